@@ -9,3 +9,4 @@ admin.site.register(m.DeliveryOffer)
 admin.site.register(m.DeliveryInfo)
 admin.site.register(m.Message)
 admin.site.register(m.Notification)
+admin.site.register(m.OutboxEvent)
@@ -0,0 +1,77 @@
+import hashlib
+from calendar import timegm
+
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+# Bumped whenever the serialized fields change, so clients drop cached copies.
+API_VERSION = 1
+
+# Compact output names of the columns fetched, nothing else is loaded.
+OFFER_LIST_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'wage': 'wage',
+    'distance': 'distance',
+    'owner': 'owner__username',
+    'city_from': 'delivery_info__city_from',
+    'city_to': 'delivery_info__city_to',
+    'bid_count': 'bid_count',
+    'min_bid': 'min_bid',
+    'date_added': 'date_added',
+    'updated_at': 'updated_at',
+}
+OFFER_DETAIL_FIELDS = {
+    **OFFER_LIST_FIELDS,
+    'description': 'description',
+    'is_active': 'is_active',
+    'contractor': 'contractor__username',
+    'final_bid': 'final_bid',
+    'max_bid': 'max_bid',
+    'last_bid_at': 'last_bid_at',
+    'street_from': 'delivery_info__street_from',
+    'street_from_number': 'delivery_info__street_from_number',
+    'street_to': 'delivery_info__street_to',
+    'street_to_number': 'delivery_info__street_to_number',
+    'extras': 'delivery_info__extras',
+}
+BID_FIELDS = {
+    'id': 'id',
+    'owner': 'owner__username',
+    'value': 'value',
+    'date_added': 'date_added',
+}
+
+
+def serialize(queryset, fields):
+    """Rows of queryset as dicts of fields output names, fetched with values_list()."""
+    names = list(fields)
+    return [dict(zip(names, row)) for row in queryset.values_list(*fields.values())]
+
+
+def compute_etag(*parts):
+    """Strong ETag of the given version parts."""
+    digest = hashlib.sha1(repr((API_VERSION, *parts)).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def not_modified(request, etag, last_modified=None):
+    """304 (or 412) response when the client copy is current, otherwise None."""
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        _set_validators(response, etag, last_modified)
+    return response
+
+
+def json_response(data, etag, last_modified=None):
+    response = JsonResponse(data)
+    _set_validators(response, etag, last_modified)
+    return response
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'MyApp'
+
+    def ready(self):
+        from MyApp import signals
+
+        post_migrate.connect(signals.create_search_indexes, sender=self)
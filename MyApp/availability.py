@@ -0,0 +1,128 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
+
+from MyApp import models as m
+
+# User columns checked case-insensitively, both have a Lower() index.
+FIELDS = ('username', 'email')
+BLOOM_ERROR_RATE = 0.01
+
+_filter = None
+_filter_built_at = 0
+_filter_lock = threading.Lock()
+# Held while the filter is built, reentrant for get_filter.
+_rebuild_lock = threading.RLock()
+
+
+class BloomFilter:
+    """
+    Set of strings answering "maybe present" or "definitely absent".
+
+    Sized for capacity items at error_rate false positives, in
+    -capacity * ln(error_rate) / ln(2)^2 bits.
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing, k positions out of one 128 bit digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def normalize(value):
+    return (value or '').strip().lower()
+
+
+def _key(field, value):
+    return f'{field}:{normalize(value)}'
+
+
+def rebuild():
+    """
+    Load every taken username and email into a new filter, with room to grow
+    twice. Rows are streamed, only the filter is kept in memory.
+    """
+    global _filter, _filter_built_at
+    with _rebuild_lock:
+        bloom = BloomFilter(2 * len(FIELDS) * m.User.objects.count())
+        for row in m.User.objects.values_list(*FIELDS).iterator():
+            for field, value in zip(FIELDS, row):
+                if value:
+                    bloom.add(_key(field, value))
+        with _filter_lock:
+            _filter, _filter_built_at = bloom, time.monotonic()
+    return bloom
+
+
+def get_filter():
+    """
+    The process wide filter, rebuilt after AVAILABILITY_FILTER_MAX_AGE seconds.
+
+    Users saved by this process are added right away, those registered by
+    other processes only show up after the next rebuild. A single thread
+    rebuilds an expired filter, the others keep using it meanwhile.
+    """
+    with _filter_lock:
+        bloom = _filter
+        if bloom is not None and time.monotonic() - _filter_built_at < settings.AVAILABILITY_FILTER_MAX_AGE:
+            return bloom
+
+    if bloom is None:
+        # Nothing to answer from yet, wait for the first build.
+        with _rebuild_lock:
+            if _filter is not None:
+                return _filter
+            return rebuild()
+
+    if not _rebuild_lock.acquire(blocking=False):
+        return bloom
+    try:
+        return rebuild()
+    finally:
+        _rebuild_lock.release()
+
+
+def remember(user):
+    """Add a saved user to the filter, if it is loaded."""
+    with _filter_lock:
+        if _filter is not None:
+            for field in FIELDS:
+                if value := getattr(user, field):
+                    _filter.add(_key(field, value))
+
+
+def is_taken(field, value):
+    """Case-insensitive EXISTS query on the indexed Lower(field)."""
+    return m.User.objects.filter(Exact(Lower(field), Lower(Value((value or '').strip())))).exists()
+
+
+def is_available(field, value):
+    """
+    Live check for forms, the filter answers most free values without a
+    query. It can be stale by AVAILABILITY_FILTER_MAX_AGE seconds, so saving
+    the form still goes through is_taken.
+    """
+    if _key(field, value) not in get_filter():
+        return True
+    return not is_taken(field, value)
@@ -0,0 +1,186 @@
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from MyApp import models as m
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail edge lengths in px, every size is stored as WebP and JPEG.
+AVATAR_SIZES = (40, 128, 256)
+AVATAR_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+# Larger images are refused before they are decoded.
+AVATAR_MAX_PIXELS = 40_000_000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class InvalidAvatar(Exception):
+    pass
+
+
+def content_hash(uploaded_file):
+    """sha256 of an uploaded file, read chunk by chunk."""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def variant_name(avatar_hash, size, extension):
+    return f'avatars/{avatar_hash[:2]}/{avatar_hash}/{size}.{extension}'
+
+
+def pending_name(avatar_hash):
+    return f'avatars/pending/{avatar_hash}'
+
+
+def variants_exist(avatar_hash):
+    # The largest JPEG is written last, see process_avatar.
+    return default_storage.exists(variant_name(avatar_hash, AVATAR_SIZES[-1], 'jpg'))
+
+
+def accept_upload(profile, uploaded_file):
+    """
+    Check an uploaded avatar and queue it for processing.
+
+    Runs on the request thread, so it only reads the image header. Uploads
+    with a content hash seen before reuse the stored variants right away.
+    """
+    if uploaded_file.size > settings.AVATAR_MAX_UPLOAD_SIZE:
+        raise InvalidAvatar('Plik jest za duży.')
+    try:
+        with Image.open(uploaded_file) as image:
+            if image.width * image.height > AVATAR_MAX_PIXELS:
+                raise InvalidAvatar('Obraz ma za dużą rozdzielczość.')
+            image.verify()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError):
+        raise InvalidAvatar('Nieprawidłowy plik obrazu.')
+
+    avatar_hash = content_hash(uploaded_file)
+    profile.avatar_hash = avatar_hash
+    if variants_exist(avatar_hash):
+        profile.avatar_ready = True
+        profile.avatar.name = variant_name(avatar_hash, AVATAR_SIZES[-1], 'jpg')
+        profile.save()
+        return
+
+    if not default_storage.exists(pending_name(avatar_hash)):
+        uploaded_file.seek(0)
+        default_storage.save(pending_name(avatar_hash), uploaded_file)
+    profile.avatar_ready = False
+    profile.save()
+    transaction.on_commit(lambda: schedule(profile.pk))
+
+
+def flatten(image):
+    """RGB copy of image, transparent areas painted white."""
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variant(image, size, image_format):
+    """Square thumbnail of an RGB image, encoded without EXIF or any other metadata."""
+    thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        thumbnail.save(buffer, image_format, quality=85, optimize=True, progressive=True)
+    else:
+        thumbnail.save(buffer, image_format, quality=80, method=6)
+    return buffer.getvalue()
+
+
+def process_avatar(profile):
+    """Write the variants of a pending avatar, safe to run more than once."""
+    avatar_hash = profile.avatar_hash
+    if not variants_exist(avatar_hash):
+        with default_storage.open(pending_name(avatar_hash)) as file:
+            with Image.open(file) as image:
+                # Apply the EXIF orientation before the metadata is dropped.
+                image = flatten(ImageOps.exif_transpose(image))
+
+        for size in AVATAR_SIZES:
+            for extension, image_format in AVATAR_FORMATS.items():
+                name = variant_name(avatar_hash, size, extension)
+                if not default_storage.exists(name):
+                    default_storage.save(name, ContentFile(render_variant(image, size, image_format)))
+
+    # Another upload may have replaced the avatar meanwhile.
+    m.UserProfile.objects.filter(pk=profile.pk, avatar_hash=avatar_hash).update(
+        avatar_ready=True, avatar=variant_name(avatar_hash, AVATAR_SIZES[-1], 'jpg'),
+    )
+    if default_storage.exists(pending_name(avatar_hash)):
+        default_storage.delete(pending_name(avatar_hash))
+
+
+def process_pending(profile_ids=None):
+    """Process avatars of profile_ids (all pending ones by default), return their number."""
+    profiles = m.UserProfile.objects.filter(avatar_ready=False).exclude(avatar_hash='')
+    if profile_ids is not None:
+        profiles = profiles.filter(pk__in=profile_ids)
+
+    processed = 0
+    for profile in profiles.iterator():
+        try:
+            process_avatar(profile)
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            # verify() lets truncated files through, they only fail to decode here.
+            logger.exception('Avatar %s of profile %s can not be processed.', profile.avatar_hash, profile.pk)
+            discard_upload(profile)
+            continue
+        processed += 1
+    return processed
+
+
+def discard_upload(profile):
+    """Drop a broken pending avatar, the profile keeps showing the previous one."""
+    m.UserProfile.objects.filter(pk=profile.pk, avatar_hash=profile.avatar_hash).update(avatar_hash='')
+    if default_storage.exists(pending_name(profile.avatar_hash)):
+        default_storage.delete(pending_name(profile.avatar_hash))
+
+
+def _process_in_background(profile_id):
+    try:
+        process_pending([profile_id])
+    finally:
+        # Pool threads open their own connections, do not leak them.
+        connections.close_all()
+
+
+def schedule(profile_id):
+    """Process an avatar on the background thread pool, off the request thread."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.AVATAR_WORKERS,
+                                           thread_name_prefix='avatars')
+    _executor.submit(_process_in_background, profile_id)
+
+
+def avatar_urls(profile, size):
+    """
+    {'webp': url, 'jpg': url} of the smallest variant at least size px wide.
+
+    Until a new upload is processed there is no WebP URL and the JPEG one
+    points to the avatar field, the previous avatar or the default picture.
+    """
+    if profile is None or not profile.avatar_ready:
+        return {'webp': None, 'jpg': profile.avatar.url if profile and profile.avatar else None}
+    variant_size = next((variant for variant in AVATAR_SIZES if variant >= size), AVATAR_SIZES[-1])
+    return {
+        extension: default_storage.url(variant_name(profile.avatar_hash, variant_size, extension))
+        for extension in AVATAR_FORMATS
+    }
@@ -0,0 +1,61 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from MyApp import fragment_cache
+from MyApp import models as m
+
+
+def place_bid(delivery_offer_id, owner, value):
+    """Place a bid of owner on an offer, return it or None if the offer is closed or gone."""
+    user_bids = place_bids([m.UserBid(owner=owner, value=value, delivery_offer_id=delivery_offer_id)])
+    return user_bids[0] if user_bids else None
+
+
+def place_bids(user_bids):
+    """
+    Save unsaved UserBid objects in one transaction, return the saved ones.
+
+    Every offer gets one conditional UPDATE of its bid aggregates, which
+    also refuses bids on offers closed meanwhile (see DeliveryOffer.accept_bid),
+    then the bids and their outbox events are inserted with one bulk_create
+    each. Nothing is loaded, the delivery offers are only referenced by id.
+    """
+    value_field = m.UserBid._meta.get_field('value')
+    by_offer = defaultdict(list)
+    now = timezone.now()
+    for user_bid in user_bids:
+        user_bid.value = value_field.to_python(user_bid.value)
+        # Stored as is, so last_bid_at matches Max(date_added).
+        user_bid.date_added = now
+        by_offer[user_bid.delivery_offer_id].append(user_bid)
+
+    placed = []
+    with transaction.atomic():
+        # Offers locked in the same order by every batch, concurrent batches can not deadlock.
+        for delivery_offer_id in sorted(by_offer):
+            offer_bids = by_offer[delivery_offer_id]
+            values = [user_bid.value for user_bid in offer_bids]
+            active = m.DeliveryOffer.objects.filter(pk=delivery_offer_id, is_active=m.DeliveryOffer.IsActive.YES)
+            if m.DeliveryOffer.add_bid_aggregates(active, len(offer_bids), min(values), max(values), now):
+                placed.extend(offer_bids)
+        if not placed:
+            return []
+
+        m.UserBid.objects.bulk_create(placed)
+        # Notifications are fanned out by the process_outbox worker.
+        m.OutboxEvent.objects.bulk_create(
+            m.OutboxEvent(
+                kind=m.OutboxEvent.Kind.BID_PLACED,
+                payload={
+                    'delivery_offer_id': user_bid.delivery_offer_id,
+                    'bidder_id': user_bid.owner_id,
+                    'value': str(user_bid.value),
+                }
+            )
+            for user_bid in placed
+        )
+        for delivery_offer_id in {user_bid.delivery_offer_id for user_bid in placed}:
+            fragment_cache.bump_offer(delivery_offer_id)
+    return placed
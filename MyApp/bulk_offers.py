@@ -0,0 +1,185 @@
+import csv
+import json
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+from MyApp import models as m
+from MyApp import search
+import MyApp.validators.delivery_offer_validator as dov
+
+# Columns read by import and written by export, in this order.
+OFFER_FIELDS = [
+    'name', 'description', 'wage', 'distance',
+    'city_from', 'street_from', 'street_from_number',
+    'city_to', 'street_to', 'street_to_number',
+    'extras',
+]
+EXPORT_FIELDS = ['id', 'date_added', 'is_active', *OFFER_FIELDS]
+FORMATS = ('csv', 'jsonl')
+
+# Rows inserted with one bulk_create / fetched with one export query.
+IMPORT_CHUNK_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, line, errors):
+        self.errors.append({'line': line, 'errors': errors})
+
+
+def read_rows(lines, format):
+    """
+    Yield (line number, row dict or None) from an iterable of text lines.
+
+    Rows which can not be parsed at all are yielded as None, so they end up
+    in the error report instead of stopping the import.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def validate_row(row):
+    """DeliveryOfferValidator rules, plus column lengths the form does not check."""
+    values = {name: str(row.get(name) if row.get(name) is not None else '').strip() for name in OFFER_FIELDS}
+    errors = dov.DeliveryOfferValidator.validate({name: [value] for name, value in values.items()})
+
+    for model in (m.DeliveryOffer, m.DeliveryInfo):
+        for model_field in model._meta.concrete_fields:
+            if model_field.name not in values:
+                continue
+            max_length = model_field.max_length
+            if max_length and len(values[model_field.name]) > max_length:
+                errors.append(f'Pole {model_field.name} może mieć najwyżej {max_length} znaków.')
+            elif not errors and isinstance(model_field, (models.DecimalField, models.IntegerField)):
+                # NaN, infinity and integers out of the column range pass the form rules.
+                try:
+                    model_field.clean(values[model_field.name], None)
+                except ValidationError:
+                    errors.append(f'Pole {model_field.name} ma niepoprawną wartość.')
+    return values, errors
+
+
+def import_offers(rows, owner, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Create offers of owner from (line number, row) pairs, see read_rows.
+
+    Valid rows are inserted in chunks, each chunk with two bulk_create
+    queries of paired DeliveryInfo / DeliveryOffer rows in one transaction.
+    Invalid rows are skipped and reported by line number.
+    """
+    result = ImportResult()
+    chunk = []
+    for line, row in rows:
+        if row is None:
+            result.add_error(line, ['Nieprawidłowy format wiersza.'])
+            continue
+
+        values, errors = validate_row(row)
+        if errors:
+            result.add_error(line, errors)
+            continue
+
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            result.created += _create_chunk(chunk, owner)
+            chunk = []
+
+    if chunk:
+        result.created += _create_chunk(chunk, owner)
+    return result
+
+
+def _create_chunk(chunk, owner):
+    delivery_infos = []
+    for values in chunk:
+        delivery_info = m.DeliveryInfo(
+            city_from=values['city_from'],
+            street_from=values['street_from'],
+            street_from_number=int(values['street_from_number']),
+            city_to=values['city_to'],
+            street_to=values['street_to'],
+            street_to_number=int(values['street_to_number']),
+            extras=values['extras'],
+        )
+        delivery_info.update_location()
+        delivery_infos.append(delivery_info)
+
+    with transaction.atomic():
+        m.DeliveryInfo.objects.bulk_create(delivery_infos)
+
+        delivery_offers = []
+        for values, delivery_info in zip(chunk, delivery_infos):
+            delivery_offer = m.DeliveryOffer(
+                name=values['name'],
+                description=values['description'],
+                wage=values['wage'],
+                distance=values['distance'],
+                owner=owner,
+                delivery_info=delivery_info,
+            )
+            delivery_offer.search_document = search.build_search_document(delivery_offer)
+            delivery_offers.append(delivery_offer)
+        m.DeliveryOffer.objects.bulk_create(delivery_offers)
+
+    # bulk_create skips the post_save signal keeping the search index in sync.
+    backend = search.get_search_backend()
+    for delivery_offer in delivery_offers:
+        backend.index_offer(delivery_offer)
+    search.invalidate_results()
+    return len(delivery_offers)
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield queryset offers as CSV or JSONL lines, fetching chunk_size rows at a time."""
+    writer = csv.writer(_Echo()) if format == 'csv' else None
+    if writer:
+        yield writer.writerow(EXPORT_FIELDS)
+
+    delivery_offers = queryset.select_related('delivery_info').order_by('pk')
+    for delivery_offer in delivery_offers.iterator(chunk_size=chunk_size):
+        delivery_info = delivery_offer.delivery_info
+        values = [
+            delivery_offer.pk,
+            delivery_offer.date_added.isoformat(),
+            delivery_offer.is_active,
+            delivery_offer.name,
+            delivery_offer.description or '',
+            str(delivery_offer.wage),
+            str(delivery_offer.distance),
+            delivery_info.city_from,
+            delivery_info.street_from,
+            delivery_info.street_from_number,
+            delivery_info.city_to,
+            delivery_info.street_to,
+            delivery_info.street_to_number,
+            delivery_info.extras,
+        ]
+        if writer:
+            yield writer.writerow(values)
+        else:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, values)), ensure_ascii=False) + '\n'
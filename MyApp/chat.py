@@ -0,0 +1,234 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from MyApp import models as m
+from MyApp.pagination import KeysetPaginator
+
+# Upper bound of messages sent in one push or API response.
+CHAT_BATCH_SIZE = 100
+
+
+class ChatBroker:
+    """
+    Wakes up chat waiters of this process when a message is created.
+
+    Messages created by other processes are picked up by polling every
+    CHAT_POLL_INTERVAL seconds, so the broker only makes delivery faster.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+
+    def subscribe(self, delivery_offer_id):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters[delivery_offer_id].add(waiter)
+        return waiter
+
+    def unsubscribe(self, delivery_offer_id, waiter):
+        with self._lock:
+            waiters = self._waiters.get(delivery_offer_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[delivery_offer_id]
+
+    def publish(self, delivery_offer_id):
+        """Thread safe, called from sync views after the message is committed."""
+        with self._lock:
+            waiters = list(self._waiters.get(delivery_offer_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+broker = ChatBroker()
+
+
+def close_old_connections():
+    """Like django.db.close_old_connections, but never inside a transaction."""
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def database_sync_to_async(func):
+    """sync_to_async for ORM code run outside of the request cycle."""
+
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(inner)
+
+
+def get_chat_offer(user, delivery_id):
+    """Return the offer if user is one of both chat parties, otherwise None."""
+    if not user.is_authenticated:
+        return None
+    delivery_offer = m.DeliveryOffer.objects.filter(pk=delivery_id).first()
+    # Without a contractor there is nobody to write to.
+    if (not delivery_offer or delivery_offer.contractor_id is None
+            or user.pk not in (delivery_offer.owner_id, delivery_offer.contractor_id)):
+        return None
+    return delivery_offer
+
+
+def serialize_message(message):
+    return {
+        'id': message.pk,
+        'content': message.content,
+        'message_from': message.message_from.username,
+        'date': message.date.isoformat(),
+    }
+
+
+def messages_after(delivery_offer_id, after_id):
+    """Messages newer than after_id, oldest first, at most CHAT_BATCH_SIZE."""
+    messages = m.Message.objects.filter(
+        delivery_offer_id=delivery_offer_id, pk__gt=after_id
+    ).select_related('message_from').order_by('pk')[:CHAT_BATCH_SIZE]
+    return [serialize_message(message) for message in messages]
+
+
+def history_page(delivery_offer_id, cursor=None):
+    """CHAT_HISTORY_PAGE_SIZE messages, newest first, older ones behind page.next_cursor."""
+    messages = m.Message.objects.filter(delivery_offer_id=delivery_offer_id).select_related('message_from')
+    return KeysetPaginator(messages, settings.CHAT_HISTORY_PAGE_SIZE, ordering=('-date', '-pk')).page(cursor)
+
+
+def send_message(delivery_offer, user, content):
+    """Create a message from user to the other chat party."""
+    message_to_id = (
+        delivery_offer.owner_id if user.pk != delivery_offer.owner_id else
+        delivery_offer.contractor_id
+    )
+    message = m.Message.objects.create(content=content,
+                                       delivery_offer=delivery_offer,
+                                       message_from=user,
+                                       message_to_id=message_to_id)
+    message.message_from = user
+    return message
+
+
+async def wait_for_messages(delivery_offer_id, after_id, timeout):
+    """
+    Return messages newer than after_id as soon as there are any.
+
+    Gives up with an empty list after timeout seconds. The database is only
+    queried when the broker signals a new message or every poll interval.
+    """
+    deadline = time.monotonic() + timeout
+    waiter = broker.subscribe(delivery_offer_id)
+    _, event = waiter
+    try:
+        while True:
+            # Clear before fetching, a publish during the fetch is not lost.
+            event.clear()
+            messages = await database_sync_to_async(messages_after)(delivery_offer_id, after_id)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                return messages
+            try:
+                await asyncio.wait_for(event.wait(), min(settings.CHAT_POLL_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        broker.unsubscribe(delivery_offer_id, waiter)
+
+
+def get_scope_user(scope):
+    """User authenticated by the session cookie of an ASGI connection."""
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin1'))
+
+    session_key = cookies[settings.SESSION_COOKIE_NAME].value if settings.SESSION_COOKIE_NAME in cookies else None
+    session_store = import_string(f'{settings.SESSION_ENGINE}.SessionStore')
+    return get_user(SimpleNamespace(session=session_store(session_key)))
+
+
+def origin_allowed(scope):
+    """Reject cross-site WebSocket connections, browsers do not apply CORS to them."""
+    headers = dict(scope.get('headers', []))
+    origin = headers.get(b'origin')
+    if origin is None:
+        return True
+    host = headers.get(b'host', b'')
+    return origin.split(b'://', 1)[-1] == host
+
+
+class ChatWebSocketApp:
+    """
+    ASGI application pushing new messages of a DeliveryOffer chat.
+
+    Connect to /ws/chat/<delivery_id>/?after=<last message id>. The server
+    sends {"messages": [...]} whenever there are messages newer than the
+    last one sent, the client sends {"content": "..."} to write a message.
+    """
+
+    path_re = re.compile(r'^/ws/chat/(?P<delivery_id>\d+)/$')
+
+    async def __call__(self, scope, receive, send):
+        match = self.path_re.match(scope['path'])
+        event = await receive()
+        if event['type'] != 'websocket.connect':
+            return
+
+        user = await database_sync_to_async(get_scope_user)(scope)
+        delivery_offer = None
+        if match and origin_allowed(scope):
+            delivery_offer = await database_sync_to_async(get_chat_offer)(user, match['delivery_id'])
+        if not delivery_offer:
+            await send({'type': 'websocket.close', 'code': 4403})
+            return
+
+        query = parse_qs(scope.get('query_string', b'').decode())
+        try:
+            after_id = int(query.get('after', ['0'])[0] or 0)
+        except ValueError:
+            after_id = 0
+        await send({'type': 'websocket.accept'})
+
+        pusher = asyncio.ensure_future(self.push_messages(send, delivery_offer.pk, after_id))
+        try:
+            while True:
+                event = await receive()
+                if event['type'] == 'websocket.disconnect':
+                    break
+                if event['type'] == 'websocket.receive':
+                    await self.receive_message(event, delivery_offer, user)
+        finally:
+            pusher.cancel()
+
+    async def push_messages(self, send, delivery_offer_id, after_id):
+        while True:
+            messages = await wait_for_messages(delivery_offer_id, after_id, settings.CHAT_LONG_POLL_TIMEOUT)
+            if messages:
+                after_id = messages[-1]['id']
+                await send({'type': 'websocket.send', 'text': json.dumps({'messages': messages})})
+
+    async def receive_message(self, event, delivery_offer, user):
+        try:
+            content = json.loads(event.get('text') or '{}').get('content', '').strip()
+        except (ValueError, AttributeError):
+            return
+        if content:
+            await database_sync_to_async(send_message)(delivery_offer, user, content)
@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import functools
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set by replica_reads for the duration of a view.
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+# Set when the request wrote to the primary or came with the pin cookie.
+_pinned = contextvars.ContextVar('pinned_to_primary', default=False)
+_wrote = contextvars.ContextVar('wrote_to_primary', default=False)
+
+PIN_COOKIE = 'pin_primary'
+# Sessions are read on every request, a login has to be visible on the next one.
+PRIMARY_ONLY_APPS = {'sessions'}
+
+
+def get_replicas():
+    """Configured replica aliases, see DATABASE_REPLICAS setting."""
+    return [alias for alias in getattr(settings, 'DATABASE_REPLICAS', []) if alias in connections]
+
+
+def pin_to_primary():
+    """Send the rest of this request's reads to the primary."""
+    _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def replica_reads(func):
+    """
+    Let reads of the decorated view (or method) go to a replica.
+
+    Reads everywhere else, and after the view wrote anything or when the
+    request is pinned (see PrimaryPinningMiddleware), use the primary.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """Route reads of replica_reads views to a random replica, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or _pinned.get() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        # Reads inside a transaction must see its own writes.
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = get_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        aliases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication.
+        return db not in get_replicas()
+
+
+class PrimaryPinningMiddleware:
+    """
+    Read your own writes: after a POST (or any request which wrote to the
+    database) the client is pinned to the primary for REPLICA_PIN_SECONDS,
+    so the redirect that follows never reads a lagging replica.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django await the middleware, see MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        tokens = self.start(request)
+        try:
+            response = self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            self.finish(tokens)
+        return self.pin(request, response, wrote)
+
+    async def __acall__(self, request):
+        tokens = self.start(request)
+        try:
+            response = await self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            self.finish(tokens)
+        return self.pin(request, response, wrote)
+
+    @staticmethod
+    def start(request):
+        return _pinned.set(PIN_COOKIE in request.COOKIES), _wrote.set(False)
+
+    @staticmethod
+    def finish(tokens):
+        pinned_token, wrote_token = tokens
+        _pinned.reset(pinned_token)
+        _wrote.reset(wrote_token)
+
+    @staticmethod
+    def pin(request, response, wrote):
+        if wrote or request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def check_connections(**kwargs):
+    """
+    Close persistent connections that went away (database restart, idle
+    timeout) before the request uses them, like CONN_HEALTH_CHECKS of
+    Django 4.1. Costs one ping per open connection and request.
+    """
+    for connection in connections.all():
+        if (connection.connection is not None and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.in_atomic_block and not connection.is_usable()):
+            connection.close()
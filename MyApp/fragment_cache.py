@@ -0,0 +1,58 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'MyApp:fragments:generation'
+OFFER_VERSION_KEY = 'MyApp:fragments:offer:{}'
+
+
+def _new_version():
+    # Versions start from the clock, so a counter lost to cache eviction
+    # never comes back with a value some cached fragment is keyed on.
+    return time.time_ns() // 1000
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_version(), timeout=None)
+
+
+def _bump(key):
+    _incr(key)
+    # Bump again once the change is visible to other connections, fragments
+    # rendered from the old rows by concurrent requests meanwhile are dropped.
+    transaction.on_commit(lambda: _incr(key))
+
+
+def bump_offer(offer_id):
+    """Invalidate cached fragments of a single offer."""
+    _bump(OFFER_VERSION_KEY.format(offer_id))
+
+
+def bump_listing():
+    """Invalidate every cached offer fragment, used after bulk updates."""
+    _bump(GENERATION_KEY)
+
+
+def with_versions(offers):
+    """
+    Set fragment_version on every offer, used in the {% cache %} tag key.
+
+    The version is made of the listing generation and the offer version,
+    all of them read from the cache in a single get_many.
+    """
+    offers = list(offers)
+    keys = [GENERATION_KEY] + [OFFER_VERSION_KEY.format(offer.pk) for offer in offers]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+
+    generation = versions[GENERATION_KEY]
+    for offer in offers:
+        offer.fragment_version = f'{generation}.{versions[OFFER_VERSION_KEY.format(offer.pk)]}'
+    return offers
@@ -0,0 +1,162 @@
+import csv
+import functools
+import math
+import re
+from pathlib import Path
+
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+from MyApp.search import normalize
+
+EARTH_RADIUS_KM = 6371.0088
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Stored geohash length, about 38 x 19 m.
+GEOHASH_PRECISION = 8
+# Upper bound of geohash cells a radius query is split into.
+MAX_QUERY_CELLS = 16
+
+# "x=54.234523, y=23.53424" or "54.234523, 23.53424", x being the latitude.
+# Both numbers need a decimal part, so "2, 3 piętro" is not a location.
+COORDINATES_RE = re.compile(
+    r'(?:x\s*=\s*)?(-?\d{1,2}\.\d+)\s*[,;]\s*(?:y\s*=\s*)?(-?\d{1,3}\.\d+)'
+)
+
+
+@functools.lru_cache(maxsize=None)
+def gazetteer():
+    """{normalized city name: (lat, lon)}, read once from GAZETTEER_PATH."""
+    with open(GAZETTEER_PATH, encoding='utf-8', newline='') as file:
+        return {normalize(row['name']): (float(row['lat']), float(row['lon'])) for row in csv.DictReader(file)}
+
+
+def parse_coordinates(text):
+    match = COORDINATES_RE.search(text or '')
+    if not match:
+        return None
+    lat, lon = float(match[1]), float(match[2])
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def resolve_place(text):
+    """(lat, lon) of "lat, lon" coordinates or a gazetteer city name, otherwise None."""
+    return parse_coordinates(text) or gazetteer().get(normalize(text))
+
+
+def locate(city, extras=''):
+    """(lat, lon, geohash) of an address, coordinates in extras win over the city."""
+    location = parse_coordinates(extras) or gazetteer().get(normalize(city))
+    if not location:
+        return None, None, ''
+    return location[0], location[1], geohash(*location)
+
+
+def geohash(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value_range, value = (lon_range, lon) if even else (lat_range, lat)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            value_range[0] = middle
+        else:
+            bits = bits * 2
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(lat, lon) size in degrees of a geohash cell."""
+    bits = 5 * precision
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def bounding_box(lat, lon, radius_km):
+    """(south, north, west, east) around a circle, clamped at the poles and the antimeridian."""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    lon_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 0.01)))
+    return (max(lat - lat_delta, -90.0), min(lat + lat_delta, 90.0),
+            max(lon - lon_delta, -180.0), min(lon + lon_delta, 180.0))
+
+
+def covering_cells(lat, lon, radius_km):
+    """
+    Geohash prefixes covering the bounding box of a circle.
+
+    Uses the longest prefix that keeps the box within MAX_QUERY_CELLS cells,
+    so a query is a handful of index range scans for any radius.
+    """
+    south, north, west, east = bounding_box(lat, lon, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lon_step = cell_size(precision)
+        rows = range(math.floor(south / lat_step), math.floor(north / lat_step) + 1)
+        columns = range(math.floor(west / lon_step), math.floor(east / lon_step) + 1)
+        if len(rows) * len(columns) <= MAX_QUERY_CELLS:
+            break
+    return sorted({
+        geohash(min((row + 0.5) * lat_step, 90.0), min((column + 0.5) * lon_step, 180.0), precision)
+        for row in rows for column in columns
+    })
+
+
+def _prefix_end(prefix):
+    """Smallest geohash greater than every geohash starting with prefix, None if there is none."""
+    while prefix and prefix[-1] == GEOHASH_ALPHABET[-1]:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine(lat_field, lon_field, lat, lon):
+    """Great-circle distance in km from (lat, lon) to the fields, computed by the database."""
+    lat0, lon0 = math.radians(lat), math.radians(lon)
+    lat1, lon1 = Radians(lat_field), Radians(lon_field)
+    a = (
+        Power(Sin((lat1 - Value(lat0)) * Value(0.5)), 2)
+        + Value(math.cos(lat0)) * Cos(lat1) * Power(Sin((lon1 - Value(lon0)) * Value(0.5)), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a), output_field=FloatField())
+
+
+def within(queryset, lat, lon, radius_km, prefix='delivery_info__', end='from'):
+    """
+    Narrow queryset down to rows whose end ('from' or 'to') location lies
+    within radius_km of (lat, lon), annotated with distance_km.
+
+    Geohash prefix ranges and the bounding box use the indexes, the exact
+    haversine distance is computed only for the rows left.
+    """
+    lat_field, lon_field, geohash_field = (f'{prefix}{name}_{end}' for name in ('lat', 'lon', 'geohash'))
+
+    cells = Q()
+    for cell in covering_cells(lat, lon, radius_km):
+        cell_range = Q(**{f'{geohash_field}__gte': cell})
+        if cell_end := _prefix_end(cell):
+            cell_range &= Q(**{f'{geohash_field}__lt': cell_end})
+        cells |= cell_range
+
+    south, north, west, east = bounding_box(lat, lon, radius_km)
+    return queryset.filter(
+        cells,
+        **{f'{lat_field}__range': (south, north), f'{lon_field}__range': (west, east)},
+    ).annotate(
+        distance_km=haversine(lat_field, lon_field, lat, lon)
+    ).filter(distance_km__lte=radius_km)
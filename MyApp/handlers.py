@@ -0,0 +1,40 @@
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+# Parts of a streaming response produced per hop to the sync thread.
+STREAMING_BATCH_SIZE = 100
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    ASGIHandler producing streaming responses outside of the event loop.
+
+    Django 4.0 iterates streaming content on the event loop, where a
+    generator running ORM queries (see bulk_offers.export_rows) raises
+    SynchronousOnlyOperation. Parts are produced in batches by the thread
+    running sync views instead.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else bytes(header),
+             value.encode('latin1') if isinstance(value, str) else bytes(value))
+            for header, value in response.items()
+        ]
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        parts = iter(response)
+        next_batch = sync_to_async(lambda: list(itertools.islice(parts, STREAMING_BATCH_SIZE)))
+        while batch := await next_batch():
+            for part in batch:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
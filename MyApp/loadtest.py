@@ -0,0 +1,249 @@
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from http.client import HTTPException
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.urls import Resolver404, resolve
+
+from MyApp import seeding
+
+CSRF_TOKEN_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+OFFER_LINK_RE = re.compile(r'href="(/dashboard/delivery-detail/(\d+)/)"')
+OWNER_RE = re.compile(r'<h3>Użytkownik</h3>\s*<span>([^<]+)</span>')
+BID_USERNAME_RE = re.compile(r'<span>Uzytkownik</span>\s*</div>\s*<span>([^<]+)</span>')
+ACCEPT_BUTTON_RE = re.compile(r'name="final_bid" value="(\d+)"')
+
+# Passes the AUTH_PASSWORD_VALIDATORS of the project.
+PASSWORD = 'Obciazenie-2022!'
+REQUEST_TIMEOUT = 30
+
+
+class JourneyFailed(Exception):
+    pass
+
+
+@dataclass
+class Response:
+    status: int
+    url: str
+    body: str = ''
+    location: str = ''
+
+
+@dataclass
+class RouteStats:
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+
+    def percentile(self, percent):
+        """Nearest rank percentile of the latencies, in seconds."""
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0
+        return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+class Stats:
+    """Latencies and errors per route of one concurrency level, shared by the virtual users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = defaultdict(RouteStats)
+        self.journeys = 0
+        self.failures = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, route, seconds, error):
+        with self._lock:
+            route_stats = self.routes[route]
+            route_stats.latencies.append(seconds)
+            route_stats.errors += error
+
+    def journey_done(self, failure=None):
+        with self._lock:
+            self.journeys += 1
+            if failure:
+                self.failures[failure] += 1
+
+    def report(self):
+        """{route: {requests, errors, error_rate, per_second, p50_ms, p95_ms, p99_ms}}."""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            route: {
+                'requests': len(route_stats.latencies),
+                'errors': route_stats.errors,
+                'error_rate': route_stats.errors / len(route_stats.latencies),
+                'per_second': len(route_stats.latencies) / elapsed,
+                **{f'p{percent}_ms': route_stats.percentile(percent) * 1000 for percent in (50, 95, 99)},
+            }
+            for route, route_stats in sorted(self.routes.items())
+        }
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    # Redirects are followed by Session.request, so every hop is timed as its own route.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def route_name(method, url):
+    """'METHOD url name' of a project URL, the path if it does not resolve."""
+    path = urlsplit(url).path
+    try:
+        name = resolve(path).url_name or path
+    except Resolver404:
+        name = path
+    return f'{method} {name}'
+
+
+class Session:
+    """A browser of one virtual user: cookie jar, CSRF token of the last form, timed requests."""
+
+    def __init__(self, base_url, stats):
+        self.base_url = base_url
+        self.stats = stats
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def request(self, method, path, data=None, expect=(200,), follow=True):
+        """
+        Send a request and follow its redirects like a browser. The last
+        response must have one of the expect statuses, else JourneyFailed.
+        """
+        url = urljoin(self.base_url, path)
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data).encode()
+            # Like a browser submitting a form of this site.
+            headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                       'Origin': self.base_url.rstrip('/'), 'Referer': url}
+
+        route = route_name(method, url)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(Request(url, data=body, headers=headers, method=method),
+                                  timeout=REQUEST_TIMEOUT) as raw:
+                response = Response(raw.status, url, raw.read().decode())
+        except HTTPError as error:
+            response = Response(error.code, url, error.read().decode(errors='replace'),
+                                error.headers.get('Location', ''))
+        except (URLError, OSError, HTTPException):
+            # Refused, reset or cut short (IncompleteRead) under load.
+            response = Response(0, url)
+        seconds = time.perf_counter() - started
+
+        redirected = 300 <= response.status < 400 and response.location
+        failed = response.status == 0 or response.status >= 400 or (
+            not redirected and response.status not in expect)
+        self.stats.record(route, seconds, failed)
+        if redirected and follow:
+            return self.request('GET', response.location, expect=expect)
+        if response.status not in expect:
+            raise JourneyFailed(f'{route} {response.status}')
+        return response
+
+    def submit(self, page, path, data, **kwargs):
+        """POST a form of page, with the CSRF token the template rendered."""
+        token = CSRF_TOKEN_RE.search(page.body)
+        if not token:
+            raise JourneyFailed(f'{route_name("GET", page.url)} without CSRF token')
+        return self.request('POST', path, {'csrfmiddlewaretoken': token[1], **data}, **kwargs)
+
+    def login(self, username, password):
+        page = self.request('GET', '/login/')
+        response = self.submit(page, '/login/', {'username': username, 'password': password})
+        if urlsplit(response.url).path == '/login/':
+            raise JourneyFailed(f'login of {username} refused')
+        return response
+
+
+def journey(base_url, stats, rng, search_terms, owner_password):
+    """
+    register → login → search → open offer → bid → owner accepts → chat,
+    one new user per journey. Raises JourneyFailed at the first step that
+    does not go as in a browser.
+    """
+    bidder = Session(base_url, stats)
+    username = f'load{uuid.uuid4().hex[:12]}'
+    page = bidder.request('GET', '/register/')
+    bidder.submit(page, '/register/', {'email': f'{username}@boxme.pl', 'username': username,
+                                       'password': PASSWORD, 'password2': PASSWORD})
+    bidder.request('GET', '/logout/')
+    bidder.login(username, PASSWORD)
+
+    page = bidder.request('GET', '/dashboard/?' + urlencode({'search': rng.choice(search_terms)}))
+    offers = sorted(set(OFFER_LINK_RE.findall(page.body)))
+    if not offers:
+        raise JourneyFailed('search without results')
+    offer_path, offer_id = rng.choice(offers)
+
+    page = bidder.request('GET', offer_path)
+    owner_username = OWNER_RE.search(page.body)
+    if not owner_username:
+        raise JourneyFailed('offer without owner')
+    bidder.submit(page, offer_path, {'bid': f'{rng.randint(1000, 50000) / 100:.2f}'})
+
+    owner = Session(base_url, stats)
+    owner.login(owner_username[1].strip(), owner_password)
+    page = owner.request('GET', offer_path)
+    bid_ids = [ACCEPT_BUTTON_RE.search(proposal) for proposal in page.body.split('class="user-proposal"')[1:]
+               if (match := BID_USERNAME_RE.search(proposal)) and match[1].strip() == username]
+    if not bid_ids or not bid_ids[-1]:
+        raise JourneyFailed('bid missing, offer closed meanwhile')
+    owner.submit(page, offer_path, {'final_bid': bid_ids[-1][1]})
+
+    contact_path = f'/dashboard/user/delivery-offers/{offer_id}/contact/'
+    messages_path = f'/dashboard/user/delivery-offers/{offer_id}/messages/'
+    page = bidder.request('GET', contact_path)
+    # The chat form is posted by the page script to the messages API.
+    bidder.submit(page, messages_path, {'content': 'Dzień dobry, kiedy odbiór?'}, expect=(201,))
+    page = owner.request('GET', contact_path)
+    owner.request('GET', f'{messages_path}?after=0')
+    owner.submit(page, messages_path, {'content': 'Jutro rano.'}, expect=(201,))
+
+
+def run_level(base_url, users, duration=None, journeys=None, search_terms=None, owner_password=None,
+              seed=0, ramp_up=0):
+    """
+    Run users virtual users in parallel, each repeating journeys until
+    duration seconds passed or it made journeys journeys. Returns the Stats.
+    """
+    search_terms = search_terms or seeding.GOODS
+    owner_password = owner_password or seeding.SeedConfig.password
+    stats = Stats()
+    deadline = time.perf_counter() + duration if duration else math.inf
+
+    def virtual_user(number):
+        rng = random.Random(f'{seed}:{number}')
+        # Users start spread over the ramp up, not all at once.
+        time.sleep(ramp_up * number / users)
+        done = 0
+        while time.perf_counter() < deadline and (journeys is None or done < journeys):
+            try:
+                journey(base_url, stats, rng, search_terms, owner_password)
+                stats.journey_done()
+            except JourneyFailed as failure:
+                stats.journey_done(str(failure))
+            except Exception as error:
+                # Anything else would end this user without a trace in the report.
+                stats.journey_done(f'unexpected {type(error).__name__}')
+            done += 1
+
+    threads = [threading.Thread(target=virtual_user, args=(number,), name=f'loadtest-{number}')
+               for number in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.finished = time.perf_counter()
+    return stats
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from MyApp import bulk_offers
+from MyApp import models as m
+
+
+class Command(BaseCommand):
+    help = 'Import delivery offers of a user from a CSV or JSONL file, streamed row by row.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', required=True, help='Username of the offers owner.')
+        parser.add_argument('--format', choices=bulk_offers.FORMATS,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=bulk_offers.IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            owner = m.User.objects.get(username=options['owner'])
+        except m.User.DoesNotExist:
+            raise CommandError(f"User {options['owner']} does not exist.")
+
+        path = options['path']
+        import_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        with open(path, encoding='utf-8', newline='') as file:
+            result = bulk_offers.import_offers(bulk_offers.read_rows(file, import_format),
+                                               owner, chunk_size=options['chunk_size'])
+
+        for error in result.errors:
+            self.stderr.write(f"Line {error['line']}: {' '.join(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.created} offers, {len(result.errors)} rows rejected.'
+        ))
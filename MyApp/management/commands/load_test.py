@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from MyApp import loadtest, seeding
+
+
+class Command(BaseCommand):
+    help = ('Replay register, login, search, bid, accept and chat journeys against a running server '
+            'and report throughput, latency percentiles and errors per route.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/')
+        parser.add_argument('--users', default='1,5,10,25',
+                            help='Comma separated concurrency levels, run one after another.')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds per concurrency level.')
+        parser.add_argument('--journeys', type=int, help='Journeys per user, instead of --duration.')
+        parser.add_argument('--ramp-up', type=float, default=0, help='Seconds over which users start.')
+        parser.add_argument('--search', action='append', help='Search terms, defaults to the seeded goods.')
+        parser.add_argument('--owner-password', default=seeding.SeedConfig.password,
+                            help='Password of offer owners, see seed_marketplace.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help='Also write the results to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(users) for users in options['users'].split(',')]
+        except ValueError:
+            raise CommandError('--users takes comma separated numbers.')
+
+        results = {}
+        for users in levels:
+            self.stdout.write(f'{users} users...')
+            stats = loadtest.run_level(
+                options['base_url'], users,
+                duration=None if options['journeys'] else options['duration'],
+                journeys=options['journeys'], search_terms=options['search'],
+                owner_password=options['owner_password'], seed=options['seed'], ramp_up=options['ramp_up'],
+            )
+            report = stats.report()
+            results[users] = {'journeys': stats.journeys, 'failures': dict(stats.failures), 'routes': report}
+            self.write_level(users, stats, report)
+
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def write_level(self, users, stats, report):
+        self.stdout.write(f'{"route":<36} {"req":>6} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} '
+                          f'{"p99 ms":>9} {"errors":>7}')
+        for route, result in report.items():
+            line = (f"{route:<36} {result['requests']:>6} {result['per_second']:>8.1f} "
+                    f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                    f"{result['error_rate']:>7.1%}")
+            self.stdout.write(self.style.ERROR(line) if result['errors'] else line)
+
+        failed = sum(stats.failures.values())
+        summary = f'{users} users: {stats.journeys} journeys, {failed} failed'
+        self.stdout.write(self.style.WARNING(summary) if failed else self.style.SUCCESS(summary))
+        for failure, count in sorted(stats.failures.items(), key=lambda item: -item[1]):
+            self.stdout.write(f'  {count} x {failure}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from MyApp import avatars
+
+
+class Command(BaseCommand):
+    help = 'Render thumbnails of uploaded avatars left unprocessed, e.g. after a restart.'
+
+    def handle(self, *args, **options):
+        processed = avatars.process_pending()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} avatars.'))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from MyApp import outbox
+
+
+class Command(BaseCommand):
+    help = 'Fan out outbox events into notifications, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the outbox is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the outbox and exit instead of polling.')
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            count = outbox.drain(options['batch_size'])
+            processed += count
+            if count:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} outbox events.'))
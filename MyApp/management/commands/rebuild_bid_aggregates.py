@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from MyApp import fragment_cache
+from MyApp import models as m
+
+
+class Command(BaseCommand):
+    help = 'Recompute DeliveryOffer bid_count, min_bid, max_bid and last_bid_at from UserBid.'
+
+    def handle(self, *args, **options):
+        updated = m.DeliveryOffer.rebuild_bid_aggregates()
+        # Offer cards show the aggregates, drop all of them.
+        fragment_cache.bump_listing()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt bid aggregates of {updated} offers.'))
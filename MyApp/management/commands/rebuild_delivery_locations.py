@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from MyApp import models as m
+
+LOCATION_FIELDS = ['lat_from', 'lon_from', 'geohash_from', 'lat_to', 'lon_to', 'geohash_to']
+
+
+class Command(BaseCommand):
+    help = 'Recompute DeliveryInfo coordinates and geohashes from extras and the gazetteer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        batch = []
+        updated = 0
+        for delivery_info in m.DeliveryInfo.objects.order_by('pk').iterator(chunk_size=batch_size):
+            delivery_info.update_location()
+            batch.append(delivery_info)
+            if len(batch) >= batch_size:
+                updated += self._flush(batch)
+
+        updated += self._flush(batch)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt locations of {updated} deliveries.'))
+
+    @staticmethod
+    def _flush(batch):
+        m.DeliveryInfo.objects.bulk_update(batch, LOCATION_FIELDS)
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from MyApp import models as m
+
+
+class Command(BaseCommand):
+    help = 'Recompute User.unread_notifications from Notification.'
+
+    def handle(self, *args, **options):
+        updated = m.User.rebuild_unread_notifications()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt unread notification counters of {updated} users.'))
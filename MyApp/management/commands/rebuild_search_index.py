@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from MyApp import models as m
+from MyApp import search
+
+
+class Command(BaseCommand):
+    help = 'Recompute DeliveryOffer.search_document for all offers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        delivery_offers = m.DeliveryOffer.objects.select_related('owner', 'delivery_info').order_by('pk')
+
+        batch = []
+        updated = 0
+        for delivery_offer in delivery_offers.iterator(chunk_size=batch_size):
+            delivery_offer.search_document = search.build_search_document(delivery_offer)
+            batch.append(delivery_offer)
+            if len(batch) >= batch_size:
+                updated += self._flush(batch)
+
+        updated += self._flush(batch)
+        search.get_search_backend().invalidate()
+        search.invalidate_results()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search documents of {updated} offers.'))
+
+    @staticmethod
+    def _flush(batch):
+        m.DeliveryOffer.objects.bulk_update(batch, ['search_document'])
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,55 @@
+import dataclasses
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from MyApp import models as m
+from MyApp import seeding
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic users, offers, bids, messages and notifications.'
+
+    def add_arguments(self, parser):
+        defaults = seeding.SeedConfig(offers=0)
+        parser.add_argument('--offers', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--seed', type=int, default=defaults.seed)
+        parser.add_argument('--bids-per-offer', type=float, default=defaults.bids_per_offer,
+                            help='Mean of the Poisson distributed number of bids.')
+        parser.add_argument('--messages-per-conversation', type=float,
+                            default=defaults.messages_per_conversation,
+                            help='Mean of the Poisson distributed number of messages between a bidder and the owner.')
+        parser.add_argument('--closed-ratio', type=float, default=defaults.closed_ratio,
+                            help='Fraction of closed offers, those with bids get a contractor.')
+        parser.add_argument('--read-ratio', type=float, default=defaults.read_ratio,
+                            help='Fraction of read notifications.')
+        parser.add_argument('--days', type=int, default=defaults.days,
+                            help='Offers are spread over this many days back.')
+        parser.add_argument('--prefix', default=defaults.prefix, help='Username prefix of the seeded users.')
+        parser.add_argument('--password', default=defaults.password)
+        parser.add_argument('--chunk-size', type=int, default=defaults.chunk_size)
+        parser.add_argument('--workers', type=int, default=defaults.workers,
+                            help='Processes inserting chunks in parallel, useful with Postgres only.')
+
+    def handle(self, *args, **options):
+        config = seeding.SeedConfig(**{
+            field.name: options[field.name] for field in dataclasses.fields(seeding.SeedConfig)
+        })
+        if config.users < 2:
+            raise CommandError('At least 2 users are needed, bids come from other users than the owner.')
+        if m.User.objects.filter(username=f'{config.prefix}0').exists():
+            raise CommandError(f'Users prefixed {config.prefix} exist already, pick another --prefix.')
+
+        started = time.perf_counter()
+
+        def progress(result):
+            rate = result.offers / max(time.perf_counter() - started, 0.001)
+            self.stdout.write(f'{result.offers}/{config.offers} offers, {rate:.0f} offers/s')
+
+        result = seeding.seed_marketplace(config, progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {result.users} users, {result.offers} offers, {result.bids} bids, '
+            f'{result.messages} messages and {result.notifications} notifications '
+            f'in {time.perf_counter() - started:.1f} s.'
+        ))
@@ -0,0 +1,242 @@
+import asyncio
+import atexit
+import contextvars
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.template.backends import django as django_backend
+
+from MyApp.query_budget import QueryCounter
+
+# name: (type, help), in exposition order.
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by view, method and status code.'),
+    'http_request_duration_seconds': ('histogram', 'Time spent in the view and middleware.'),
+    'http_response_size_bytes': ('histogram', 'Size of non streaming response bodies.'),
+    'db_queries_total': ('counter', 'SQL queries run while handling requests.'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent running SQL queries.'),
+    'template_render_duration_seconds_total': ('counter', 'Time spent rendering templates.'),
+}
+UNRESOLVED_VIEW = '<unresolved>'
+
+# Template render time of the current request, see Template.render.
+_template_seconds = contextvars.ContextVar('template_seconds', default=None)
+
+# Every thread increments its own shard, readers sum them (see snapshot).
+_local = threading.local()
+_shards = []
+_last_flush = 0
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        _shards.append(shard)
+    return shard
+
+
+def inc(name, labels, amount=1):
+    shard = _shard()
+    key = (name, labels)
+    shard[key] = shard.get(key, 0) + amount
+
+
+def observe(name, labels, value, buckets):
+    """Add value to a histogram, buckets are cumulative like in the exposition format."""
+    shard = _shard()
+    for bound in (*buckets, math.inf):
+        if value <= bound:
+            key = (f'{name}_bucket', (*labels, ('le', _format_value(bound))))
+            shard[key] = shard.get(key, 0) + 1
+    inc(f'{name}_sum', labels, value)
+    inc(f'{name}_count', labels)
+
+
+def snapshot():
+    """Sum of all shards of this process, keyed by (sample name, labels)."""
+    values = {}
+    for shard in list(_shards):
+        # dict.copy does not release the GIL, the owner thread can keep writing.
+        for key, value in shard.copy().items():
+            values[key] = values.get(key, 0) + value
+    return values
+
+
+def _path(pid):
+    return os.path.join(settings.METRICS_DIR, f'{pid}.json')
+
+
+def flush(force=False):
+    """
+    Write this process' counters to METRICS_DIR, at most every
+    METRICS_FLUSH_INTERVAL seconds unless forced.
+
+    Every worker has its own file, so no locking is needed and files of
+    restarted workers keep counting until Prometheus sees the reset.
+    """
+    global _last_flush
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+
+    samples = [[name, labels, value] for (name, labels), value in snapshot().items()]
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = _path(os.getpid())
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(samples, file)
+    os.replace(tmp_path, path)
+
+
+atexit.register(flush, force=True)
+
+
+def collect():
+    """Counters of this process plus the last flushed ones of the other workers."""
+    values = snapshot()
+    if not settings.METRICS_DIR:
+        return values
+
+    own_path = _path(os.getpid())
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        if path == own_path:
+            continue
+        try:
+            with open(path) as file:
+                samples = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in samples:
+            key = (name, tuple(tuple(label) for label in labels))
+            values[key] = values.get(key, 0) + value
+    return values
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _sample_order(sample):
+    name, labels, value = sample
+    # Buckets in numeric order of their upper bound.
+    return name, [(key, float(label) if key == 'le' else 0, label) for key, label in labels]
+
+
+def render(values):
+    """Prometheus text exposition format 0.0.4 of collected values."""
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        samples = sorted(((name, labels, value) for (name, labels), value in values.items()
+                          if name == metric or name.rsplit('_', 1)[0] == metric), key=_sample_order)
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, labels, value in samples:
+            label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+            lines.append(f'{name}{{{label_text}}} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class Template(django_backend.Template):
+    """Template adding its render time to the current request, see MetricsMiddleware."""
+
+    def render(self, context=None, request=None):
+        seconds = _template_seconds.get()
+        if seconds is None:
+            return super().render(context, request)
+
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            seconds[0] += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """
+    The Django template backend with timed templates.
+
+    Templates included by {% include %} or {% extends %} are loaded by the
+    engine directly, so only the outermost render is timed.
+    """
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return Template(template.template, self)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL queries, template render time and response size of
+    every request, labeled with the URL name of the view.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django await the middleware, see MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        started, template_seconds, token = self.start()
+        with QueryCounter() as queries:
+            try:
+                response = self.get_response(request)
+            finally:
+                _template_seconds.reset(token)
+        self.record(request, response, started, queries, template_seconds[0])
+        return response
+
+    async def __acall__(self, request):
+        started, template_seconds, token = self.start()
+        with QueryCounter() as queries:
+            try:
+                response = await self.get_response(request)
+            finally:
+                _template_seconds.reset(token)
+        self.record(request, response, started, queries, template_seconds[0])
+        return response
+
+    @staticmethod
+    def start():
+        template_seconds = [0.0]
+        return time.perf_counter(), template_seconds, _template_seconds.set(template_seconds)
+
+    @staticmethod
+    def record(request, response, started, queries, template_seconds):
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match and match.view_name else UNRESOLVED_VIEW
+        labels = (('view', view), ('method', request.method))
+
+        inc('http_requests_total', (*labels, ('status', str(response.status_code))))
+        observe('http_request_duration_seconds', labels, duration, settings.METRICS_LATENCY_BUCKETS)
+        if not response.streaming:
+            observe('http_response_size_bytes', labels, len(response.content), settings.METRICS_SIZE_BUCKETS)
+        inc('db_queries_total', labels, queries.count)
+        inc('db_query_duration_seconds_total', labels, queries.duration)
+        inc('template_render_duration_seconds_total', labels, template_seconds)
+        flush()
@@ -1,19 +1,63 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
-from django.db.models import Q
-from django.shortcuts import redirect
+from django.db.models import Case, Count, F, Max, Min, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least, Lower
+from django.utils import timezone
 from django.utils.translation import gettext_lazy
 
+from MyApp import fragment_cache, geo, search
+from MyApp.pagination import KeysetPaginator
+
 # Create your models here.
 
 
 class UserProfile(models.Model):
     avatar = models.ImageField(default='user.svg', null=True, upload_to='uploaded')
 
+    # Content hash of the uploaded avatar, its variants are ready when
+    # avatar_ready is set, see MyApp.avatars.
+    avatar_hash = models.CharField(max_length=64, default='', blank=True, editable=False)
+    avatar_ready = models.BooleanField(default=False, editable=False)
+
 
 class User(AbstractUser):
     profile = models.OneToOneField(UserProfile, on_delete=models.CASCADE, null=True)
 
+    # Maintained by Notification, read instead of COUNT(*) on notifications.
+    unread_notifications = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # Case-insensitive availability checks, see MyApp.availability.
+        indexes = [
+            models.Index(Lower('username'), name='user_username_lower_idx'),
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+        ]
+
+    @classmethod
+    def rebuild_unread_notifications(cls, queryset=None):
+        """Recompute unread counters of queryset users from Notification in one UPDATE."""
+        queryset = cls.objects.all() if queryset is None else queryset
+        unread = Notification.objects.filter(
+            user=OuterRef('pk'), is_read=False
+        ).order_by().values('user').annotate(count=Count('pk')).values('count')
+        return queryset.update(unread_notifications=Coalesce(Subquery(unread), 0))
+
+    @classmethod
+    def add_unread_notifications(cls, counts):
+        """Shift unread counters by {user_id: delta} in a single UPDATE."""
+        counts = {user_id: delta for user_id, delta in counts.items() if delta}
+        if not counts:
+            return
+        delta = Case(
+            *[When(pk=user_id, then=Value(delta)) for user_id, delta in counts.items()],
+            default=Value(0),
+            output_field=models.IntegerField(),
+        )
+        cls.objects.filter(pk__in=counts).update(
+            unread_notifications=Greatest(F('unread_notifications') + delta, Value(0))
+        )
+
 
 class DeliveryInfo(models.Model):
     city_from = models.CharField(max_length=64)
@@ -24,15 +68,50 @@ class DeliveryInfo(models.Model):
     street_to_number = models.IntegerField()
     extras = models.TextField()
 
+    # Filled by update_location from extras coordinates or the gazetteer, see MyApp.geo.
+    lat_from = models.FloatField(null=True, blank=True, editable=False)
+    lon_from = models.FloatField(null=True, blank=True, editable=False)
+    geohash_from = models.CharField(max_length=12, default='', blank=True, editable=False)
+    lat_to = models.FloatField(null=True, blank=True, editable=False)
+    lon_to = models.FloatField(null=True, blank=True, editable=False)
+    geohash_to = models.CharField(max_length=12, default='', blank=True, editable=False)
+
+    class Meta:
+        # Radius search indexes, see MyApp.geo.within.
+        indexes = [
+            models.Index(fields=['geohash_from', 'lat_from', 'lon_from'], name='deliveryinfo_from_geo_idx'),
+            models.Index(fields=['geohash_to', 'lat_to', 'lon_to'], name='deliveryinfo_to_geo_idx'),
+        ]
+
     def __str__(self):
         return self.deliveryoffer.name
 
+    def update_location(self):
+        self.lat_from, self.lon_from, self.geohash_from = geo.locate(self.city_from, self.extras)
+        self.lat_to, self.lon_to, self.geohash_to = geo.locate(self.city_to)
+
     def get_instance_update(self, **kwargs):
         for attr in self.__dict__:
             if attr and attr in kwargs:
                 self.__setattr__(f'{attr}', kwargs[f'{attr}'])
         self.save()
 
+    def save(self,
+             force_insert=False,
+             force_update=False,
+             using=None,
+             update_fields=None
+             ):
+        self.update_location()
+        super().save()
+
+        # Cities are part of the offer search document, keep it in sync.
+        delivery_offer = DeliveryOffer.objects.select_related('owner').filter(delivery_info=self).first()
+        if delivery_offer:
+            delivery_offer.delivery_info = self
+            delivery_offer.update_search_document()
+            fragment_cache.bump_offer(delivery_offer.pk)
+
 
 class DeliveryOffer(models.Model):
     class IsActive(models.IntegerChoices):
@@ -63,21 +142,68 @@ class DeliveryOffer(models.Model):
         blank=True
     )
     date_added = models.DateTimeField(auto_now_add=True)
+    # Set by save, and by the queryset updates of delivery info and bid
+    # aggregates, so it changes whenever the offer, its delivery info or bids do.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Normalized name, description, owner username and cities, see MyApp.search.
+    search_document = models.TextField(default='', blank=True, editable=False)
+
+    # Bid aggregates, maintained by UserBid.save and UserBid.delete.
+    bid_count = models.PositiveIntegerField(default=0, editable=False)
+    min_bid = models.DecimalField(max_digits=256, decimal_places=2, null=True, blank=True, editable=False)
+    max_bid = models.DecimalField(max_digits=256, decimal_places=2, null=True, blank=True, editable=False)
+    last_bid_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    BID_AGGREGATE_FIELDS = ('bid_count', 'min_bid', 'max_bid', 'last_bid_at')
+
+    class Meta:
+        # Keyset pagination indexes, see MyApp.pagination.
+        indexes = [
+            models.Index(fields=['is_active', '-date_added', '-id'], name='deliveryoffer_listing_idx'),
+            models.Index(fields=['owner', '-date_added', '-id'], name='deliveryoffer_owner_idx'),
+            models.Index(fields=['contractor', '-date_added', '-id'], name='deliveryoffer_contractor_idx'),
+        ]
 
     @classmethod
     def filter_searchbar_query(cls, query):
-        return cls.objects.all().filter(
-            Q(name__icontains=query) |
-            Q(owner__username__icontains=query) |
-            Q(delivery_info__city_from__icontains=query) |
-            Q(delivery_info__city_to__icontains=query)
+        return search.get_search_backend().search(cls.objects.all(), query)
+
+    def update_search_document(self):
+        self.search_document = search.build_search_document(self)
+        DeliveryOffer.objects.filter(pk=self.pk).update(search_document=self.search_document,
+                                                        updated_at=timezone.now())
+        search.get_search_backend().index_offer(self)
+        search.invalidate_results()
+
+    @classmethod
+    def rebuild_bid_aggregates(cls, queryset=None):
+        """Recompute bid aggregates of queryset offers from UserBid in one UPDATE."""
+        queryset = cls.objects.all() if queryset is None else queryset
+        bids = UserBid.objects.filter(delivery_offer=OuterRef('pk')).order_by().values('delivery_offer')
+
+        return queryset.update(
+            bid_count=Coalesce(Subquery(bids.annotate(count=Count('pk')).values('count')), 0),
+            min_bid=Subquery(bids.annotate(value_min=Min('value')).values('value_min')),
+            max_bid=Subquery(bids.annotate(value_max=Max('value')).values('value_max')),
+            last_bid_at=Subquery(bids.annotate(date_max=Max('date_added')).values('date_max')),
+            updated_at=timezone.now(),
         )
 
     @classmethod
-    def set_search_cookie_redirect(cls, query):
-        http_request = redirect('dashboard')
-        http_request.set_cookie('search', query, max_age=1)
-        return http_request
+    def add_bid_aggregates(cls, queryset, count, min_value, max_value, last_bid_at):
+        """Fold count new bids, with the given value range and newest date, into aggregates in one UPDATE."""
+        value_field = UserBid._meta.get_field('value')
+        min_value = Value(min_value, output_field=value_field)
+        max_value = Value(max_value, output_field=value_field)
+        last_bid_at = Value(last_bid_at, output_field=UserBid._meta.get_field('date_added'))
+        return queryset.update(
+            bid_count=F('bid_count') + count,
+            min_bid=Least(Coalesce(F('min_bid'), min_value), min_value),
+            max_bid=Greatest(Coalesce(F('max_bid'), max_value), max_value),
+            last_bid_at=Greatest(Coalesce(F('last_bid_at'), last_bid_at), last_bid_at),
+            updated_at=timezone.now(),
+        )
 
     def get_instance_update(self, **kwargs):
         for attr in self.__dict__:
@@ -85,33 +211,96 @@ class DeliveryOffer(models.Model):
                 self.__setattr__(f'{attr}', kwargs[f'{attr}'])
         self.save()
 
+    def accept_bid(self, user_bid):
+        """
+        Close the auction with user_bid, return True if this call closed it.
+
+        One conditional UPDATE of the changed columns, so of concurrent
+        accepts only the one that flipped is_active notifies the users.
+        """
+        with transaction.atomic():
+            accepted = DeliveryOffer.objects.filter(pk=self.pk, is_active=self.IsActive.YES).update(
+                contractor_id=user_bid.owner_id,
+                is_active=self.IsActive.NO,
+                final_bid=user_bid.value,
+                updated_at=timezone.now(),
+            )
+            if not accepted:
+                return False
+
+            # Notifications are fanned out by the process_outbox worker.
+            OutboxEvent.objects.create(
+                kind=OutboxEvent.Kind.OFFER_ACCEPTED,
+                payload={
+                    'delivery_offer_id': self.pk,
+                    'owner_id': self.owner_id,
+                    'contractor_id': user_bid.owner_id,
+                    'final_bid': str(user_bid.value),
+                }
+            )
+            fragment_cache.bump_offer(self.pk)
+
+        self.contractor_id = user_bid.owner_id
+        self.is_active = self.IsActive.NO
+        self.final_bid = user_bid.value
+        return True
+
+    def delete(self, using=None, keep_parents=False):
+        with transaction.atomic():
+            # Cascade deletes skip Notification.delete, keep unread counters right.
+            User.add_unread_notifications(Notification.unread_counts(self.notification_set.all()))
+            fragment_cache.bump_offer(self.pk)
+            return super().delete(using=using, keep_parents=keep_parents)
+
     def save(self,
              force_insert=False,
              force_update=False,
              using=None,
              update_fields=None
              ):
-        if not self.is_active:
-            msg_contractor = f"'@{self.name}' Twoja oferta zostala zaakceptowana przez {self.owner.username}."
-            Notification.objects.create(
-                delivery_offer=self,
-                user=self.contractor,
-                title=msg_contractor
-            )
+        self.search_document = search.build_search_document(self)
 
-            msg_owner = f"'@{self.name}' Zaakceptowales oferte uzytkownika {self.contractor.username} ({self.final_bid} zł)."
-            Notification.objects.create(
-                delivery_offer=self,
-                user=self.owner,
-                title=msg_owner
-            )
-        super().save()
+        # Bid aggregates are maintained by UserBid, never overwrite them here.
+        if not self._state.adding and update_fields is None:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.BID_AGGREGATE_FIELDS
+            ]
+
+        with transaction.atomic():
+            super().save(update_fields=update_fields)
+            fragment_cache.bump_offer(self.pk)
+
+
+class UserBidQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the bids and rebuild the aggregates of their offers, one UPDATE for all of them."""
+        with transaction.atomic(using=self.db):
+            delivery_offer_ids = set(self.order_by().values_list('delivery_offer_id', flat=True))
+            result = super().delete()
+            UserBid.rebuild_offers(delivery_offer_ids)
+        return result
 
 
 class UserBid(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     value = models.DecimalField(max_digits=256, decimal_places=2)
     delivery_offer = models.ForeignKey(DeliveryOffer, on_delete=models.CASCADE)
+    # Not auto_now_add, place_bids stamps a batch with the date it folds into last_bid_at.
+    date_added = models.DateTimeField(default=timezone.now, editable=False)
+
+    # Aggregates are rebuilt by the queryset and UserBid.delete, not by delete
+    # signals, so bids of a deleted offer still go by one fast DELETE.
+    objects = UserBidQuerySet.as_manager()
+
+    @staticmethod
+    def rebuild_offers(delivery_offer_ids):
+        """Rebuild aggregates of offers which lost bids, offers deleted meanwhile are skipped by the UPDATE."""
+        if not delivery_offer_ids:
+            return
+        DeliveryOffer.rebuild_bid_aggregates(DeliveryOffer.objects.filter(pk__in=delivery_offer_ids))
+        for delivery_offer_id in delivery_offer_ids:
+            fragment_cache.bump_offer(delivery_offer_id)
 
     def save(self,
              force_insert=False,
@@ -119,20 +308,79 @@ class UserBid(models.Model):
              using=None,
              update_fields=None
              ):
+        adding = self._state.adding
 
-        msg_owner = f'"@{self.delivery_offer.name}" Użytkownik {self.owner.username} złożył ofertę ({self.value} zł).'
-        Notification.objects.create(
-            delivery_offer=self.delivery_offer,
-            user=self.delivery_offer.owner,
-            title=msg_owner
-        )
-        super().save()
+        with transaction.atomic():
+            super().save()
+
+            # Notifications are fanned out by the process_outbox worker.
+            OutboxEvent.objects.create(
+                kind=OutboxEvent.Kind.BID_PLACED,
+                payload={
+                    'delivery_offer_id': self.delivery_offer_id,
+                    'bidder_id': self.owner_id,
+                    'value': str(self.value),
+                }
+            )
+
+            fragment_cache.bump_offer(self.delivery_offer_id)
+            delivery_offers = DeliveryOffer.objects.filter(pk=self.delivery_offer_id)
+            if not adding:
+                # The value may have changed, min/max can not be updated incrementally.
+                DeliveryOffer.rebuild_bid_aggregates(delivery_offers)
+                return
+
+            DeliveryOffer.add_bid_aggregates(delivery_offers, 1, self.value, self.value, self.date_added)
+
+    def delete(self, using=None, keep_parents=False):
+        with transaction.atomic():
+            result = super().delete(using=using, keep_parents=keep_parents)
+            UserBid.rebuild_offers({self.delivery_offer_id})
+        return result
 
 
 class Notification(models.Model):
     delivery_offer = models.ForeignKey(DeliveryOffer, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=256)
+    is_read = models.BooleanField(default=False)
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Notification feed pagination index, newest first.
+        indexes = [models.Index(fields=['user', '-id'], name='notification_feed_idx')]
+
+    @classmethod
+    def feed_page(cls, user, cursor=None):
+        """Bounded page of user notifications, newest first."""
+        return KeysetPaginator(user.notification_set.all(),
+                               settings.NOTIFICATIONS_PER_PAGE,
+                               ordering=('-pk',)).page(cursor)
+
+    @classmethod
+    def unread_counts(cls, queryset):
+        """Return {user_id: -unread notifications} of queryset, ready for User.add_unread_notifications."""
+        rows = queryset.filter(is_read=False).order_by().values('user').annotate(count=Count('pk'))
+        return {row['user']: -row['count'] for row in rows}
+
+    def save(self,
+             force_insert=False,
+             force_update=False,
+             using=None,
+             update_fields=None
+             ):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save()
+            if adding and not self.is_read:
+                User.add_unread_notifications({self.user_id: 1})
+
+    def delete(self, using=None, keep_parents=False):
+        with transaction.atomic():
+            result = super().delete(using=using, keep_parents=keep_parents)
+            if not self.is_read:
+                User.add_unread_notifications({self.user_id: -1})
+        return result
 
 
 class Message(models.Model):
@@ -141,3 +389,19 @@ class Message(models.Model):
     message_from = models.ForeignKey(User, on_delete=models.CASCADE, related_name="message_from")
     message_to = models.ForeignKey(User, on_delete=models.CASCADE, related_name="message_to")
     date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Chat history pages are range scans of a single conversation.
+        indexes = [models.Index(fields=['delivery_offer', 'date', 'id'], name='message_history_idx')]
+
+
+class OutboxEvent(models.Model):
+    """Event written in the same transaction as the change, see MyApp.outbox."""
+
+    class Kind(models.TextChoices):
+        BID_PLACED = 'bid_placed', gettext_lazy('Bid placed')
+        OFFER_ACCEPTED = 'offer_accepted', gettext_lazy('Offer accepted')
+
+    kind = models.CharField(max_length=32, choices=Kind.choices)
+    payload = models.JSONField()
+    date_added = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,83 @@
+from collections import Counter
+
+from django.db import transaction
+
+from MyApp import models as m
+
+
+def bid_placed_title(offer_name, bidder_username, value):
+    return f'"@{offer_name}" Użytkownik {bidder_username} złożył ofertę ({value} zł).'
+
+
+def offer_accepted_titles(offer_name, owner_username, contractor_username, final_bid):
+    """(title for the contractor, title for the owner)."""
+    return (
+        f"'@{offer_name}' Twoja oferta zostala zaakceptowana przez {owner_username}.",
+        f"'@{offer_name}' Zaakceptowales oferte uzytkownika {contractor_username} ({final_bid} zł).",
+    )
+
+
+def bid_placed_notifications(payload, delivery_offers, users):
+    delivery_offer = delivery_offers.get(payload['delivery_offer_id'])
+    bidder = users.get(payload['bidder_id'])
+    if not delivery_offer or not bidder:
+        return []
+
+    msg_owner = bid_placed_title(delivery_offer.name, bidder.username, payload['value'])
+    return [m.Notification(delivery_offer=delivery_offer, user_id=delivery_offer.owner_id, title=msg_owner)]
+
+
+def offer_accepted_notifications(payload, delivery_offers, users):
+    delivery_offer = delivery_offers.get(payload['delivery_offer_id'])
+    owner = users.get(payload['owner_id'])
+    contractor = users.get(payload['contractor_id'])
+    if not delivery_offer or not owner or not contractor:
+        return []
+
+    msg_contractor, msg_owner = offer_accepted_titles(delivery_offer.name, owner.username, contractor.username,
+                                                      payload['final_bid'])
+    return [
+        m.Notification(delivery_offer=delivery_offer, user=contractor, title=msg_contractor),
+        m.Notification(delivery_offer=delivery_offer, user=owner, title=msg_owner),
+    ]
+
+
+NOTIFICATION_FANOUT = {
+    m.OutboxEvent.Kind.BID_PLACED: bid_placed_notifications,
+    m.OutboxEvent.Kind.OFFER_ACCEPTED: offer_accepted_notifications,
+}
+
+USER_ID_KEYS = ('bidder_id', 'owner_id', 'contractor_id')
+
+
+def drain(batch_size=500):
+    """
+    Turn up to batch_size outbox events into notifications.
+
+    Offers and users of the whole batch are loaded with one query each,
+    notifications are inserted with bulk_create and unread counters are
+    shifted with a single UPDATE, so a batch costs a constant number of
+    queries. Locked rows are skipped, several workers may run at once.
+    Returns the number of processed events.
+    """
+    with transaction.atomic():
+        events = list(
+            m.OutboxEvent.objects.select_for_update(skip_locked=True).order_by('pk')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        delivery_offer_ids = {event.payload['delivery_offer_id'] for event in events}
+        user_ids = {event.payload[key] for event in events for key in USER_ID_KEYS if event.payload.get(key)}
+        delivery_offers = m.DeliveryOffer.objects.only('name', 'owner_id').in_bulk(delivery_offer_ids)
+        users = m.User.objects.only('username').in_bulk(user_ids)
+
+        notifications = []
+        for event in events:
+            notifications.extend(NOTIFICATION_FANOUT[event.kind](event.payload, delivery_offers, users))
+
+        m.Notification.objects.bulk_create(notifications, batch_size=batch_size)
+        m.User.add_unread_notifications(Counter(notification.user_id for notification in notifications))
+        m.OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+
+    return len(events)
@@ -0,0 +1,134 @@
+import copy
+import json
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'MyApp.pagination.cursor'
+
+
+class KeysetPage:
+    """Single page of a KeysetPaginator, iterable like a list of objects."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination keyed on the ordering columns (by default date_added, id).
+
+    Each page is fetched with a "WHERE (date_added, id) < (...) LIMIT n" query,
+    which is an index range scan no matter how deep the page is, unlike
+    OFFSET based pagination. Cursors are signed, so they are opaque to users
+    and a tampered cursor falls back to the first page.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-date_added', '-pk')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def page(self, cursor=None):
+        direction, values = self.decode_cursor(cursor)
+
+        if direction == 'previous':
+            ordering = tuple(self._reverse(field) for field in self.ordering)
+            queryset = self.queryset.filter(self._after(values, ordering))
+        else:
+            ordering = self.ordering
+            queryset = self.queryset
+            if values is not None:
+                queryset = queryset.filter(self._after(values, ordering))
+
+        # One extra row tells whether there is another page further on.
+        object_list = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if direction == 'previous':
+            object_list.reverse()
+            previous_cursor = self._cursor('previous', object_list[0]) if has_more and object_list else None
+            next_cursor = self._cursor('next', object_list[-1]) if object_list else None
+        else:
+            next_cursor = self._cursor('next', object_list[-1]) if has_more else None
+            previous_cursor = self._cursor('previous', object_list[0]) if values is not None and object_list else None
+
+        return KeysetPage(object_list, next_cursor, previous_cursor)
+
+    def decode_cursor(self, cursor):
+        """Return (direction, ordering values) or (None, None) for the first page."""
+        if not cursor:
+            return None, None
+        try:
+            direction, raw_values = json.loads(signing.loads(cursor, salt=CURSOR_SALT))
+            fields = self._fields()
+            if direction not in ('next', 'previous') or len(raw_values) != len(fields):
+                return None, None
+            values = [field.to_python(value) for field, value in zip(fields, raw_values)]
+        except (signing.BadSignature, ValueError, TypeError):
+            return None, None
+        return direction, values
+
+    def _cursor(self, direction, obj):
+        raw_values = [field.value_to_string(obj) for field in self._fields()]
+        return signing.dumps(json.dumps([direction, raw_values]), salt=CURSOR_SALT)
+
+    def _fields(self):
+        return [self._field(field.lstrip('-')) for field in self.ordering]
+
+    def _field(self, name):
+        opts = self.queryset.model._meta
+        if name == 'pk':
+            return opts.pk
+        if name not in self.queryset.query.annotations:
+            return opts.get_field(name)
+        # Annotations, e.g. search_rank of search.cached_search.
+        field = copy.copy(self.queryset.query.annotations[name].output_field)
+        field.set_attributes_from_name(name)
+        return field
+
+    @staticmethod
+    def _reverse(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(values, ordering):
+        """
+        Rows strictly after values in the given ordering.
+
+        The leading "first_field >=/<= value" term is redundant, but it lets
+        the database use an index range scan on the first column.
+        """
+        names = [field.lstrip('-') for field in ordering]
+        lookups = ['lt' if field.startswith('-') else 'gt' for field in ordering]
+
+        condition = Q()
+        for i, (name, lookup) in enumerate(zip(names, lookups)):
+            equal = {names[j]: values[j] for j in range(i)}
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+
+        return Q(**{f'{names[0]}__{lookups[0]}e': values[0]}) & condition
@@ -0,0 +1,134 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers, load_backend
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import PermissionDenied
+
+from MyApp import models as m
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+# Like django.contrib.auth, passwords never reach user_login_failed receivers.
+CLEANSED_PASSWORD = '********************'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    pbkdf2_sha256 with PASSWORD_HASH_ITERATIONS iterations.
+
+    Hashes of another iteration count still verify and are rehashed on the
+    next login, see authenticate.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASHING_WORKERS,
+                                           thread_name_prefix='passwords')
+    return _executor
+
+
+async def run_hasher(func, *args):
+    """
+    Run a hashing function on the password thread pool.
+
+    hashlib releases the GIL, so at most PASSWORD_HASHING_WORKERS hashes run
+    in parallel while the event loop and the database thread keep serving
+    other requests. The pool threads never touch the database.
+    """
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), functools.partial(func, *args))
+
+
+async def make_password(password):
+    return await run_hasher(hashers.make_password, password)
+
+
+def verify(password, encoded):
+    """(is_correct, must_update) of password against the encoded hash, see hashers.check_password."""
+    if password is None or not hashers.is_password_usable(encoded):
+        return False, False
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False, False
+
+    preferred = hashers.get_hasher('default')
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = hasher.verify(password, encoded)
+    if not is_correct and not hasher_changed and must_update:
+        hasher.harden_runtime(password, encoded)
+    return is_correct, must_update
+
+
+def _get_user(username):
+    return m.User._default_manager.filter(**{m.User.USERNAME_FIELD: username}).first()
+
+
+def _update_password(user, encoded):
+    user.password = encoded
+    user.save(update_fields=['password'])
+
+
+async def _authenticate_model_backend(username, password):
+    """
+    ModelBackend.authenticate with the hashing done by run_hasher.
+
+    Database queries go through sync_to_async. A password hashed with an old
+    hasher or cost is rehashed with the current one.
+    """
+    user = await sync_to_async(_get_user)(username)
+    if user is None:
+        # Hash anyway, so response times do not tell which usernames exist.
+        await make_password(password)
+        return None
+
+    is_correct, must_update = await run_hasher(verify, password, user.password)
+    if not is_correct or not user.is_active:
+        return None
+
+    if must_update:
+        await sync_to_async(_update_password)(user, await make_password(password))
+    return user
+
+
+async def authenticate(request, username, password):
+    """
+    django.contrib.auth.authenticate for the event loop.
+
+    Tries AUTHENTICATION_BACKENDS in order, ModelBackend without blocking
+    the loop on hashing, the others through sync_to_async. Sends
+    user_login_failed when none of them accepts the credentials.
+    """
+    if username is not None and password is not None:
+        for backend_path in settings.AUTHENTICATION_BACKENDS:
+            backend = load_backend(backend_path)
+            try:
+                if backend_path == MODEL_BACKEND:
+                    user = await _authenticate_model_backend(username, password)
+                else:
+                    user = await sync_to_async(backend.authenticate)(request, username=username, password=password)
+            except PermissionDenied:
+                # The backend refused, the remaining ones are not asked.
+                break
+            if user is not None:
+                user.backend = backend_path
+                return user
+
+    await sync_to_async(user_login_failed.send)(
+        sender=__name__, credentials={'username': username, 'password': CLEANSED_PASSWORD}, request=request,
+    )
+    return None
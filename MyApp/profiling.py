@@ -0,0 +1,210 @@
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+
+from MyApp import db, metrics, query_budget
+from MyApp.query_budget import QueryCounter
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+# Trigger value: profiler, '1' picks the sampling one.
+PROFILERS = {'1': 'sample', 'sample': 'sample', 'cprofile': 'cprofile'}
+
+# Wrappers around views and queries, never reported as call sites.
+_instrumentation_files = {
+    os.path.abspath(module.__file__) for module in (sys.modules[__name__], db, metrics, query_budget)
+}
+
+
+def _short_path(filename):
+    """Path relative to the project, or to site-packages for libraries."""
+    if filename.startswith('<'):
+        return filename
+    path = os.path.abspath(filename)
+    if 'site-packages' + os.sep in path:
+        return path.split('site-packages' + os.sep, 1)[1]
+    base_dir = str(settings.BASE_DIR) + os.sep
+    return path[len(base_dir):] if path.startswith(base_dir) else path
+
+
+def call_site():
+    """Innermost frame of project code (not a library or instrumentation) on the current stack."""
+    base_dir = str(settings.BASE_DIR) + os.sep
+    for frame, lineno in traceback.walk_stack(None):
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (filename.startswith(base_dir) and filename not in _instrumentation_files
+                and 'site-packages' not in filename):
+            return f'{_short_path(filename)}:{lineno} in {frame.f_code.co_name}'
+    return None
+
+
+class QueryLog(QueryCounter):
+    """QueryCounter keeping the time and call site of every query."""
+
+    def __init__(self):
+        super().__init__()
+        self.log = []
+
+    def add(self, sql, duration):
+        super().add(sql, duration)
+        self.log.append({
+            'sql': sql,
+            'duration_ms': round(duration * 1000, 3),
+            'call_site': call_site(),
+        })
+
+
+class Sampler:
+    """
+    Sampling profiler, every interval seconds it records the stacks of
+    thread_ids (all threads if None) as collapsed stacks.
+    """
+
+    def __init__(self, thread_ids=None, interval=None):
+        self.thread_ids = thread_ids
+        self.interval = interval or settings.PROFILING_SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = [f'{_short_path(f.f_code.co_filename)}:{f.f_code.co_name}'
+                         for f, _ in traceback.walk_stack(frame)]
+                if self.thread_ids is None:
+                    stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Stacks in the format of flamegraph.pl and speedscope, one 'frame;frame count' per line."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def _cprofile_stats(profile):
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(settings.PROFILING_STATS_LIMIT)
+    return stream.getvalue()
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request of a staff member sent with ?profile= or an
+    X-Profile header, 'sample' (or '1') for collapsed stacks of a sampling
+    profiler, 'cprofile' for cProfile statistics.
+
+    The page is replaced by a JSON report, which also lists every SQL query
+    with its time and call site. With PROFILING_DIR set, reports are stored
+    there as well. Requests without the trigger only pay for its lookup,
+    only staff requests are ever profiled. Has to come after
+    AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django await the middleware, see MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        profiler = self.requested_profiler(request)
+        if profiler is None or not request.user.is_staff:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with QueryLog() as queries:
+            if profiler == 'cprofile':
+                with cProfile.Profile() as profile:
+                    response = self.get_response(request)
+                result = {'stats': _cprofile_stats(profile)}
+            else:
+                with Sampler({threading.get_ident()}) as sampler:
+                    response = self.get_response(request)
+                result = {'stacks': sampler.collapsed()}
+        return self.report(request, response, profiler, started, queries, result)
+
+    async def __acall__(self, request):
+        profiler = self.requested_profiler(request)
+        if profiler is None or not await sync_to_async(lambda: request.user.is_staff)():
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        with QueryLog() as queries:
+            if profiler == 'cprofile':
+                # Profiles the event loop thread, sync_to_async code runs elsewhere.
+                with cProfile.Profile() as profile:
+                    response = await self.get_response(request)
+                result = {'stats': _cprofile_stats(profile)}
+            else:
+                # The request hops between threads, concurrent requests show up too.
+                with Sampler() as sampler:
+                    response = await self.get_response(request)
+                result = {'stacks': sampler.collapsed()}
+        return self.report(request, response, profiler, started, queries, result)
+
+    @staticmethod
+    def requested_profiler(request):
+        trigger = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+        # Anonymous requests are refused without loading a user.
+        if trigger is None or settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return None
+        return PROFILERS.get(trigger.lower())
+
+    @staticmethod
+    def report(request, response, profiler, started, queries, result):
+        match = request.resolver_match
+        report = {
+            'path': request.get_full_path(),
+            'view': match.view_name if match else None,
+            'status_code': response.status_code,
+            'profiler': profiler,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            'query_count': queries.count,
+            'query_duration_ms': round(queries.duration * 1000, 3),
+            'queries': queries.log,
+            **result,
+        }
+        if settings.PROFILING_DIR:
+            directory = Path(settings.PROFILING_DIR)
+            directory.mkdir(parents=True, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{report['view'] or 'unresolved'}"
+            (directory / f'{name}.json').write_text(json.dumps(report, indent=2))
+            if 'stacks' in result:
+                (directory / f'{name}.collapsed').write_text(result['stacks'])
+            report['stored_as'] = str(directory / name)
+        return JsonResponse(report)
@@ -0,0 +1,107 @@
+import contextvars
+import functools
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# QueryCounters of the current request (or task). Copied into the
+# sync_to_async thread along with the rest of the context.
+_counters = contextvars.ContextVar('query_counters', default=())
+
+
+def _count_queries(execute, sql, params, many, context):
+    counters = _counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for counter in counters:
+            counter.add(sql, duration)
+
+
+def install_query_counting(connection, **kwargs):
+    """Wrap every query of connection, connected to the connection_created signal."""
+    if _count_queries not in connection.execute_wrappers:
+        # First, so wrappers entered later nest inside and pop their own.
+        connection.execute_wrappers.insert(0, _count_queries)
+
+
+class QueryCounter:
+    """
+    Count SQL queries run on every database connection.
+
+    Uses connection.execute_wrapper, so it works with DEBUG turned off.
+    The counter follows the context, so queries of a sync view run by
+    sync_to_async under ASGI are counted too, whatever thread runs them.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.duration = 0.0
+        self._token = None
+
+    def add(self, sql, duration):
+        self.queries.append(sql)
+        self.duration += duration
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def __enter__(self):
+        # Connections of this thread opened before the signal was connected.
+        for alias in connections:
+            install_query_counting(connections[alias])
+        self._token = _counters.set((*_counters.get(), self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _counters.reset(self._token)
+
+
+def query_budget(max_queries):
+    """
+    Declare how many SQL queries the decorated view (or method) may run.
+
+    Going over the budget is handled according to QUERY_BUDGET_MODE setting:
+    'raise' raises QueryBudgetExceeded, 'log' logs a warning, any other
+    value turns the check off.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            mode = getattr(settings, 'QUERY_BUDGET_MODE', None)
+            if mode not in ('raise', 'log'):
+                return func(*args, **kwargs)
+
+            with QueryCounter() as counter:
+                result = func(*args, **kwargs)
+
+            if counter.count > max_queries:
+                msg = (
+                    f'{func.__qualname__} ran {counter.count} queries, '
+                    f'budget is {max_queries}.'
+                )
+                if mode == 'raise':
+                    raise QueryBudgetExceeded(msg + '\n' + '\n'.join(counter.queries))
+                logger.warning(msg)
+            return result
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return decorator
@@ -0,0 +1,349 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import BooleanField, Case, F, FloatField, Func, IntegerField, Q, Value, When
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r'\w+')
+
+RESULTS_GENERATION_KEY = 'MyApp:search:generation'
+# Ordering of cached_search results, best match first.
+SEARCH_ORDERING = ('-search_rank', '-date_added', '-pk')
+
+# Letters NFKD does not decompose into base letter + accent.
+EXTRA_TRANSLITERATION = str.maketrans({'ł': 'l', 'Ł': 'L'})
+
+
+def normalize(text):
+    """Lowercase text, strip diacritics and collapse whitespace."""
+    text = str(text or '').translate(EXTRA_TRANSLITERATION)
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.lower().split())
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def build_search_document(delivery_offer):
+    """Text searched by the dashboard search bar for a single offer."""
+    delivery_info = delivery_offer.delivery_info
+    return normalize(' '.join([
+        delivery_offer.name or '',
+        delivery_offer.description or '',
+        delivery_offer.owner.username,
+        delivery_info.city_from,
+        delivery_info.city_to,
+    ]))
+
+
+# Postgres expressions, written to match the GIN indexes created in
+# MyApp.signals.create_search_indexes.
+
+class ToTSVector(Func):
+    function = 'to_tsvector'
+    template = "%(function)s('simple'::regconfig, %(expressions)s)"
+
+
+class PlainToTSQuery(Func):
+    function = 'plainto_tsquery'
+    template = "%(function)s('simple'::regconfig, %(expressions)s)"
+
+
+class TSMatch(Func):
+    template = '%(expressions)s'
+    arg_joiner = ' @@ '
+    output_field = BooleanField()
+
+
+class TSRank(Func):
+    function = 'ts_rank'
+    output_field = FloatField()
+
+
+class TrigramSimilarity(Func):
+    function = 'similarity'
+    output_field = FloatField()
+
+
+class PostgresSearchBackend:
+    """
+    Full-text and trigram search over DeliveryOffer.search_document.
+
+    Substring matches are served by the gin_trgm_ops index, word matches by
+    the tsvector index, results are ranked by ts_rank plus trigram similarity.
+    """
+
+    def search(self, queryset, query):
+        query = normalize(query)
+        if not query:
+            return queryset
+
+        vector = ToTSVector(F('search_document'))
+        ts_query = PlainToTSQuery(Value(query))
+        return queryset.filter(
+            Q(search_document__contains=query) | Q(TSMatch(vector, ts_query))
+        ).annotate(
+            search_rank=TSRank(vector, ts_query) + TrigramSimilarity(F('search_document'), Value(query))
+        ).order_by('-search_rank', '-date_added')
+
+    def index_offer(self, delivery_offer):
+        """Postgres keeps its indexes up to date by itself."""
+
+    def remove_offer(self, offer_id):
+        """Postgres keeps its indexes up to date by itself."""
+
+    def invalidate(self):
+        """Postgres keeps its indexes up to date by itself."""
+
+
+class InvertedIndexSearchBackend:
+    """
+    Pure Python trigram inverted index, used where Postgres is not available.
+
+    The index is loaded lazily from DeliveryOffer.search_document and kept in
+    sync by the signals in MyApp.signals. Writes of other processes are only
+    seen through the search results generation (see invalidate_results):
+    once it changes, the index is loaded again. Every hit is re-checked
+    against the database, so a stale index never returns a wrong offer.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents = None
+        self._generation = None
+        self._postings = defaultdict(set)
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+
+        # Every token has to appear in the document.
+        for token in tokens:
+            queryset = queryset.filter(search_document__contains=token)
+
+        # Tokens shorter than a trigram cannot be looked up in the index.
+        if any(len(token) < 3 for token in tokens):
+            return queryset.order_by('-date_added')
+
+        scores = self._score(queryset.model, tokens)
+        if not scores:
+            return queryset.none()
+
+        # Group ids by score, so the CASE has one branch per distinct score.
+        ids_by_score = defaultdict(list)
+        for offer_id, score in scores.items():
+            ids_by_score[score].append(offer_id)
+
+        return queryset.filter(pk__in=list(scores)).annotate(
+            search_rank=Case(
+                *[When(pk__in=ids, then=Value(score)) for score, ids in ids_by_score.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        ).order_by('-search_rank', '-date_added')
+
+    def _score(self, model, tokens):
+        """Return {offer_id: score}, whole word hits weigh more than substrings."""
+        generation = _results_generation()
+        with self._lock:
+            self._ensure_loaded(model, generation)
+
+            candidates = None
+            for token in tokens:
+                for trigram in trigrams(token):
+                    postings = self._postings.get(trigram, set())
+                    candidates = postings.copy() if candidates is None else candidates & postings
+                    if not candidates:
+                        return {}
+
+            scores = {}
+            for offer_id in candidates:
+                document, words = self._documents[offer_id]
+                if all(token in document for token in tokens):
+                    scores[offer_id] = len(tokens) + sum(token in words for token in tokens)
+            return scores
+
+    def _ensure_loaded(self, model, generation):
+        if self._documents is not None and self._generation == generation:
+            return
+        # Read before loading, a write committed meanwhile bumps it again.
+        self._generation = generation
+        self._documents = {}
+        self._postings = defaultdict(set)
+        for offer_id, document in model.objects.values_list('id', 'search_document').iterator():
+            self._add(offer_id, document)
+
+    def _add(self, offer_id, document):
+        words = set(TOKEN_RE.findall(document))
+        self._documents[offer_id] = (document, words)
+        for word in words:
+            for trigram in trigrams(word):
+                self._postings[trigram].add(offer_id)
+
+    def _discard(self, offer_id):
+        if offer_id not in self._documents:
+            return
+        _, words = self._documents.pop(offer_id)
+        for word in words:
+            for trigram in trigrams(word):
+                postings = self._postings.get(trigram)
+                if postings is not None:
+                    postings.discard(offer_id)
+                    if not postings:
+                        del self._postings[trigram]
+
+    def index_offer(self, delivery_offer):
+        with self._lock:
+            if self._documents is None:
+                return
+            self._discard(delivery_offer.pk)
+            self._add(delivery_offer.pk, delivery_offer.search_document)
+
+    def remove_offer(self, offer_id):
+        with self._lock:
+            if self._documents is not None:
+                self._discard(offer_id)
+
+    def invalidate(self):
+        """Drop the index, it is rebuilt on the next search."""
+        with self._lock:
+            self._documents = None
+            self._postings = defaultdict(set)
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """
+    Return the search backend instance for the default database.
+
+    DELIVERY_OFFER_SEARCH_BACKEND setting may point to a backend class,
+    otherwise it is picked by database vendor.
+    """
+    path = getattr(settings, 'DELIVERY_OFFER_SEARCH_BACKEND', None)
+    if not path:
+        path = (
+            'MyApp.search.PostgresSearchBackend' if connection.vendor == 'postgresql' else
+            'MyApp.search.InvertedIndexSearchBackend'
+        )
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+class SearchResultCache:
+    """
+    LRU of normalized query -> matching offer ids, kept per process.
+
+    Entries are tagged with the results generation they were computed in,
+    see invalidate_results, and ignored once it changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+
+    def get(self, query, generation):
+        with self._lock:
+            entry = self._results.get(query)
+            if entry is None or entry[0] != generation:
+                return None
+            self._results.move_to_end(query)
+            return entry[1]
+
+    def put(self, query, generation, ids):
+        with self._lock:
+            self._results[query] = (generation, ids)
+            self._results.move_to_end(query)
+            while len(self._results) > settings.SEARCH_RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+result_cache = SearchResultCache()
+
+
+def _results_generation():
+    generation = cache.get(RESULTS_GENERATION_KEY)
+    if generation is None:
+        # Started from the clock, an evicted counter never repeats an old value.
+        cache.add(RESULTS_GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(RESULTS_GENERATION_KEY)
+    return generation
+
+
+def _bump_results_generation():
+    try:
+        cache.incr(RESULTS_GENERATION_KEY)
+    except ValueError:
+        cache.add(RESULTS_GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_results():
+    """
+    Drop cached search results in every process, called when an offer is
+    created, deleted or its search document changes.
+    """
+    _bump_results_generation()
+    # Again after commit, results computed from the old rows meanwhile are dropped.
+    transaction.on_commit(_bump_results_generation)
+
+
+def _with_rank(queryset):
+    # Backends skip the ranking for queries they can only match as substrings.
+    if 'search_rank' in queryset.query.annotations:
+        return queryset
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def cached_search(queryset, query):
+    """
+    Offers of queryset matching query, annotated with search_rank, to be
+    ordered by SEARCH_ORDERING.
+
+    The ranked ids of all matching offers are cached by normalized query,
+    so a repeated search costs a cache read and a primary key lookup.
+    Results with more than SEARCH_RESULT_CACHE_MAX_IDS offers are not cached.
+    """
+    query = normalize(query)
+    if not query:
+        return queryset
+
+    generation = _results_generation()
+    ranks = result_cache.get(query, generation)
+    if ranks is None:
+        model = queryset.model
+        results = _with_rank(get_search_backend().search(model.objects.all(), query))
+        ranks = list(results.values_list('pk', 'search_rank')[:settings.SEARCH_RESULT_CACHE_MAX_IDS + 1])
+        if len(ranks) > settings.SEARCH_RESULT_CACHE_MAX_IDS:
+            return _with_rank(get_search_backend().search(queryset, query))
+        result_cache.put(query, generation, ranks)
+
+    # Group ids by rank, so the CASE has one branch per distinct rank.
+    ids_by_rank = defaultdict(list)
+    for offer_id, rank in ranks:
+        ids_by_rank[float(rank)].append(offer_id)
+    return queryset.filter(pk__in=[offer_id for offer_id, _ in ranks]).annotate(
+        search_rank=Case(
+            *[When(pk__in=ids, then=Value(rank)) for rank, ids in ids_by_rank.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
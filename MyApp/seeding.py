@@ -0,0 +1,314 @@
+import csv
+import functools
+import math
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import hashers
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from MyApp import geo, outbox, search
+from MyApp import models as m
+
+# Offers, with their delivery info, bids, messages and notifications, inserted per transaction.
+SEED_CHUNK_SIZE = 5000
+# Users and profiles inserted with one bulk_create.
+USER_CHUNK_SIZE = 5000
+# Rows of a single INSERT statement, see insert_rows.
+INSERT_BATCH_SIZE = 1000
+
+# Arguments of seed_chunk in worker processes, see _init_worker.
+_worker_args = None
+
+# Goods in the genitive, "Transport mebli".
+GOODS = [
+    'mebli', 'kartonów', 'lodówki', 'pralki', 'pianina', 'rowerów', 'drewna', 'palet',
+    'szafy', 'biurka', 'kanapy', 'telewizora', 'cegieł', 'opon', 'akwarium', 'materaców',
+]
+STREETS = [
+    'Polna', 'Długa', 'Lipowa', 'Leśna', 'Słoneczna', 'Krótka', 'Szkolna', 'Ogrodowa',
+    'Kościuszki', 'Mickiewicza', 'Kwiatowa', 'Parkowa',
+]
+MESSAGES = [
+    'Dzień dobry, kiedy odbiór?', 'Czy ładunek zmieści się w busie?', 'Mogę przyjechać jutro rano.',
+    'Czy jest winda?', 'Proszę o numer telefonu.', 'Pasuje mi sobota.', 'Dziękuję, do zobaczenia.',
+]
+
+
+@dataclass
+class SeedConfig:
+    """
+    What seed_marketplace generates. Bids per offer and messages per
+    conversation follow Poisson distributions of the given means.
+    """
+    offers: int
+    users: int = 1000
+    seed: int = 0
+    bids_per_offer: float = 3
+    messages_per_conversation: float = 4
+    closed_ratio: float = 0.2
+    read_ratio: float = 0.7
+    days: int = 365
+    prefix: str = 'seed'
+    password: str = 'seed1234'
+    chunk_size: int = SEED_CHUNK_SIZE
+    workers: int = 1
+
+
+@dataclass
+class SeedResult:
+    users: int = 0
+    offers: int = 0
+    bids: int = 0
+    messages: int = 0
+    notifications: int = 0
+
+    def add(self, other):
+        for name, count in vars(other).items():
+            setattr(self, name, getattr(self, name) + count)
+
+
+def poisson(rng, mean):
+    # Knuth's method, fast enough for the small means used here.
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+@functools.lru_cache(maxsize=None)
+def cities():
+    """(name, lat, lon) of the Polish cities of the geo gazetteer."""
+    with open(geo.GAZETTEER_PATH, encoding='utf-8', newline='') as file:
+        return [(row['name'], float(row['lat']), float(row['lon'])) for row in csv.DictReader(file)]
+
+
+@contextmanager
+def explicit_dates():
+    """Let bulk_create keep the generated offer dates instead of auto_now(_add) ones."""
+    fields = [m.DeliveryOffer._meta.get_field('date_added'), m.DeliveryOffer._meta.get_field('updated_at')]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def create_users(config, rng):
+    """Users named prefix0, prefix1, ... with profiles, all with the same password."""
+    password = hashers.make_password(config.password)
+    users = []
+    for start in range(0, config.users, USER_CHUNK_SIZE):
+        numbers = range(start, min(start + USER_CHUNK_SIZE, config.users))
+        with transaction.atomic():
+            profiles = m.UserProfile.objects.bulk_create(m.UserProfile() for _ in numbers)
+            users += m.User.objects.bulk_create(
+                m.User(username=f'{config.prefix}{number}', email=f'{config.prefix}{number}@boxme.pl',
+                       password=password, profile=profile,
+                       date_joined=timezone.now() - timedelta(days=rng.uniform(config.days, 2 * config.days)))
+                for number, profile in zip(numbers, profiles)
+            )
+    return users
+
+
+def _delivery_info(rng, places):
+    (city_from, lat_from, lon_from), (city_to, lat_to, lon_to) = rng.choice(places), rng.choice(places)
+    # Spread addresses around the city centre, up to about 10 km away.
+    lat_from, lon_from = lat_from + rng.uniform(-0.09, 0.09), lon_from + rng.uniform(-0.14, 0.14)
+    return m.DeliveryInfo(
+        city_from=city_from, street_from=rng.choice(STREETS), street_from_number=rng.randint(1, 200),
+        city_to=city_to, street_to=rng.choice(STREETS), street_to_number=rng.randint(1, 200),
+        extras='',
+        lat_from=lat_from, lon_from=lon_from, geohash_from=geo.geohash(lat_from, lon_from),
+        lat_to=lat_to, lon_to=lon_to, geohash_to=geo.geohash(lat_to, lon_to),
+    )
+
+
+def _adapter(field, connection):
+    internal_type = field.get_internal_type()
+    if internal_type == 'DateTimeField':
+        return connection.ops.adapt_datetimefield_value
+    if internal_type == 'DecimalField':
+        return functools.partial(connection.ops.adapt_decimalfield_value,
+                                 max_digits=field.max_digits, decimal_places=field.decimal_places)
+    return None
+
+
+def insert_rows(model, field_names, rows):
+    """
+    INSERT plain tuples of field_names values, in batches of at most
+    INSERT_BATCH_SIZE rows. Skips building model instances, the biggest
+    cost of bulk_create for millions of rows, so values must already have
+    the Python type of their field (ids for foreign keys).
+    """
+    connection = connections[router.db_for_write(model)]
+    fields = [model._meta.get_field(name) for name in field_names]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    placeholders = f"({', '.join(['%s'] * len(fields))})"
+    batch_size = min(connection.ops.bulk_batch_size(fields, rows), INSERT_BATCH_SIZE)
+    # Only dates and decimals need adapting, field.get_db_prep_save for every value costs as much as the INSERT.
+    adapt = [_adapter(field, connection) for field in fields]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = [value if adapt_value is None or value is None else adapt_value(value)
+                      for row in batch for adapt_value, value in zip(adapt, row)]
+            cursor.execute(f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) '
+                           f"VALUES {', '.join([placeholders] * len(batch))}", params)
+
+
+def _offer_bids(config, rng, delivery_offer, users, now):
+    """(bidder, value, date) of bids of other users on an offer, oldest first."""
+    count = min(poisson(rng, config.bids_per_offer), len(users) - 1)
+    bidders = [user for user in rng.sample(users, count + 1) if user != delivery_offer.owner][:count]
+    span = (now - delivery_offer.date_added).total_seconds()
+    return sorted((
+        (bidder, (delivery_offer.wage * Decimal(rng.uniform(0.6, 1.2))).quantize(Decimal('0.01')),
+         delivery_offer.date_added + timedelta(seconds=rng.uniform(0, span)))
+        for bidder in bidders
+    ), key=lambda user_bid: user_bid[2])
+
+
+def _conversation(config, rng, delivery_offer, bidder, date, now):
+    """Message rows between a bidder and the offer owner, alternating, the bidder writes first."""
+    people = (bidder.pk, delivery_offer.owner_id)
+    rows = []
+    for number in range(poisson(rng, config.messages_per_conversation)):
+        date += timedelta(seconds=rng.uniform(0, (now - date).total_seconds() / 2))
+        rows.append((rng.choice(MESSAGES), delivery_offer.pk, people[number % 2], people[(number + 1) % 2], date))
+    return rows
+
+
+def _create_chunk(config, rng, places, users, numbers, now, result):
+    delivery_infos, delivery_offers, offer_bids = [], [], []
+    for _ in numbers:
+        delivery_info = _delivery_info(rng, places)
+        goods = rng.sample(GOODS, 3)
+        delivery_offer = m.DeliveryOffer(
+            name=f'Transport {goods[0]}', description=f"Do przewiezienia: {', '.join(goods)}.",
+            wage=Decimal(rng.randint(5000, 500000)) / 100, distance=Decimal(rng.randint(1, 600)),
+            owner=rng.choice(users), delivery_info=delivery_info,
+            date_added=now - timedelta(seconds=rng.uniform(0, config.days * 24 * 60 * 60)),
+        )
+        delivery_offer.search_document = search.build_search_document(delivery_offer)
+        bids = _offer_bids(config, rng, delivery_offer, users, now)
+
+        # Bid aggregates are known up front, see DeliveryOffer.add_bid_aggregates.
+        values = [value for _, value, _ in bids]
+        delivery_offer.bid_count = len(bids)
+        delivery_offer.min_bid, delivery_offer.max_bid = (min(values), max(values)) if values else (None, None)
+        delivery_offer.last_bid_at = bids[-1][2] if bids else None
+        delivery_offer.updated_at = delivery_offer.last_bid_at or delivery_offer.date_added
+        if rng.random() < config.closed_ratio:
+            delivery_offer.is_active = m.DeliveryOffer.IsActive.NO
+            if bids:
+                winner, delivery_offer.final_bid, _ = rng.choice(bids)
+                delivery_offer.contractor = winner
+
+        delivery_infos.append(delivery_info)
+        delivery_offers.append(delivery_offer)
+        offer_bids.append(bids)
+
+    # bulk_create fills in the delivery_info foreign keys, the other rows are plain tuples.
+    m.DeliveryInfo.objects.bulk_create(delivery_infos)
+    m.DeliveryOffer.objects.bulk_create(delivery_offers)
+
+    bid_rows, message_rows, notification_rows = [], [], []
+    for delivery_offer, bids in zip(delivery_offers, offer_bids):
+        for bidder, value, date in bids:
+            bid_rows.append((bidder.pk, value, delivery_offer.pk, date))
+            message_rows += _conversation(config, rng, delivery_offer, bidder, date, now)
+            # Titles as the outbox worker writes them, but without outbox events.
+            notification_rows.append((delivery_offer.pk, delivery_offer.owner_id, date,
+                                      outbox.bid_placed_title(delivery_offer.name, bidder.username, value)))
+        if delivery_offer.contractor is not None:
+            titles = outbox.offer_accepted_titles(delivery_offer.name, delivery_offer.owner.username,
+                                                  delivery_offer.contractor.username, delivery_offer.final_bid)
+            for user_id, title in zip((delivery_offer.contractor_id, delivery_offer.owner_id), titles):
+                notification_rows.append((delivery_offer.pk, user_id, delivery_offer.last_bid_at, title))
+    notification_rows = [(*row, rng.random() < config.read_ratio) for row in notification_rows]
+
+    insert_rows(m.UserBid, ['owner', 'value', 'delivery_offer', 'date_added'], bid_rows)
+    insert_rows(m.Message, ['content', 'delivery_offer', 'message_from', 'message_to', 'date'], message_rows)
+    insert_rows(m.Notification, ['delivery_offer', 'user', 'date_added', 'title', 'is_read'], notification_rows)
+
+    result.offers += len(delivery_offers)
+    result.bids += len(bid_rows)
+    result.messages += len(message_rows)
+    result.notifications += len(notification_rows)
+
+
+def seed_chunk(config, users, now, index):
+    """Insert chunk index of the offers in one transaction, return its SeedResult."""
+    start = index * config.chunk_size
+    numbers = range(start, min(start + config.chunk_size, config.offers))
+    # Every chunk has its own generator, the data does not depend on which worker inserts it.
+    rng = random.Random(f'{config.seed}:{index}')
+    result = SeedResult()
+    with transaction.atomic():
+        _create_chunk(config, rng, cities(), users, numbers, now, result)
+    return result
+
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+
+def _seed_chunk_in_worker(index):
+    return seed_chunk(*_worker_args, index)
+
+
+def seed_marketplace(config, progress=None):
+    """
+    Insert config.offers offers of config.users new users, with bids,
+    messages and notifications, and return a SeedResult.
+
+    Rows go through chunked bulk_create and insert_rows, so save()
+    overrides, signals and outbox events are skipped: bid aggregates are
+    set on the offers and unread counters rebuilt at the end. The same seed
+    gives the same data, except for dates, which are relative to now.
+    progress, if given, is called with the SeedResult after every chunk.
+
+    With config.workers > 1 chunks are inserted by forked processes, each
+    with its own connection. That is for Postgres, SQLite lets only one of
+    them write at a time.
+    """
+    now = timezone.now()
+    result = SeedResult()
+    users = create_users(config, random.Random(config.seed))
+    result.users = len(users)
+    chunks = range(math.ceil(config.offers / config.chunk_size))
+
+    with explicit_dates():
+        if config.workers > 1:
+            # Forked workers must not share the connections of this process.
+            connections.close_all()
+            with ProcessPoolExecutor(config.workers, mp_context=multiprocessing.get_context('fork'),
+                                     initializer=_init_worker, initargs=(config, users, now)) as executor:
+                chunk_results = executor.map(_seed_chunk_in_worker, chunks)
+                for chunk_result in chunk_results:
+                    result.add(chunk_result)
+                    if progress:
+                        progress(result)
+        else:
+            for index in chunks:
+                result.add(seed_chunk(config, users, now, index))
+                if progress:
+                    progress(result)
+
+    if users:
+        m.User.rebuild_unread_notifications(m.User.objects.filter(pk__range=(users[0].pk, users[-1].pk)))
+    search.get_search_backend().invalidate()
+    search.invalidate_results()
+    return result
@@ -0,0 +1,77 @@
+import django
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from MyApp import availability, chat, db
+from MyApp import models as m
+from MyApp import query_budget, search
+
+
+# Django 4.1 checks CONN_HEALTH_CHECKS connections itself.
+if django.VERSION < (4, 1):
+    request_started.connect(db.check_connections, dispatch_uid='check_connections')
+
+connection_created.connect(query_budget.install_query_counting, dispatch_uid='install_query_counting')
+
+
+@receiver(post_save, sender=m.User)
+def remember_taken_username(sender, instance, **kwargs):
+    availability.remember(instance)
+
+
+@receiver(post_save, sender=m.DeliveryOffer)
+def index_delivery_offer(sender, instance, **kwargs):
+    search.get_search_backend().index_offer(instance)
+    search.invalidate_results()
+
+
+@receiver(post_delete, sender=m.DeliveryOffer)
+def unindex_delivery_offer(sender, instance, **kwargs):
+    search.get_search_backend().remove_offer(instance.pk)
+    search.invalidate_results()
+
+
+@receiver(pre_delete, sender=m.User)
+def remember_bid_offers(sender, instance, **kwargs):
+    # Bids of a deleted user go by a cascade, which skips UserBidQuerySet.delete.
+    instance._bid_offer_ids = set(
+        m.UserBid.objects.filter(owner=instance).order_by().values_list('delivery_offer_id', flat=True))
+
+
+@receiver(post_delete, sender=m.User)
+def rebuild_bid_offers(sender, instance, **kwargs):
+    m.UserBid.rebuild_offers(getattr(instance, '_bid_offer_ids', set()))
+
+
+@receiver(post_save, sender=m.Message)
+def publish_chat_message(sender, instance, created, **kwargs):
+    if created:
+        delivery_offer_id = instance.delivery_offer_id
+        transaction.on_commit(lambda: chat.broker.publish(delivery_offer_id))
+
+
+def create_search_indexes(sender, using, **kwargs):
+    """
+    Create GIN indexes used by MyApp.search.PostgresSearchBackend.
+
+    Declared here instead of Meta.indexes, so the same models still create
+    their tables on SQLite.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    table = connection.ops.quote_name(m.DeliveryOffer._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS myapp_deliveryoffer_search_trgm '
+            f'ON {table} USING gin (search_document gin_trgm_ops)'
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS myapp_deliveryoffer_search_fts '
+            f"ON {table} USING gin (to_tsvector('simple'::regconfig, search_document))"
+        )
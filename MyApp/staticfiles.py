@@ -0,0 +1,176 @@
+import asyncio
+import gzip
+import json
+import mimetypes
+import os
+from email.utils import formatdate
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.txt', '.html', '.json', '.xml', '.map', '.ico'}
+# A variant is kept only if it saves at least this fraction of the size.
+MIN_COMPRESSION_GAIN = 0.05
+
+# Accept-Encoding token, variant suffix, in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def compress_file(path):
+    """Write .gz (and .br when brotli is installed) next to path if they are smaller."""
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+
+    for suffix, compressed in variants.items():
+        if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_GAIN):
+            with open(f'{path}{suffix}', 'wb') as file:
+                file.write(compressed)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage writing gzip and brotli variants of text files.
+
+    Variants are produced once by collectstatic, after the hashed names are
+    known, and served by StaticFilesMiddleware.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        names = set(paths) | set(self.hashed_files.values())
+        for name in names:
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS and self.exists(name):
+                compress_file(self.path(name))
+
+    def stored_name(self, name):
+        # collectstatic has not run (development, tests), use the source name.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        self.path = path
+        self.immutable = immutable
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type.endswith(('javascript', 'json', 'svg+xml')):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.last_modified = int(os.stat(path).st_mtime)
+        self.variants = {
+            encoding: f'{path}{suffix}' for encoding, suffix in ENCODINGS if os.path.exists(f'{path}{suffix}')
+        }
+
+
+def accepted_encodings(request):
+    """Content codings accepted by the client, those with q=0 left out."""
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """
+    Serve collected static files from the app process.
+
+    STATIC_ROOT is indexed once at startup, so a request costs a dict lookup
+    and an open(). Hashed names from the manifest are sent as immutable with
+    a one year max-age, other files are revalidated after STATIC_MAX_AGE.
+    The precompressed variant is picked by Accept-Encoding. Requests for
+    files that were not collected fall through to the next handler.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django await the middleware, see MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else f'/{settings.STATIC_URL}'
+        self.files = self.index(Path(settings.STATIC_ROOT)) if settings.STATIC_ROOT else {}
+
+    @staticmethod
+    def index(root):
+        if not root.is_dir():
+            return {}
+
+        hashed_names = set()
+        manifest_name = getattr(staticfiles_storage, 'manifest_name', None)
+        if manifest_name and (root / manifest_name).is_file():
+            with open(root / manifest_name, encoding='utf-8') as file:
+                hashed_names = set(json.load(file).get('paths', {}).values())
+
+        suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        files = {}
+        for path in root.rglob('*'):
+            if path.is_file() and not path.name.endswith(suffixes):
+                name = path.relative_to(root).as_posix()
+                files[name] = StaticFile(str(path), name in hashed_names)
+        return files
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is not None:
+            return self.serve(request, static_file)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        static_file = self.find(request)
+        if static_file is not None:
+            return self.serve(request, static_file)
+        return await self.get_response(request)
+
+    def find(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            return self.files.get(request.path[len(self.prefix):])
+        return None
+
+    def serve(self, request, static_file):
+        if not static_file.immutable:
+            if response := get_conditional_response(request, last_modified=static_file.last_modified):
+                return response
+
+        accepted = accepted_encodings(request)
+        encoding = next((encoding for encoding, _ in ENCODINGS
+                         if encoding in accepted and encoding in static_file.variants), None)
+        path = static_file.variants[encoding] if encoding else static_file.path
+
+        response = FileResponse(open(path, 'rb'))
+        # FileResponse guesses both from the file name, which is the variant's.
+        response['Content-Type'] = static_file.content_type
+        del response['Content-Disposition']
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if static_file.variants:
+            response['Vary'] = 'Accept-Encoding'
+        response['Last-Modified'] = formatdate(static_file.last_modified, usegmt=True)
+        response['Cache-Control'] = (
+            'public, max-age=31536000, immutable' if static_file.immutable else
+            f'public, max-age={settings.STATIC_MAX_AGE}'
+        )
+        return response
@@ -0,0 +1,16 @@
+from django import template
+
+from MyApp import avatars
+
+register = template.Library()
+
+
+@register.inclusion_tag('MyApp/avatar_component.html')
+def avatar(user, size=40):
+    """<picture> of user avatar, the smallest stored variant at least size px wide."""
+    profile = getattr(user, 'profile', None)
+    return {
+        'urls': avatars.avatar_urls(profile, size),
+        'size': size,
+        'username': getattr(user, 'username', ''),
+    }
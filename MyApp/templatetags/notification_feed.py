@@ -0,0 +1,19 @@
+from django import template
+
+from MyApp import models as m
+
+register = template.Library()
+
+
+@register.inclusion_tag('MyApp/notification_component.html', takes_context=True)
+def notification_feed(context):
+    """First page of request user notifications, more are loaded from the feed API."""
+    request = context['request']
+    user = request.user
+    notifications = m.Notification.feed_page(user) if user.is_authenticated else None
+    return {
+        'request': request,
+        'user': user,
+        'notifications': notifications,
+        'csrf_token': context.get('csrf_token'),
+    }
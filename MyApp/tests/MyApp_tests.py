@@ -1,6 +1,32 @@
+import contextlib
+import gzip
+import http.client
+import io
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.signals import user_login_failed
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import close_old_connections, connection, connections
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
 
+from MyApp import availability, bids, geo, loadtest, metrics, profiling, search, seeding
 from MyApp import models as m
+from MyApp import outbox
+from MyApp.chat import ChatWebSocketApp
+from MyApp.query_budget import QueryBudgetExceeded, query_budget
+from MyApp.staticfiles import StaticFilesMiddleware
 
 from MyApp import views as v
 
@@ -25,7 +51,6 @@ WOOD_TRANSPORT = {
 @pytest.mark.django_db
 def test_login_user(rf, client, random_user, django_user_model):
     request = rf.get('/login/')
-    get_response = v.LoginView()
     request.user = django_user_model
 
     post_response = client.post('/login/',
@@ -35,10 +60,51 @@ def test_login_user(rf, client, random_user, django_user_model):
     assert not client.login(username='Pietaszsek', password='qwerty')
     assert random_user.is_authenticated
     assert client.login(username='Draven', password='random123')
-    assert get_response.get(request).status_code == 302
+    assert async_to_sync(v.login_view)(request).status_code == 302
     assert post_response.status_code == 302
 
 
+@pytest.mark.django_db
+def test_login_next_and_failed_signal(client, random_user):
+    credentials = {'username': 'Draven', 'password': 'random123'}
+    response = client.post('/login/?next=https://evil.example/', credentials)
+    assert response.url == '/dashboard/'
+    response = client.post('/login/?next=/dashboard/user/profile/', credentials)
+    assert response.url == '/dashboard/user/profile/'
+
+    failures = []
+    user_login_failed.connect(lambda **kwargs: failures.append(kwargs['credentials']), weak=False,
+                              dispatch_uid='test_login_failed')
+    try:
+        client.post('/login/', {'username': 'Draven', 'password': 'zle'})
+    finally:
+        user_login_failed.disconnect(dispatch_uid='test_login_failed')
+    assert failures == [{'username': 'Draven', 'password': '********************'}]
+
+
+@pytest.mark.django_db
+def test_login_rehashes_password(client, settings, random_user, django_user_model):
+    settings.PASSWORD_HASH_ITERATIONS = 1000
+    response = client.post('/login/', {'username': 'Draven', 'password': 'wrong123'})
+    assert response.url == '/login/'
+    random_user.refresh_from_db()
+    assert random_user.password.startswith('pbkdf2_sha256$320000$')
+
+    # The cost changed, the hash is replaced once the password is known.
+    response = client.post('/login/?next=/dashboard/user/profile/', {'username': 'Draven', 'password': 'random123'})
+    assert response.url == '/dashboard/user/profile/'
+    random_user.refresh_from_db()
+    assert random_user.password.startswith('pbkdf2_sha256$1000$')
+    assert client.get('/login/').url == '/dashboard/'
+
+    client.logout()
+    client.post('/register/', {'email': 'random@wp.pl', 'username': 'Klojda',
+                               'password': 'kaka1234', 'password2': 'kaka1234'})
+    user = django_user_model.objects.get(username='Klojda')
+    assert user.password.startswith('pbkdf2_sha256$1000$') and user.check_password('kaka1234')
+    assert user.profile_id
+
+
 @pytest.mark.django_db
 def test_register_user(client, django_user_model):
     get_response = client.get('/register/')
@@ -65,6 +131,56 @@ def test_register_failure_user(client, django_user_model):
     assert django_user_model.objects.all().count() == 0
 
 
+@pytest.mark.django_db
+def test_register_availability(client, settings, django_user_model, random_user, django_assert_num_queries):
+    availability.rebuild()
+    url = '/register/availability/'
+
+    # Free values are answered by the filter alone.
+    with django_assert_num_queries(0):
+        response = client.get(url, {'username': 'Klojda', 'email': 'random@wp.pl'})
+    assert response.json() == {
+        'username': {'available': True, 'message': None},
+        'email': {'available': True, 'message': None},
+    }
+    response = client.get(url, {'username': 'DRAVEN', 'email': ' Draven@Axe.com'})
+    assert response.json()['username'] == {'available': False, 'message': 'Uzytkownik o podanej nazwie istnieje.'}
+    assert not response.json()['email']['available']
+
+    client.post('/register/', {'email': 'random@wp.pl', 'username': 'Klojda',
+                               'password': 'kaka1234', 'password2': 'kaka1234'})
+    assert not client.get(url, {'username': 'klojda'}).json()['username']['available']
+
+    # Taken regardless of case when registering as well.
+    client.post('/register/', {'email': 'RANDOM@wp.pl', 'username': 'KLOJDA',
+                               'password': 'kaka1234', 'password2': 'kaka1234'})
+    assert django_user_model.objects.count() == 2
+
+    bloom = availability.BloomFilter(1000)
+    for i in range(1000):
+        bloom.add(f'user{i}')
+    assert all(f'user{i}' in bloom for i in range(1000))
+    assert sum(f'other{i}' in bloom for i in range(10000)) < 300
+
+    # While one thread rebuilds an expired filter, the others answer from the old one.
+    old_filter = availability.get_filter()
+    settings.AVAILABILITY_FILTER_MAX_AGE = 0
+    rebuilding, done = threading.Event(), threading.Event()
+
+    def rebuild():
+        with availability._rebuild_lock:
+            rebuilding.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=rebuild)
+    thread.start()
+    rebuilding.wait(5)
+    with django_assert_num_queries(0):
+        assert availability.get_filter() is old_filter
+    done.set()
+    thread.join()
+
+
 @pytest.mark.django_db
 def test_create_delivery_offer(rf, client, random_user):
     request = rf.post('/dashboard/add-delivery-offer/', data=WOOD_TRANSPORT)
@@ -137,12 +253,8 @@ def test_create_bid_auction_close(rf,
     post_request.user = random_delivery_offer.owner
 
     response = view.post(post_request, random_delivery_offer.id)
-
-    random_delivery_offer.get_instance_update(
-        contractor_id=random_user2_bid.owner_id,
-        is_active=0,
-        final_bid=random_user2_bid.value
-    )
+    random_delivery_offer.refresh_from_db()
+    random_user2_bid.refresh_from_db()
 
     assert response.url == '/dashboard/user/delivery-offers/'
     assert response.status_code == 302
@@ -156,6 +268,9 @@ def test_create_bid_auction_close(rf,
 
     assert random_delivery_offer.is_active == 0
     assert random_delivery_offer.final_bid == random_user2_bid.value
+
+    # Notifications are created by the outbox worker.
+    outbox.drain()
     assert random_user.notification_set.all().count() > 0
     assert random_user2.notification_set.all().count() > 0
     assert random_delivery_offer.notification_set.all().count() >= 2
@@ -267,3 +382,972 @@ def test_user_send_message(rf,
             ==
             random_delivery_offer
     )
+
+
+@pytest.mark.django_db
+def test_search_delivery_offer(random_delivery_offer, random_user):
+    assert random_delivery_offer.search_document == (
+        'transport mebli szafa, biurko, stol. draven kozia wolka kozia wolka'
+    )
+
+    for query in ('KOZIA', 'kozia wołka', 'drav', 'Mebli szafa'):
+        assert list(m.DeliveryOffer.filter_searchbar_query(query)) == [random_delivery_offer]
+
+    assert not m.DeliveryOffer.filter_searchbar_query('Gdańsk').exists()
+
+
+@pytest.mark.django_db
+def test_search_delivery_offer_ranking(rf, client, settings, random_delivery_offer, random_user):
+    request = rf.post('/dashboard/add-delivery-offer/',
+                      data={**WOOD_TRANSPORT, 'name': 'Transport lodowki',
+                            'description': 'Wolkanizacja opon.', 'city_from': 'Gdansk',
+                            'city_to': 'Sopot'})
+    request.user = random_user
+    v.CreateDeliveryOfferView().post(request)
+    substring_offer = m.DeliveryOffer.objects.get(name='Transport lodowki')
+
+    # Whole word 'wolka' ranks before a 'wolkanizacja' substring hit.
+    assert list(m.DeliveryOffer.filter_searchbar_query('wolka')) == [
+        random_delivery_offer, substring_offer
+    ]
+
+    # The dashboard keeps the ranking from page to page, newer offers do not jump ahead.
+    settings.DELIVERY_OFFERS_PER_PAGE = 1
+    first = client.get('/dashboard/', {'search': 'wolka'}).context['page']
+    second = client.get('/dashboard/', {'search': 'wolka', 'cursor': first.next_cursor}).context['page']
+    assert [*first, *second] == [random_delivery_offer, substring_offer]
+    assert second.next_cursor is None
+
+
+@pytest.mark.django_db
+def test_search_index_sees_other_processes(random_delivery_offer, random_user):
+    search.get_search_backend().invalidate()
+    assert not m.DeliveryOffer.filter_searchbar_query('lodowki').exists()
+
+    # Written by another process: no signals here, only the shared generation changes.
+    delivery_info = random_delivery_offer.delivery_info
+    delivery_info.pk = None
+    delivery_info.save()
+    offer = m.DeliveryOffer(owner=random_user, delivery_info=delivery_info, name='Transport lodowki', wage=10,
+                            distance=1)
+    offer.search_document = search.build_search_document(offer)
+    m.DeliveryOffer.objects.bulk_create([offer])
+    search._bump_results_generation()
+    assert [o.name for o in m.DeliveryOffer.filter_searchbar_query('lodowki')] == ['Transport lodowki']
+
+
+@pytest.mark.django_db
+def test_search_delivery_offer_index_update(client, random_delivery_offer, random_user):
+    client.force_login(random_user)
+    client.post(f'/dashboard/delivery-detail/modify/{random_delivery_offer.id}/',
+                {**WOOD_TRANSPORT, 'city_from': 'Gdańsk'})
+
+    assert list(m.DeliveryOffer.filter_searchbar_query('gdansk')) == [random_delivery_offer]
+
+    client.get(f'/dashboard/delivery-detail/delete/{random_delivery_offer.id}/')
+    assert not m.DeliveryOffer.filter_searchbar_query('gdansk').exists()
+
+
+@pytest.mark.django_db
+def test_search_result_cache(client, random_delivery_offer, random_user, django_assert_num_queries):
+    response = client.get('/dashboard/', {'search': 'Kozia'})
+    assert response.status_code == 200
+    assert 'search' not in response.cookies
+    assert list(response.context['all_delivery_offers']) == [random_delivery_offer]
+
+    # Another spelling of a cached query skips the search query, leaving the page keys and rows.
+    with django_assert_num_queries(2):
+        response = client.get('/dashboard/api/offers/', {'search': ' KÓZIA '})
+    assert [offer['id'] for offer in response.json()['offers']] == [random_delivery_offer.id]
+
+    # Other pages link their search form straight to the dashboard.
+    response = client.get(f'/dashboard/delivery-detail/{random_delivery_offer.id}/', {'search': 'Kozia'})
+    assert response.status_code == 200
+
+    # An edit invalidates the cached results.
+    assert not list(client.get('/dashboard/', {'search': 'gdansk'}).context['all_delivery_offers'])
+    client.force_login(random_user)
+    client.post(f'/dashboard/delivery-detail/modify/{random_delivery_offer.id}/',
+                {**WOOD_TRANSPORT, 'city_from': 'Gdańsk'})
+    assert list(client.get('/dashboard/', {'search': 'gdansk'}).context['all_delivery_offers']) == [
+        random_delivery_offer
+    ]
+
+
+@pytest.mark.django_db
+def test_dashboard_keyset_pagination(client, settings, random_delivery_offer, random_user):
+    settings.DELIVERY_OFFERS_PER_PAGE = 2
+    for i in range(4):
+        m.DeliveryOffer.objects.create(
+            owner=random_user,
+            delivery_info=m.DeliveryInfo.objects.create(**{
+                field: WOOD_TRANSPORT[field] for field in (
+                    'city_from', 'street_from', 'street_from_number',
+                    'city_to', 'street_to', 'street_to_number', 'extras')
+            }),
+            name=f'Oferta {i}',
+            wage=10,
+            distance=1,
+        )
+    m.DeliveryOffer.objects.filter(name='Oferta 1').update(is_active=0)
+    expected = list(m.DeliveryOffer.objects.filter(is_active=1).order_by('-date_added', '-id'))
+
+    first = client.get('/dashboard/').context['page']
+    assert list(first) == expected[:2]
+    assert first.has_next and not first.has_previous
+
+    second = client.get('/dashboard/', {'cursor': first.next_cursor}).context['page']
+    assert list(second) == expected[2:]
+    assert not second.has_next and second.has_previous
+
+    previous = client.get('/dashboard/', {'cursor': second.previous_cursor}).context['page']
+    assert list(previous) == expected[:2]
+    assert not previous.has_previous
+
+    tampered = client.get('/dashboard/', {'cursor': first.next_cursor[:-2]}).context['page']
+    assert list(tampered) == expected[:2]
+
+
+@pytest.mark.django_db
+def test_listing_views_constant_queries(client, random_user, random_user2, random_delivery_offer):
+    for i in range(25):
+        delivery_offer = m.DeliveryOffer.objects.create(
+            owner=random_user2 if i % 2 else random_user,
+            contractor=random_user2,
+            delivery_info=m.DeliveryInfo.objects.create(
+                city_from='Kozia wolka', street_from='Polna', street_from_number=i,
+                city_to='Gdansk', street_to='Dluga', street_to_number=i, extras=''
+            ),
+            name=f'Oferta {i}',
+            wage=10,
+            distance=1,
+        )
+        m.UserBid.objects.create(owner=random_user2, value=i + 1, delivery_offer=random_delivery_offer)
+        m.Message.objects.create(content=f'Wiadomosc {i}', delivery_offer=delivery_offer,
+                                 message_from=random_user2, message_to=random_user)
+
+    client.force_login(random_user)
+
+    # Budgets are enforced by the raise_on_query_budget fixture.
+    for url in ('/dashboard/',
+                '/dashboard/?search=oferta',
+                '/dashboard/user/delivery-offers/',
+                f'/dashboard/delivery-detail/{random_delivery_offer.id}/',
+                f'/dashboard/user/delivery-offers/{delivery_offer.id}/contact/'):
+        assert client.get(url).status_code == 200
+
+
+@pytest.mark.django_db
+def test_query_budget_exceeded(settings, random_user, random_user2):
+    @query_budget(1)
+    def two_queries():
+        return list(m.User.objects.all()), list(m.DeliveryOffer.objects.all())
+
+    with pytest.raises(QueryBudgetExceeded):
+        two_queries()
+
+    settings.QUERY_BUDGET_MODE = 'log'
+    assert two_queries()
+
+
+@pytest.mark.django_db
+def test_bid_aggregates(random_delivery_offer, random_user2):
+    for value in (45.99, 120, 9.5, 100):
+        m.UserBid.objects.create(owner=random_user2, value=value,
+                                 delivery_offer=random_delivery_offer)
+    random_delivery_offer.refresh_from_db()
+
+    assert random_delivery_offer.bid_count == 4
+    assert float(random_delivery_offer.min_bid) == 9.5
+    assert float(random_delivery_offer.max_bid) == 120
+    assert random_delivery_offer.last_bid_at == random_delivery_offer.userbid_set.latest('date_added').date_added
+
+    random_delivery_offer.userbid_set.get(value=9.5).delete()
+    random_delivery_offer.refresh_from_db()
+    assert random_delivery_offer.bid_count == 3
+    assert float(random_delivery_offer.min_bid) == 45.99
+
+    # Stale in-memory offer must not overwrite the aggregates.
+    stale_offer = m.DeliveryOffer.objects.get(pk=random_delivery_offer.pk)
+    m.UserBid.objects.create(owner=random_user2, value=1, delivery_offer=random_delivery_offer)
+    stale_offer.get_instance_update(name='Transport szafy')
+    random_delivery_offer.refresh_from_db()
+    assert random_delivery_offer.bid_count == 4
+    assert float(random_delivery_offer.min_bid) == 1
+
+    m.DeliveryOffer.objects.update(bid_count=0, min_bid=None, max_bid=None)
+    call_command('rebuild_bid_aggregates')
+    random_delivery_offer.refresh_from_db()
+    assert random_delivery_offer.name == 'Transport szafy'
+    assert random_delivery_offer.bid_count == 4
+    assert float(random_delivery_offer.min_bid) == 1
+    assert float(random_delivery_offer.max_bid) == 120
+
+    # Queryset deletes skip UserBid.delete.
+    random_delivery_offer.userbid_set.filter(value__lt=100).delete()
+    random_delivery_offer.refresh_from_db()
+    assert random_delivery_offer.bid_count == 2
+    assert float(random_delivery_offer.min_bid) == 100
+
+    # So do cascades of deleted bidders, bids of a deleted offer are not even loaded.
+    random_user2.delete()
+    random_delivery_offer.refresh_from_db()
+    assert random_delivery_offer.bid_count == 0 and random_delivery_offer.min_bid is None
+    m.UserBid.objects.create(owner=random_delivery_offer.owner, value=1, delivery_offer=random_delivery_offer)
+    with CaptureQueriesContext(connection) as queries:
+        random_delivery_offer.delete()
+    assert not any('SELECT' in query['sql'] and 'userbid' in query['sql'] for query in queries.captured_queries)
+
+
+@pytest.mark.django_db
+def test_place_bids_batch(random_delivery_offer, random_user, random_user2, django_assert_num_queries):
+    closed_offer = m.DeliveryOffer.objects.create(
+        owner=random_user, delivery_info=m.DeliveryInfo.objects.create(
+            city_from='Kraków', street_from='Polna', street_from_number=1,
+            city_to='Kraków', street_to='Długa', street_to_number=2, extras='',
+        ),
+        name='Transport szafy', wage=10, distance=1, is_active=0,
+    )
+    m.OutboxEvent.objects.all().delete()
+
+    # Savepoint, aggregates of both offers, bids insert, events insert, release.
+    with django_assert_num_queries(6):
+        placed = bids.place_bids(
+            [m.UserBid(owner=random_user2, value=value, delivery_offer_id=random_delivery_offer.pk)
+             for value in ('45.99', '120', '9.50')]
+            + [m.UserBid(owner=random_user2, value=5, delivery_offer_id=closed_offer.pk)]
+        )
+    assert [user_bid.delivery_offer_id for user_bid in placed] == [random_delivery_offer.pk] * 3
+    assert not closed_offer.userbid_set.exists()
+    assert m.OutboxEvent.objects.filter(kind=m.OutboxEvent.Kind.BID_PLACED).count() == 3
+
+    with django_assert_num_queries(5):
+        assert bids.place_bid(random_delivery_offer.pk, random_user2, '50')
+    assert bids.place_bid(closed_offer.pk, random_user2, '50') is None
+
+    fields = ('bid_count', 'min_bid', 'max_bid', 'last_bid_at')
+    random_delivery_offer.refresh_from_db()
+    aggregates = [getattr(random_delivery_offer, name) for name in fields]
+    m.DeliveryOffer.rebuild_bid_aggregates()
+    random_delivery_offer.refresh_from_db()
+    assert aggregates == [getattr(random_delivery_offer, name) for name in fields]
+    assert aggregates[0] == 4 and float(aggregates[1]) == 9.5
+
+
+@pytest.mark.django_db
+def test_outbox_notification_fanout(random_delivery_offer, random_user, random_user2,
+                                    django_assert_num_queries):
+    for value in (10, 20, 30):
+        user_bid = m.UserBid.objects.create(owner=random_user2, value=value,
+                                            delivery_offer=random_delivery_offer)
+    assert random_delivery_offer.accept_bid(user_bid)
+
+    assert not m.Notification.objects.exists()
+    assert m.OutboxEvent.objects.count() == 4
+
+    # Savepoint, events, offers, users, notifications insert,
+    # unread counters update, events delete, release.
+    with django_assert_num_queries(8):
+        assert outbox.drain(batch_size=100) == 4
+
+    assert not m.OutboxEvent.objects.exists()
+    assert list(random_user.notification_set.order_by('pk').values_list('title', flat=True)) == [
+        '"@Transport Mebli" Użytkownik Pietaszek złożył ofertę (10 zł).',
+        '"@Transport Mebli" Użytkownik Pietaszek złożył ofertę (20 zł).',
+        '"@Transport Mebli" Użytkownik Pietaszek złożył ofertę (30 zł).',
+        "'@Transport Mebli' Zaakceptowales oferte uzytkownika Pietaszek (30 zł).",
+    ]
+    assert list(random_user2.notification_set.values_list('title', flat=True)) == [
+        "'@Transport Mebli' Twoja oferta zostala zaakceptowana przez Draven.",
+    ]
+
+    call_command('process_outbox', '--once')
+    assert m.Notification.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_notification_feed_unread_counter(client, settings, random_user, random_user2,
+                                          random_delivery_offer, random_user_notification):
+    settings.NOTIFICATIONS_PER_PAGE = 2
+    for value in (10, 20):
+        m.UserBid.objects.create(owner=random_user2, value=value,
+                                 delivery_offer=random_delivery_offer)
+    outbox.drain()
+    random_user.refresh_from_db()
+    assert random_user.unread_notifications == 3
+
+    client.force_login(random_user)
+    first = client.get('/dashboard/user/notifications/').json()
+    assert first['unread'] == 3
+    assert len(first['notifications']) == 2
+    second = client.get('/dashboard/user/notifications/', {'cursor': first['next_cursor']}).json()
+    assert [n['id'] for n in second['notifications']] == [random_user_notification.id]
+    assert second['next_cursor'] is None
+
+    dashboard = client.get('/dashboard/')
+    assert len(dashboard.context['notifications']) == 2
+    assert b'notification-unread">3<' in dashboard.content
+
+    client.get(f'/dashboard/user/notifications/{random_user_notification.id}/delete/')
+    random_user.refresh_from_db()
+    assert random_user.unread_notifications == 2
+
+    # A notification counted but committed after the UPDATE stays counted.
+    m.User.add_unread_notifications({random_user.pk: 1})
+    response = client.post('/dashboard/user/notifications/read/', {'next': 'https://evil.example/'})
+    assert response.url == '/dashboard/'
+    random_user.refresh_from_db()
+    assert random_user.unread_notifications == 1
+    assert not random_user.notification_set.filter(is_read=False).exists()
+    m.User.objects.filter(pk=random_user.pk).update(unread_notifications=0)
+    response = client.post('/dashboard/user/notifications/read/', {'next': '/dashboard/user/delivery-offers/'})
+    assert response.url == '/dashboard/user/delivery-offers/'
+
+    m.Notification.objects.create(delivery_offer=random_delivery_offer, user=random_user, title='Nowe')
+    client.get(f'/dashboard/delivery-detail/delete/{random_delivery_offer.id}/')
+    random_user.refresh_from_db()
+    assert random_user.unread_notifications == 0
+
+
+@pytest.mark.django_db
+def test_chat_messages_api(client, settings, random_user, random_user2,
+                           random_delivery_offer, random_user_message):
+    settings.CHAT_LONG_POLL_TIMEOUT = 0.1
+    url = f'/dashboard/user/delivery-offers/{random_delivery_offer.id}/messages/'
+    # Without a contractor the owner has nobody to write to.
+    client.force_login(random_delivery_offer.owner)
+    assert client.post(url, {'content': 'Halo'}).status_code == 403
+    client.logout()
+    m.DeliveryOffer.objects.filter(pk=random_delivery_offer.pk).update(contractor=random_user2)
+
+    assert client.get(url).status_code == 403
+
+    client.force_login(random_user2)
+    response = client.post(url, {'content': 'Dzien dobry'})
+    assert response.status_code == 201
+    reply = response.json()['message']
+    assert reply['message_from'] == random_user2.username
+    assert m.Message.objects.get(pk=reply['id']).message_to == random_user
+
+    messages = client.get(url, {'after': random_user_message.id}).json()['messages']
+    assert [message['id'] for message in messages] == [reply['id']]
+
+    # Long poll without new messages gives up after the timeout.
+    assert client.get(url, {'after': reply['id'], 'wait': 1}).json() == {'messages': []}
+
+
+@pytest.mark.django_db
+def test_chat_websocket(client, settings, random_user, random_user2, random_delivery_offer):
+    settings.CHAT_POLL_INTERVAL = 0.05
+    m.DeliveryOffer.objects.filter(pk=random_delivery_offer.pk).update(contractor=random_user2)
+    client.force_login(random_user)
+    scope = {
+        'type': 'websocket',
+        'path': f'/ws/chat/{random_delivery_offer.id}/',
+        'query_string': b'after=0',
+        'headers': [(b'cookie', f'sessionid={client.cookies["sessionid"].value}'.encode())],
+    }
+
+    @async_to_sync
+    async def talk():
+        communicator = ApplicationCommunicator(ChatWebSocketApp(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        assert (await communicator.receive_output(1))['type'] == 'websocket.accept'
+
+        await communicator.send_input({'type': 'websocket.receive', 'text': '{"content": "Czesc"}'})
+        pushed = await communicator.receive_output(1)
+        await communicator.send_input({'type': 'websocket.disconnect'})
+        await communicator.wait(1)
+        return pushed
+
+    pushed = talk()
+    assert pushed['type'] == 'websocket.send'
+    assert [message['content'] for message in json.loads(pushed['text'])['messages']] == ['Czesc']
+    assert random_user2.message_to.get().content == 'Czesc'
+
+    # A malformed after sends the whole history, like the messages API.
+    scope['query_string'] = b'after=abc'
+
+    @async_to_sync
+    async def history():
+        communicator = ApplicationCommunicator(ChatWebSocketApp(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        assert (await communicator.receive_output(1))['type'] == 'websocket.accept'
+        pushed = await communicator.receive_output(1)
+        await communicator.send_input({'type': 'websocket.disconnect'})
+        await communicator.wait(1)
+        return pushed
+
+    assert [message['content'] for message in json.loads(history()['text'])['messages']] == ['Czesc']
+
+    # Users outside of the chat are refused.
+    client.force_login(m.User.objects.create_user(username='Obcy', password='random123'))
+    scope['headers'] = [(b'cookie', f'sessionid={client.cookies["sessionid"].value}'.encode())]
+
+    @async_to_sync
+    async def refused():
+        communicator = ApplicationCommunicator(ChatWebSocketApp(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        return await communicator.receive_output(1)
+
+    assert refused() == {'type': 'websocket.close', 'code': 4403}
+
+
+@pytest.mark.django_db
+def test_chat_history_window(client, settings, random_user, random_user2, random_delivery_offer):
+    settings.CHAT_HISTORY_PAGE_SIZE = 3
+    m.DeliveryOffer.objects.filter(pk=random_delivery_offer.pk).update(contractor=random_user2)
+    messages = [
+        m.Message.objects.create(content=f'Wiadomosc {i}', delivery_offer=random_delivery_offer,
+                                 message_from=random_user, message_to=random_user2)
+        for i in range(7)
+    ]
+    client.force_login(random_user)
+
+    response = client.get(f'/dashboard/user/delivery-offers/{random_delivery_offer.id}/contact/')
+    page = response.context['all_messages']
+    assert list(page) == messages[:-4:-1]
+    assert response.context['last_message_id'] == messages[-1].id
+
+    url = f'/dashboard/user/delivery-offers/{random_delivery_offer.id}/messages/'
+    older = client.get(url, {'cursor': page.next_cursor}).json()
+    assert [message['id'] for message in older['messages']] == [message.id for message in messages[3:0:-1]]
+    oldest = client.get(url, {'cursor': older['next_cursor']}).json()
+    assert [message['id'] for message in oldest['messages']] == [messages[0].id]
+    assert oldest['next_cursor'] is None
+
+
+@pytest.mark.django_db
+def test_dashboard_fragment_cache(client, random_delivery_offer, random_user, random_user2):
+    client.force_login(random_user)
+    assert 'Transport Mebli' in client.get('/dashboard/').content.decode()
+
+    # Bypassing save() does not invalidate the card, so it is served from cache.
+    m.DeliveryOffer.objects.filter(pk=random_delivery_offer.pk).update(name='Transport szafy')
+    assert 'Transport Mebli' in client.get('/dashboard/').content.decode()
+
+    random_delivery_offer.refresh_from_db()
+    random_delivery_offer.get_instance_update(name='Transport komody')
+    content = client.get('/dashboard/').content.decode()
+    assert 'Transport Mebli' not in content
+    assert 'Transport komody' in content
+
+    m.UserBid.objects.create(owner=random_user2, value=30, delivery_offer=random_delivery_offer)
+    assert '(od 30,00 zł)' in client.get('/dashboard/').content.decode()
+
+    random_delivery_offer.delivery_info.get_instance_update(city_from='Chrzanów')
+    assert 'Chrzanów' in client.get('/dashboard/').content.decode()
+
+    # Bulk delete skips UserBid.delete, the rebuild command drops every card.
+    m.UserBid.objects.all().delete()
+    call_command('rebuild_bid_aggregates')
+    assert '(od 30,00 zł)' not in client.get('/dashboard/').content.decode()
+
+
+@pytest.mark.django_db
+def test_dashboard_pickup_radius_filter(client, random_delivery_offer, random_user):
+    client.force_login(random_user)
+    client.post('/dashboard/add-delivery-offer/', data=WOOD_TRANSPORT)
+    wood_offer = m.DeliveryOffer.objects.get(name=WOOD_TRANSPORT['name'])
+
+    # Coordinates pasted into extras win over the gazetteer.
+    assert (wood_offer.delivery_info.lat_from, wood_offer.delivery_info.lon_from) == (54.234523, 23.53424)
+    assert random_delivery_offer.delivery_info.geohash_from == ''
+
+    random_delivery_offer.delivery_info.get_instance_update(city_from='Kraków')
+    assert random_delivery_offer.delivery_info.geohash_from == geo.geohash(*geo.gazetteer()['krakow'])
+
+    response = client.get('/dashboard/', {'near': 'krakow', 'radius': 15})
+    assert list(response.context['all_delivery_offers']) == [random_delivery_offer]
+
+    response = client.get('/dashboard/', {'near': '54.2, 23.5', 'radius': 5})
+    assert list(response.context['all_delivery_offers']) == [wood_offer]
+
+    response = client.get('/dashboard/', {'near': 'Wieliczka'})
+    assert response.context['near_error']
+    assert len(response.context['all_delivery_offers']) == 2
+
+
+@pytest.mark.django_db
+def test_radius_query_matches_haversine(random_user):
+    rng = random.Random(11)
+    delivery_infos = []
+    for _ in range(500):
+        lat, lon = 50.0647 + rng.uniform(-0.5, 0.5), 19.9450 + rng.uniform(-0.8, 0.8)
+        delivery_infos.append(m.DeliveryInfo(
+            city_from='', city_to='', street_from='', street_to='',
+            street_from_number=1, street_to_number=1, extras='',
+            lat_from=lat, lon_from=lon, geohash_from=geo.geohash(lat, lon),
+        ))
+    m.DeliveryInfo.objects.bulk_create(delivery_infos)
+
+    for radius in (1, 15, 50):
+        expected = {
+            delivery_info.pk for delivery_info in m.DeliveryInfo.objects.all()
+            if geo.haversine_km(50.0647, 19.9450, delivery_info.lat_from, delivery_info.lon_from) <= radius
+        }
+        found = geo.within(m.DeliveryInfo.objects.all(), 50.0647, 19.9450, radius, prefix='')
+        assert set(found.values_list('pk', flat=True)) == expected
+
+
+@pytest.mark.django_db
+def test_delivery_offers_import_export(client, random_user, random_user2, tmp_path):
+    client.force_login(random_user)
+    rows = [
+        WOOD_TRANSPORT,
+        {**WOOD_TRANSPORT, 'name': 'Transport szafy', 'wage': '12.345'},
+        {**WOOD_TRANSPORT, 'name': '', 'street_to_number': 'dwa'},
+        {**WOOD_TRANSPORT, 'name': 'Transport biurka', 'city_from': 'Kraków'},
+    ]
+    body = ''.join(json.dumps(row) + '\n' for row in rows) + 'nie json\n'
+    response = client.post('/dashboard/delivery-offers/import/?format=jsonl', data=body,
+                           content_type='application/x-ndjson')
+
+    assert response.status_code == 201
+    assert response.json()['created'] == 2
+    assert [error['line'] for error in response.json()['errors']] == [2, 3, 5]
+    assert response.json()['errors'][0]['errors'] == ['Podaj poprawny format ceny (Max 2 cyfry po przecinku).']
+    assert list(m.DeliveryOffer.filter_searchbar_query('biurka')) == [
+        m.DeliveryOffer.objects.get(name='Transport biurka')
+    ]
+
+    response = client.get('/dashboard/delivery-offers/export/?format=csv')
+    assert response.streaming
+    export = b''.join(response.streaming_content).decode()
+    assert export.splitlines()[0].startswith('id,date_added,is_active,name')
+
+    # An export is a valid import, here read in chunks of one row.
+    path = tmp_path / 'offers.csv'
+    path.write_text(export, encoding='utf-8')
+    call_command('import_delivery_offers', str(path), owner=random_user2.username, chunk_size=1)
+    imported = m.DeliveryOffer.objects.filter(owner=random_user2).select_related('delivery_info')
+    assert sorted(imported.values_list('name', flat=True)) == ['Transport Drewna.', 'Transport biurka']
+    assert imported.get(name='Transport biurka').delivery_info.city_from == 'Kraków'
+
+
+@pytest.mark.django_db
+def test_delivery_offers_import_rejects_non_finite(client, random_user):
+    client.force_login(random_user)
+    rows = [{**WOOD_TRANSPORT, 'wage': 'nan'}, {**WOOD_TRANSPORT, 'distance': 'inf'}, WOOD_TRANSPORT]
+    body = ''.join(json.dumps(row) + '\n' for row in rows)
+    response = client.post('/dashboard/delivery-offers/import/?format=jsonl', data=body,
+                           content_type='application/x-ndjson')
+
+    assert response.status_code == 201
+    assert response.json()['created'] == 1
+    assert response.json()['errors'] == [
+        {'line': 1, 'errors': ['Pole wage ma niepoprawną wartość.']},
+        {'line': 2, 'errors': ['Pole distance ma niepoprawną wartość.']},
+    ]
+
+
+# The view runs in a thread of the ASGI handler, outside of the test transaction.
+@pytest.mark.django_db(transaction=True)
+def test_delivery_offers_export_asgi(client, random_user, random_delivery_offer):
+    from MyProject.asgi import application
+
+    client.force_login(random_user)
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/dashboard/delivery-offers/export/',
+        'query_string': b'format=csv', 'server': ('testserver', 80),
+        'headers': [(b'host', b'testserver'),
+                    (b'cookie', f'sessionid={client.cookies["sessionid"].value}'.encode())],
+    }
+
+    @async_to_sync
+    async def export():
+        communicator = ApplicationCommunicator(application, scope)
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(1)
+        body = b''
+        while (message := await communicator.receive_output(1)).get('more_body'):
+            body += message['body']
+        return start['status'], body.decode()
+
+    # The export queries run outside of the event loop.
+    status, body = export()
+    assert status == 200
+    assert [row.split(',')[3] for row in body.splitlines()] == ['name', random_delivery_offer.name]
+
+
+@pytest.mark.django_db
+def test_offers_api_conditional_get(client, random_delivery_offer, random_user2, django_assert_num_queries):
+    response = client.get('/dashboard/api/offers/')
+    assert response.status_code == 200
+    assert response.json()['offers'][0]['name'] == 'Transport Mebli'
+    assert response.json()['offers'][0]['city_from'] == 'Kozia wolka'
+    etag = response['ETag']
+    assert etag.startswith('"') and response.has_header('Last-Modified')
+
+    # Unchanged data is answered from the page keys alone.
+    with django_assert_num_queries(1):
+        response = client.get('/dashboard/api/offers/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+
+    detail_url = f'/dashboard/api/offers/{random_delivery_offer.pk}/'
+    bids_url = f'/dashboard/api/offers/{random_delivery_offer.pk}/bids/'
+    detail = client.get(detail_url)
+    bid_list = client.get(bids_url)
+    assert detail.json()['offer']['street_from'] == 'Budapren'
+    assert bid_list.json()['bids'] == []
+    with django_assert_num_queries(1):
+        assert client.get(detail_url, HTTP_IF_NONE_MATCH=detail['ETag']).status_code == 304
+    assert client.get(bids_url, HTTP_IF_MODIFIED_SINCE=bid_list['Last-Modified']).status_code == 304
+
+    # A bid changes the list, the detail and the bids.
+    m.UserBid.objects.create(owner=random_user2, value=30, delivery_offer=random_delivery_offer)
+    response = client.get('/dashboard/api/offers/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['offers'][0]['bid_count'] == 1
+    assert client.get(detail_url, HTTP_IF_NONE_MATCH=detail['ETag']).status_code == 200
+    response = client.get(bids_url, HTTP_IF_NONE_MATCH=bid_list['ETag'])
+    assert response.json()['bids'][0]['owner'] == random_user2.username
+
+    # So does an edit of the delivery info.
+    detail = client.get(detail_url)
+    random_delivery_offer.delivery_info.get_instance_update(street_from='Polna')
+    response = client.get(detail_url, HTTP_IF_NONE_MATCH=detail['ETag'])
+    assert response.json()['offer']['street_from'] == 'Polna'
+
+    assert client.get('/dashboard/api/offers/0/').status_code == 404
+
+
+def photo_upload(name='photo.jpg'):
+    """Large JPEG with EXIF orientation and camera tags, like a phone photo."""
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    exif[0x010F] = 'PhoneMaker'
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 800), 'red').save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@pytest.mark.django_db
+def test_avatar_pipeline(client, settings, tmp_path, random_user, random_user2):
+    settings.MEDIA_ROOT = tmp_path
+    for user in (random_user, random_user2):
+        user.profile = m.UserProfile.objects.create()
+        user.save()
+
+    client.force_login(random_user)
+    client.post('/dashboard/user/profile/update/', {
+        'first_name': '', 'last_name': '', 'email': 'draven@topor.com', 'avatar': photo_upload(),
+    })
+    profile = m.UserProfile.objects.get(user=random_user)
+    assert profile.avatar_hash and not profile.avatar_ready
+    assert default_storage.exists(f'avatars/pending/{profile.avatar_hash}')
+
+    call_command('process_avatars')
+    profile.refresh_from_db()
+    assert profile.avatar_ready
+    assert not default_storage.exists(f'avatars/pending/{profile.avatar_hash}')
+
+    with default_storage.open(f'avatars/{profile.avatar_hash[:2]}/{profile.avatar_hash}/256.jpg') as file:
+        with Image.open(file) as thumbnail:
+            # Rotated by the EXIF orientation, which is stripped with the rest of EXIF.
+            assert thumbnail.size == (256, 256)
+            assert not thumbnail.getexif()
+    content = client.get('/dashboard/user/profile/').content.decode()
+    assert f'{profile.avatar_hash}/128.webp' in content
+    assert f'{profile.avatar_hash}/40.webp' in content
+
+    # The same photo uploaded again is stored once and ready right away.
+    client.force_login(random_user2)
+    client.post('/dashboard/user/profile/update/', {
+        'first_name': '', 'last_name': '', 'email': 'pietaszek@topor.com', 'avatar': photo_upload('copy.jpg'),
+    })
+    profile2 = m.UserProfile.objects.get(user=random_user2)
+    assert profile2.avatar_ready and profile2.avatar_hash == profile.avatar_hash
+    assert len(list((tmp_path / 'avatars').rglob('*.*'))) == 6
+
+    response = client.post('/dashboard/user/profile/update/', {
+        'first_name': '', 'last_name': '', 'email': 'pietaszek@pila.com',
+        'avatar': SimpleUploadedFile('avatar.jpg', b'not an image', content_type='image/jpeg'),
+    }, follow=True)
+    assert 'Nieprawidłowy plik obrazu.' in response.content.decode()
+    profile2.refresh_from_db()
+    assert profile2.avatar_hash == profile.avatar_hash
+
+
+@pytest.mark.django_db
+def test_avatar_truncated_upload(client, settings, tmp_path, random_user, random_user2):
+    settings.MEDIA_ROOT = tmp_path
+    images = {random_user: Image.effect_noise((300, 300), 60), random_user2: Image.new('RGB', (300, 300))}
+    for user, image in images.items():
+        user.profile = m.UserProfile.objects.create()
+        user.save()
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, 'JPEG')
+        # Half of the file passes verify(), decoding fails.
+        data = buffer.getvalue()[:len(buffer.getvalue()) // 2] if user == random_user else buffer.getvalue()
+        client.force_login(user)
+        client.post('/dashboard/user/profile/update/', {
+            'first_name': '', 'last_name': '', 'email': f'{user.username}@topor.com',
+            'avatar': SimpleUploadedFile('avatar.jpg', data, content_type='image/jpeg'),
+        })
+
+    broken, intact = (m.UserProfile.objects.get(user=user) for user in (random_user, random_user2))
+    assert broken.avatar_hash and default_storage.exists(f'avatars/pending/{broken.avatar_hash}')
+
+    # The broken upload is dropped, the avatars after it are still processed.
+    out = io.StringIO()
+    call_command('process_avatars', stdout=out)
+    assert 'Processed 1 avatars.' in out.getvalue()
+    assert not default_storage.exists(f'avatars/pending/{broken.avatar_hash}')
+    broken.refresh_from_db()
+    intact.refresh_from_db()
+    assert broken.avatar_hash == '' and not broken.avatar_ready
+    assert intact.avatar_ready
+
+
+def test_static_files_hashed_and_precompressed(settings, tmp_path, rf):
+    settings.STATIC_ROOT = tmp_path
+    call_command('collectstatic', interactive=False, verbosity=0)
+
+    css_url = staticfiles_storage.url('css/dashboard-style.css')
+    assert css_url != '/static/css/dashboard-style.css'
+    middleware = StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+
+    response = middleware(rf.get(css_url, HTTP_ACCEPT_ENCODING='gzip, deflate, br;q=0'))
+    assert response['Content-Encoding'] == 'gzip'
+    assert response['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response['Content-Type'] == 'text/css; charset=utf-8'
+    assert response['Vary'] == 'Accept-Encoding'
+    body = gzip.decompress(b''.join(response.streaming_content))
+    assert body == (tmp_path / css_url[len('/static/'):]).read_bytes()
+
+    response = middleware(rf.get('/static/css/dashboard-style.css'))
+    assert 'Content-Encoding' not in response
+    assert response['Cache-Control'] == f'public, max-age={settings.STATIC_MAX_AGE}'
+    response = middleware(rf.get('/static/css/dashboard-style.css',
+                                 HTTP_IF_MODIFIED_SINCE=response['Last-Modified']))
+    assert response.status_code == 304
+
+    response = middleware(rf.get(staticfiles_storage.url('images/persons.png'), HTTP_ACCEPT_ENCODING='gzip'))
+    assert 'Content-Encoding' not in response and 'Vary' not in response
+    assert middleware(rf.get('/static/css/missing.css')).status_code == 404
+
+
+@pytest.fixture
+def replica(settings, tmp_path):
+    """Second, empty SQLite database standing in for a lagging replica."""
+    connections.settings['replica'] = {
+        **connections.settings['default'], 'NAME': str(tmp_path / 'replica.sqlite3'), 'TEST': {},
+    }
+    # ReplicaRouter keeps migrations off replicas, they get the schema through replication.
+    routers, settings.DATABASE_ROUTERS = settings.DATABASE_ROUTERS, []
+    call_command('migrate', database='replica', run_syncdb=True, verbosity=0)
+    settings.DATABASE_ROUTERS = routers
+    settings.DATABASE_REPLICAS = ['replica']
+    yield 'replica'
+    connections['replica'].close()
+    del connections['replica']
+    del connections.settings['replica']
+
+
+# Outside of the test transaction, reads inside one always go to the primary.
+@pytest.mark.django_db(transaction=True)
+def test_replica_reads_and_primary_pinning(client, replica, random_delivery_offer, random_user2):
+    # The listing reads from the replica, which has not seen the offer yet.
+    response = client.get('/dashboard/')
+    assert 'Transport Mebli' not in response.content.decode()
+    assert 'pin_primary' not in response.cookies
+
+    # A write pins the client to the primary, so it reads its own bid back.
+    client.force_login(random_user2)
+    response = client.post(f'/dashboard/delivery-detail/{random_delivery_offer.pk}/', {'bid': 45}, follow=True)
+    assert response.redirect_chain and response.status_code == 200
+    assert response.context['bids'][0].value == 45
+    assert 'Transport Mebli' in client.get('/dashboard/').content.decode()
+
+    del client.cookies['pin_primary']
+    assert 'Transport Mebli' not in client.get('/dashboard/').content.decode()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_bid_accepts_notify_once(random_delivery_offer, random_user2):
+    user_bids = [m.UserBid.objects.create(owner=random_user2, value=value, delivery_offer=random_delivery_offer)
+            for value in range(10, 18)]
+    m.OutboxEvent.objects.all().delete()
+    barrier = threading.Barrier(len(user_bids))
+    # The shared in-memory SQLite test database fails concurrent writers right
+    # away instead of waiting, there the UPDATEs take turns.
+    write_lock = threading.Lock() if connection.vendor == 'sqlite' else contextlib.nullcontext()
+
+    def accept(user_bid):
+        # Every request loaded the offer while it was still active.
+        delivery_offer = m.DeliveryOffer.objects.get(pk=random_delivery_offer.pk)
+        barrier.wait()
+        try:
+            with write_lock:
+                return delivery_offer.accept_bid(user_bid)
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=len(user_bids)) as executor:
+        results = list(executor.map(accept, user_bids))
+
+    assert results.count(True) == 1
+    winner = user_bids[results.index(True)]
+    random_delivery_offer.refresh_from_db()
+    assert random_delivery_offer.final_bid == winner.value
+    assert m.OutboxEvent.objects.get().payload['final_bid'] == str(winner.value)
+
+    outbox.drain()
+    assert random_user2.notification_set.filter(title__contains='zaakceptowana').count() == 1
+
+
+@pytest.mark.django_db
+def test_request_metrics(client, async_client, settings, tmp_path, random_delivery_offer):
+    labels = (('view', 'dashboard'), ('method', 'GET'))
+    # Under ASGI the sync view runs in another thread than the middleware.
+    for get in (client.get, async_to_sync(async_client.get)):
+        before = metrics.collect()
+        assert get('/dashboard/').status_code == 200
+        after = metrics.collect()
+
+        def delta(name, sample_labels=labels):
+            return after.get((name, sample_labels), 0) - before.get((name, sample_labels), 0)
+
+        assert delta('http_requests_total', (*labels, ('status', '200'))) == 1
+        assert delta('http_request_duration_seconds_count') == 1
+        assert delta('http_request_duration_seconds_bucket', (*labels, ('le', '+Inf'))) == 1
+        assert delta('http_response_size_bytes_sum') > 1000
+        assert delta('db_queries_total') > 0
+        assert 0 < delta('db_query_duration_seconds_total') < delta('http_request_duration_seconds_sum')
+        assert 0 < delta('template_render_duration_seconds_total') < delta('http_request_duration_seconds_sum')
+
+    # Counters flushed by other workers are added up.
+    settings.METRICS_DIR = str(tmp_path)
+    (tmp_path / '1.json').write_text(json.dumps([['http_requests_total', [*labels, ['status', '200']], 5]]))
+    response = client.get('/metrics')
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    expected = after[('http_requests_total', (*labels, ('status', '200')))] + 5
+    assert f'http_requests_total{{view="dashboard",method="GET",status="200"}} {expected}' in response.content.decode()
+    assert '# TYPE http_request_duration_seconds histogram' in response.content.decode()
+    assert 'db_queries_total{view="a\\"b"} 1\n' in metrics.render({('db_queries_total', (('view', 'a"b'),)): 1})
+
+    assert client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code == 403
+
+
+@pytest.mark.django_db
+def test_request_profiling(client, async_client, settings, monkeypatch, tmp_path, random_delivery_offer,
+                           random_user, random_user2):
+    settings.PROFILING_DIR = str(tmp_path)
+    # Sample on every switch, the dashboard renders in a few milliseconds.
+    settings.PROFILING_SAMPLE_INTERVAL = 0.0001
+    random_user.is_staff = True
+    random_user.save()
+    client.force_login(random_user)
+
+    report = client.get('/dashboard/', {'profile': 'sample'}).json()
+    assert report['view'] == 'dashboard' and report['status_code'] == 200
+    assert report['query_count'] == len(report['queries']) > 0
+    assert any(query['call_site'].startswith('MyApp/views.py:') for query in report['queries'])
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in report['stacks'].splitlines())
+    assert (tmp_path / f"{report['stored_as']}.collapsed").read_text() == report['stacks']
+
+    report = client.get('/dashboard/', HTTP_X_PROFILE='cprofile').json()
+    assert 'function calls' in report['stats']
+
+    # Under ASGI the queries run in the sync_to_async thread.
+    async_client.force_login(random_user)
+    report = async_to_sync(async_client.get)('/dashboard/', {'profile': 'sample'}).json()
+    assert report['query_count'] == len(report['queries']) > 0
+    assert any(query['call_site'].startswith('MyApp/views.py:') for query in report['queries'])
+
+    # Other users, or a forged session cookie, get the page without starting a profiler.
+    def refused(*args, **kwargs):
+        raise AssertionError('profiler started')
+
+    monkeypatch.setattr(profiling, 'Sampler', refused)
+    monkeypatch.setattr(profiling.cProfile, 'Profile', refused)
+    client.force_login(random_user2)
+    response = client.get('/dashboard/', {'profile': 'sample'})
+    assert response['Content-Type'].startswith('text/html')
+    client.logout()
+    client.cookies['sessionid'] = 'forged'
+    assert client.get('/dashboard/', HTTP_X_PROFILE='cprofile')['Content-Type'].startswith('text/html')
+    monkeypatch.undo()
+
+    def busy_loop():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+
+    with profiling.Sampler({threading.get_ident()}) as sampler:
+        busy_loop()
+    assert 'MyApp/tests/MyApp_tests.py:busy_loop' in sampler.collapsed()
+
+
+@pytest.mark.django_db
+def test_seed_marketplace():
+    out = io.StringIO()
+    options = {'offers': 60, 'users': 8, 'seed': 7, 'chunk_size': 25, 'stdout': out}
+    call_command('seed_marketplace', prefix='a', **options)
+    assert 'Seeded 8 users, 60 offers' in out.getvalue()
+    call_command('seed_marketplace', prefix='b', **options)
+
+    # The same seed gives the same offers.
+    runs = [
+        list(m.DeliveryOffer.objects.filter(owner__username__startswith=prefix).order_by('pk').values_list(
+            'name', 'wage', 'bid_count', 'is_active', 'delivery_info__city_from'))
+        for prefix in 'ab'
+    ]
+    assert runs[0] == runs[1] and len(runs[0]) == 60
+
+    # Side effects skipped by bulk_create are made up for.
+    offers = m.DeliveryOffer.objects.all()
+    assert len({offer.date_added for offer in offers}) == 120
+    for offer in offers:
+        bids = list(offer.userbid_set.all())
+        assert offer.bid_count == len(bids)
+        assert offer.min_bid == min((bid.value for bid in bids), default=None)
+        assert all(bid.owner_id != offer.owner_id and bid.date_added >= offer.date_added for bid in bids)
+        assert offer.contractor_id is None or offer.is_active == m.DeliveryOffer.IsActive.NO
+    for user in m.User.objects.all():
+        assert user.unread_notifications == user.notification_set.filter(is_read=False).count()
+    assert m.Message.objects.exists() and not m.OutboxEvent.objects.exists()
+    assert m.DeliveryOffer.filter_searchbar_query(offers[0].name).exists()
+
+    with pytest.raises(CommandError):
+        call_command('seed_marketplace', prefix='a', **options)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_test_journeys(live_server, settings):
+    settings.PASSWORD_HASH_ITERATIONS = 1000
+    seeding.seed_marketplace(seeding.SeedConfig(offers=10, users=3, closed_ratio=0, messages_per_conversation=0))
+
+    stats = loadtest.run_level(live_server.url, users=1, journeys=2)
+    assert stats.journeys == 2 and not stats.failures
+    report = stats.report()
+    for route in ('POST register', 'POST login', 'GET dashboard', 'POST delivery-offer-detail',
+                  'GET user-send-message', 'POST user-chat-messages'):
+        assert report[route]['requests'] and not report[route]['errors']
+    assert report['POST user-chat-messages']['p50_ms'] <= report['POST user-chat-messages']['p99_ms']
+
+    accepted = m.DeliveryOffer.objects.filter(contractor__username__startswith='load')
+    assert accepted.count() == 2
+    assert m.Message.objects.filter(delivery_offer__in=accepted).count() == 4
+
+
+def test_load_test_unexpected_errors(monkeypatch):
+    session = loadtest.Session('http://testserver/', loadtest.Stats())
+
+    def cut_short(*args, **kwargs):
+        raise http.client.IncompleteRead(b'')
+
+    monkeypatch.setattr(session.opener, 'open', cut_short)
+    with pytest.raises(loadtest.JourneyFailed):
+        session.request('GET', '/404/')
+    assert session.stats.report()['GET /404/']['errors'] == 1
+
+    def broken(*args):
+        raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+
+    # The virtual user reports the journey and keeps going.
+    monkeypatch.setattr(loadtest, 'journey', broken)
+    stats = loadtest.run_level('http://testserver/', users=1, journeys=2)
+    assert stats.journeys == 2 and stats.failures == {'unexpected UnicodeDecodeError': 2}
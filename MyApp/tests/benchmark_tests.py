@@ -0,0 +1,214 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+from urllib.parse import urlencode
+
+import pytest
+from django.db import transaction
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client
+from django.urls import URLResolver, get_resolver, reverse
+
+from MyApp import bids
+from MyApp import models as m
+from MyApp import search, seeding
+from MyApp.query_budget import QueryCounter
+
+# Benchmarks are slow, they only run with --benchmark, see conftest.py.
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db]
+
+USERS = 100
+BIDS_PER_OFFER = 2
+BATCH_SIZE = 2000
+REPEAT = 5
+
+
+def get_routes():
+    """(url name, url kwargs names) of every project route, admin excluded."""
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                if not pattern.namespace:
+                    yield from walk(pattern.url_patterns)
+            elif pattern.name:
+                yield pattern.name, tuple(getattr(pattern.pattern, 'converters', {}))
+
+    return sorted(set(walk(get_resolver().url_patterns)))
+
+
+def seed_marketplace(size):
+    """Insert size offers with bids, messages and notifications, see MyApp.seeding."""
+    seeding.seed_marketplace(seeding.SeedConfig(
+        offers=size, users=USERS, seed=size, bids_per_offer=BIDS_PER_OFFER, messages_per_conversation=1,
+        prefix='benchmark', password='benchmark123', chunk_size=BATCH_SIZE,
+    ))
+    user, contractor = m.User.objects.filter(username__in=['benchmark0', 'benchmark1']).order_by('pk')
+
+    delivery_offer = m.DeliveryOffer.objects.filter(owner=user, is_active=1).latest('date_added')
+    m.DeliveryOffer.objects.filter(pk=delivery_offer.pk).update(contractor=contractor)
+    return {
+        'user': user,
+        'url_kwargs': {
+            'delivery_id': delivery_offer.pk,
+            'notification_id': user.notification_set.first().pk,
+        },
+    }
+
+
+@pytest.fixture(scope='module')
+def marketplace(marketplace_size, django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        with transaction.atomic():
+            started = time.perf_counter()
+            data = seed_marketplace(marketplace_size)
+            data['size'] = marketplace_size
+            data['seed_seconds'] = time.perf_counter() - started
+            yield data
+            transaction.set_rollback(True)
+        search.get_search_backend().invalidate()
+
+
+def measure(client, url):
+    """Wall time, query count and peak traced memory of GET url."""
+    timings = []
+    for _ in range(REPEAT):
+        # Every run is rolled back, so mutating routes measure the same data.
+        with transaction.atomic():
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append(time.perf_counter() - started)
+            transaction.set_rollback(True)
+
+    with transaction.atomic():
+        tracemalloc.start()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        transaction.set_rollback(True)
+
+    return {
+        'status_code': response.status_code,
+        'queries': counter.count,
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+
+
+@pytest.mark.parametrize('name, url_kwargs', get_routes())
+def test_route_benchmark(name, url_kwargs, marketplace, benchmark_results):
+    url = reverse(name, kwargs={kwarg: marketplace['url_kwargs'][kwarg] for kwarg in url_kwargs})
+    client = Client()
+    client.force_login(marketplace['user'])
+
+    results = benchmark_results.setdefault(str(marketplace['size']), {})
+    results[name] = measure(client, url)
+    if name == 'dashboard':
+        results['dashboard?search'] = measure(client, f'{url}?search=krakow')
+        results['dashboard?near'] = measure(client, f'{url}?near=Kraków&radius=15')
+
+
+@pytest.mark.parametrize('message_count', [10, 1000, 100000])
+def test_chat_history_benchmark(message_count, benchmark_results,
+                                random_user, random_user2, random_delivery_offer):
+    """Chat page and older history page should not depend on the conversation length."""
+    m.DeliveryOffer.objects.filter(pk=random_delivery_offer.pk).update(contractor=random_user2)
+    for start in range(0, message_count, BATCH_SIZE):
+        m.Message.objects.bulk_create(
+            m.Message(content=f'Wiadomość {i}', delivery_offer=random_delivery_offer,
+                      message_from=random_user2, message_to=random_user)
+            for i in range(start, min(start + BATCH_SIZE, message_count))
+        )
+
+    client = Client()
+    client.force_login(random_user)
+    url = reverse('user-send-message', kwargs={'delivery_id': random_delivery_offer.pk})
+    history_url = reverse('user-chat-messages', kwargs={'delivery_id': random_delivery_offer.pk})
+    next_cursor = client.get(url).context['all_messages'].next_cursor
+
+    results = benchmark_results.setdefault('chat_history', {})
+    results[f'{message_count} messages'] = measure(client, url)
+    if next_cursor:
+        results[f'{message_count} messages older'] = measure(client, f'{history_url}?cursor={next_cursor}')
+
+
+BID_BURST = 2000
+
+
+@pytest.mark.parametrize('batch_size', [1, 100])
+def test_bid_placement_benchmark(batch_size, benchmark_results, random_user2, random_delivery_offer):
+    """Bids per second of a burst on one offer, placed one by one or in batches."""
+    timings = []
+    for _ in range(REPEAT):
+        with transaction.atomic():
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                for start in range(0, BID_BURST, batch_size):
+                    bids.place_bids([
+                        m.UserBid(owner=random_user2, value=Decimal(100 + i) / 100,
+                                  delivery_offer_id=random_delivery_offer.pk)
+                        for i in range(start, start + batch_size)
+                    ])
+                timings.append(time.perf_counter() - started)
+            transaction.set_rollback(True)
+
+    results = benchmark_results.setdefault('bid_placement', {})
+    results[f'batch of {batch_size}'] = {
+        'status_code': 200,
+        'queries': counter.count,
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'peak_memory_kb': 0.0,
+        'bids_per_second': round(BID_BURST / statistics.median(timings), 1),
+    }
+
+
+LOGIN_STORM = 50
+
+
+def test_login_storm_benchmark(benchmark_results, random_user, random_delivery_offer):
+    """Dashboard latency under ASGI, idle and while LOGIN_STORM logins hash their passwords."""
+
+    async def get_dashboard(client, count):
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            await client.get('/dashboard/')
+            timings.append(time.perf_counter() - started)
+            # Let the logins in between.
+            await asyncio.sleep(0.01)
+        return timings
+
+    async def login(client):
+        # Multipart bodies are not read correctly by the Django 4.0 AsyncClient.
+        response = await client.post('/login/', urlencode({'username': random_user.username, 'password': 'random123'}),
+                                     content_type='application/x-www-form-urlencoded')
+        assert response.status_code == 302 and response.url == '/dashboard/'
+
+    async def storm():
+        idle = await get_dashboard(AsyncClient(), REPEAT * 4)
+        started = time.perf_counter()
+        busy, *_ = await asyncio.gather(get_dashboard(AsyncClient(), REPEAT * 4),
+                                        *(login(AsyncClient()) for _ in range(LOGIN_STORM)))
+        return idle, busy, time.perf_counter() - started
+
+    idle, busy, storm_seconds = async_to_sync(storm)()
+    results = benchmark_results.setdefault('login_storm', {})
+    for name, timings in (('dashboard idle', idle), (f'dashboard, {LOGIN_STORM} logins', busy)):
+        results[name] = {
+            'status_code': 200,
+            'queries': 0,
+            'median_ms': round(statistics.median(timings) * 1000, 3),
+            'min_ms': round(min(timings) * 1000, 3),
+            'max_ms': round(max(timings) * 1000, 3),
+            'peak_memory_kb': 0.0,
+        }
+    results[f'dashboard, {LOGIN_STORM} logins']['logins_per_second'] = round(LOGIN_STORM / storm_seconds, 1)
@@ -1,7 +1,90 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
 import pytest
+from django.core.cache import cache
+
 from MyApp import models as m
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmark')
+    group.addoption('--benchmark', action='store_true',
+                    help='Run benchmark_tests.py against large synthetic data.')
+    group.addoption('--benchmark-sizes', default='10000,100000',
+                    help='Comma separated numbers of offers to seed.')
+    group.addoption('--benchmark-json', default='benchmark.json',
+                    help='Where to write the benchmark results.')
+    group.addoption('--benchmark-compare', default=None,
+                    help='Previous benchmark JSON to diff the results against.')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('benchmark'):
+        return
+    skip = pytest.mark.skip(reason='Benchmarks run only with --benchmark.')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_generate_tests(metafunc):
+    if 'marketplace_size' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('benchmark_sizes').split(',')]
+        metafunc.parametrize('marketplace_size', sizes, scope='module')
+
+
+@pytest.fixture(scope='session')
+def benchmark_results(request):
+    results = {}
+    yield results
+    if not results:
+        return
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                            capture_output=True, text=True).stdout.strip()
+    report = {
+        'commit': commit,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'results': results,
+    }
+    with open(request.config.getoption('benchmark_json'), 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    request.config.benchmark_report = report
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    report = getattr(config, 'benchmark_report', None)
+    if not report:
+        return
+
+    baseline = {}
+    if path := config.getoption('benchmark_compare'):
+        with open(path) as file:
+            baseline = json.load(file)
+
+    terminalreporter.section(f"benchmark ({report['commit']})")
+    # Numeric sizes first, in numeric order, other suites after them.
+    for size, routes in sorted(report['results'].items(), key=lambda item: (len(item[0]), item[0])):
+        for name, result in sorted(routes.items()):
+            line = (f"{size:>8} {name:<28} {result['status_code']} "
+                    f"{result['queries']:>4} q {result['median_ms']:>10.2f} ms "
+                    f"{result['peak_memory_kb']:>10.1f} kB")
+            if previous := baseline.get('results', {}).get(size, {}).get(name):
+                line += (f"  | {result['queries'] - previous['queries']:+d} q "
+                         f"{result['median_ms'] / max(previous['median_ms'], 0.001):.2f}x time")
+            for key, value in result.items():
+                if key.endswith('_per_second'):
+                    line += f"  {value:.1f} {key[:-len('_per_second')]}/s"
+            terminalreporter.write_line(line)
+
+
+@pytest.fixture(autouse=True)
+def raise_on_query_budget(settings):
+    settings.QUERY_BUDGET_MODE = 'raise'
+
+
 @pytest.fixture
 def random_user():
     return m.User.objects.create_user(
@@ -73,3 +156,9 @@ def random_user2_bid(random_user2, random_delivery_offer):
         value=45.99,
         delivery_offer=delivery_offer,
     )
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Database rollbacks reuse primary keys, cached fragments must not leak between tests.
+    cache.clear()
@@ -10,9 +10,17 @@ urlpatterns = [
     path('delivery-detail/<int:delivery_id>/', v.DeliveryOfferDetailView.as_view(), name="delivery-offer-detail"),
     path('delivery-detail/modify/<int:delivery_id>/', v.DeliveryOfferModifyView.as_view(), name="delivery-offer-modify"),
     path('delivery-detail/delete/<int:delivery_id>/', v.DeliveryOfferDeleteView.as_view(), name="delivery-offer-delete"),
+    path('delivery-offers/import/', v.DeliveryOfferImportView.as_view(), name="delivery-offers-import"),
+    path('delivery-offers/export/', v.DeliveryOfferExportView.as_view(), name="delivery-offers-export"),
+    path('api/offers/', v.OfferListApiView.as_view(), name="api-offers"),
+    path('api/offers/<int:delivery_id>/', v.OfferDetailApiView.as_view(), name="api-offer-detail"),
+    path('api/offers/<int:delivery_id>/bids/', v.OfferBidsApiView.as_view(), name="api-offer-bids"),
+    path('user/notifications/', v.NotificationFeedView.as_view(), name="user-notifications"),
+    path('user/notifications/read/', v.NotificationMarkReadView.as_view(), name="user-notifications-read"),
     path('user/notifications/<int:notification_id>/delete/', v.NotificationDeleteView.as_view(), name="user-notification-delete"),
     path('user/delivery-offers/', v.UserDeliveryOffer.as_view(), name="user-delivery-offers"),
     path('user/delivery-offers/<int:delivery_id>/contact/', v.UserSendMessageView.as_view(), name="user-send-message"),
+    path('user/delivery-offers/<int:delivery_id>/messages/', v.chat_messages_view, name="user-chat-messages"),
 
     # Errors
     path('Not-allowed/', v.Http405View.as_view(), name="http_405"),
@@ -1,7 +1,7 @@
 from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.utils.module_loading import import_string
 from django.utils.translation import gettext as _
-from MyApp import models as m
+from MyApp import availability
 
 
 def get_login_email_validators(validator_config):
@@ -40,8 +40,7 @@ def validate_login_email(username=None, email=None, user=None, login_email_valid
 
 class LoginExistsValidator:
     def validate(self, username=None, email=None, user=None):
-        user = m.User.objects.all().filter(username=username)
-        if user:
+        if availability.is_taken('username', username):
             raise ValidationError(
                 _("Uzytkownik o podanej nazwie istnieje."),
                 code="user_exists",
@@ -61,8 +60,7 @@ class LoginLengthValidator:
 
 class EmailExistsValidator:
     def validate(self, username=None, email=None, user=None):
-        user = m.User.objects.all().filter(email=email)
-        if user:
+        if availability.is_taken('email', email):
             raise ValidationError(
                 _("Podany adres e-mail zostal juz uzyty w procesie rejestracji."),
                 code="email_exists",
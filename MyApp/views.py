@@ -1,14 +1,25 @@
-from django.contrib.auth import authenticate, login, logout
+import codecs
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import login, logout
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Q
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, HttpResponse
+from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme
 import django.contrib.auth.password_validation as pv
 from django.conf import settings
 from django.views import View
 
+from MyApp import api, availability, avatars, bids, bulk_offers, chat, fragment_cache, geo, metrics, passwords, search
 from MyApp import models as m
+from MyApp.pagination import KeysetPaginator
+from MyApp.db import replica_reads
+from MyApp.query_budget import query_budget
 import MyApp.validators.email_login_validation as elv
 import MyApp.validators.password_equal_validator as pev
 import MyApp.validators.delivery_offer_validator as dov
@@ -23,40 +34,71 @@ class IndexView(View):
 
 
 class DashboardView(View):
+    @replica_reads
+    @query_budget(8)
     def get(self, request):
-        all_delivery_offers = m.DeliveryOffer.objects.all().order_by('-date_added')
-        recent_added = all_delivery_offers.filter(is_active=1)[:3]
+        all_delivery_offers = m.DeliveryOffer.objects.all().filter(
+            is_active=1).select_related('owner', 'delivery_info')
+        recent_added = list(all_delivery_offers.order_by('-date_added')[:3])
 
-        # Search bar query filtering.
-        query = request.GET.get('search')
-        if query or request.COOKIES.get('search'):
-            query = query if query else request.COOKIES.get('search')
-            all_delivery_offers = m.DeliveryOffer.filter_searchbar_query(query)
+        # Search bar query filtering, best matches first.
+        ordering = ('-date_added', '-pk')
+        if query := request.GET.get('search'):
+            all_delivery_offers = search.cached_search(all_delivery_offers, query)
+            ordering = search.SEARCH_ORDERING
+
+        # Pickup location radius filtering.
+        near = request.GET.get('near', '').strip()
+        radius = request.GET.get('radius', '')
+        radius = int(radius) if radius.isdigit() and int(radius) in settings.DELIVERY_OFFER_RADIUS_CHOICES else \
+            settings.DELIVERY_OFFER_DEFAULT_RADIUS
+        near_error = None
+        if near:
+            if location := geo.resolve_place(near):
+                all_delivery_offers = geo.within(all_delivery_offers, *location, radius)
+            else:
+                near_error = 'Nie znaleziono lokalizacji, podaj miasto lub współrzędne.'
+
+        # Only the requested page of offers is fetched.
+        page = KeysetPaginator(all_delivery_offers, settings.DELIVERY_OFFERS_PER_PAGE,
+                               ordering).page(request.GET.get('cursor'))
+
+        # Offer cards are rendered from the fragment cache.
+        fragment_cache.with_versions([*page, *recent_added])
 
         context = {
-            'all_delivery_offers': all_delivery_offers,
-            'recent_added': recent_added
+            'all_delivery_offers': page,
+            'page': page,
+            'search_query': query,
+            'near': near,
+            'radius': radius,
+            'radius_choices': settings.DELIVERY_OFFER_RADIUS_CHOICES,
+            'near_error': near_error,
+            'recent_added': recent_added,
+            'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
         }
         return render(request, 'MyApp/dashboard.html', context=context)
 
 
-class LoginView(View):
-    def get(self, request):
-        if request.user.is_authenticated:
-            return redirect('dashboard')
-        return render(request, 'login.html')
-
-    def post(self, request):
+# Function based, class based views can not be async in Django 4.0.
+async def login_view(request):
+    """
+    Login form. Runs on the event loop under ASGI, the password is checked
+    on the password thread pool, see MyApp.passwords.
+    """
+    if request.method == 'POST':
         username = request.POST.get('username')
         password = request.POST.get('password')
 
-        user = authenticate(username=username, password=password)
+        user = await passwords.authenticate(request, username, password)
         if user:
             # Login User.
-            login(request, user)
+            await sync_to_async(login)(request, user)
 
-            # If previous page detected, redirect directly.
-            if previous_page := request.GET.get('next'):
+            # If previous page detected, redirect directly, only within this site.
+            previous_page = request.GET.get('next')
+            if previous_page and url_has_allowed_host_and_scheme(previous_page, allowed_hosts={request.get_host()},
+                                                                 require_https=request.is_secure()):
                 return redirect(previous_page)
 
             return redirect('dashboard')
@@ -67,6 +109,13 @@ class LoginView(View):
                                  'Niepoprawny Login lub haslo.')
             return redirect('login')
 
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    if await sync_to_async(lambda: request.user.is_authenticated)():
+        return redirect('dashboard')
+    return await sync_to_async(render)(request, 'login.html')
+
 
 class LogoutView(View):
     def get(self, request):
@@ -74,68 +123,98 @@ class LogoutView(View):
         return redirect('login')
 
 
-class RegisterView(View):
-    def get(self, request):
-
-        return render(request, 'register.html')
-
-    def post(self, request):
-        data = request.POST
-        email = data.get('email')
-        username = data.get('username')
-        password = data.get('password')
-        password2 = data.get('password2')
+def validate_registration(email, username, password, password2):
+    """Error messages of the register form, empty if it is valid."""
+    # All validators needed to validate password, username and email.
+    all_password_validators = pv.get_password_validators(settings.AUTH_PASSWORD_VALIDATORS)
+    all_login_email_validators = elv.get_login_email_validators(settings.LOGIN_EMAIL_VALIDATORS)
+
+    # Error messages from all try, except blocks.
+    errors = []
+    try:
+        # Validate password.
+        pv.validate_password(password=password,
+                             password_validators=all_password_validators)
+    except ValidationError as password_errors:
+        errors.extend(password_errors)
+
+    try:
+        # Validate password similarity.
+        pev.PasswordEqualValidator.validate(password=password,
+                                            password2=password2)
+    except ValidationError as password_equal_error:
+        errors.extend(password_equal_error)
+
+    try:
+        # Validate login and email.
+        elv.validate_login_email(
+            username=username,
+            email=email,
+            login_email_validators=all_login_email_validators
+        )
 
-        # All validators needed to validate password, username and email.
-        all_password_validators = pv.get_password_validators(settings.AUTH_PASSWORD_VALIDATORS)
-        all_login_email_validators = elv.get_login_email_validators(settings.LOGIN_EMAIL_VALIDATORS)
+    except ValidationError as login_username_errors:
+        errors.extend(login_username_errors)
+    return errors
 
-        # Error messages from all try, except blocks.
-        errors = []
-        try:
-            # Validate password.
-            pv.validate_password(password=password,
-                                 password_validators=all_password_validators)
-        except ValidationError as password_errors:
-            errors.extend(password_errors)
-
-        try:
-            # Validate password similarity.
-            pev.PasswordEqualValidator.validate(password=password,
-                                                password2=password2)
-        except ValidationError as password_equal_error:
-            errors.extend(password_equal_error)
-
-        try:
-            # Validate login and email.
-            elv.validate_login_email(
-                username=username,
-                email=email,
-                login_email_validators=all_login_email_validators
-            )
-
-        except ValidationError as login_username_errors:
-            errors.extend(login_username_errors)
-
-        # If any errors, loop through adding single error to flash messages.
-        if errors:
-            for error in errors:
-                messages.add_message(request, messages.ERROR, error)
-            return redirect('register')
 
+def create_user(email, username, encoded_password):
+    """Create a user and its profile, the password is already hashed."""
+    with transaction.atomic():
         # Create User profile.
         user_profile = m.UserProfile.objects.create()
 
         # User Instance.
-        user = m.User.objects.create_user(email=email,
-                                          username=username,
-                                          password=password,
-                                          profile=user_profile,
-                                          )
-
-        # After Successful User creation, automatically login.
-        login(request, user)
-        return redirect('dashboard')
+        user = m.User(email=m.User.objects.normalize_email(email),
+                      username=m.User.normalize_username(username),
+                      password=encoded_password,
+                      profile=user_profile,
+                      )
+        user.save()
+    return user
+
+
+async def register_view(request):
+    """Register form, the password is hashed like in login_view."""
+    if request.method == 'GET':
+        return await sync_to_async(render)(request, 'register.html')
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    data = request.POST
+    email = data.get('email')
+    username = data.get('username')
+    password = data.get('password')
+    password2 = data.get('password2')
+
+    # If any errors, loop through adding single error to flash messages.
+    if errors := await sync_to_async(validate_registration)(email, username, password, password2):
+        for error in errors:
+            messages.add_message(request, messages.ERROR, error)
+        return redirect('register')
+
+    user = await sync_to_async(create_user)(email, username, await passwords.make_password(password))
+    user.backend = passwords.MODEL_BACKEND
+
+    # After Successful User creation, automatically login.
+    await sync_to_async(login)(request, user)
+    return redirect('dashboard')
+
+
+class AvailabilityView(View):
+    error_messages = {
+        'username': 'Uzytkownik o podanej nazwie istnieje.',
+        'email': 'Podany adres e-mail zostal juz uzyty w procesie rejestracji.',
+    }
+
+    def get(self, request):
+        # Checked as the register form is typed in, see MyApp.availability.
+        result = {}
+        for field in availability.FIELDS:
+            if value := request.GET.get(field, '').strip():
+                available = availability.is_available(field, value)
+                result[field] = {'available': available, 'message': None if available else self.error_messages[field]}
+        return JsonResponse(result)
 
 
 class UserProfile(View):
@@ -160,12 +239,10 @@ class UserProfileUpdate(LoginRequiredMixin, View):
         avatar = request.FILES.get('avatar')
 
         errors = []
-        email_exists = m.User.objects.all().filter(email=email)
-        if email_exists:
-            errors.append('Podany e-mail istnieje.')
-
         if not email:
             errors.append('Podaj e-mail.')
+        elif availability.is_taken('email', email):
+            errors.append('Podany e-mail istnieje.')
 
         if errors:
             for error in errors:
@@ -178,11 +255,15 @@ class UserProfileUpdate(LoginRequiredMixin, View):
         user.last_name = last_name
         user.email = email
 
-        # User profile instance
-        user_profile = m.UserProfile.objects.all().filter(user=user).first()
-        user_profile.avatar = avatar
+        # Avatar variants are rendered in the background, see MyApp.avatars.
+        if avatar:
+            user_profile = m.UserProfile.objects.all().filter(user=user).first()
+            try:
+                avatars.accept_upload(user_profile, avatar)
+            except avatars.InvalidAvatar as error:
+                messages.add_message(request, messages.ERROR, str(error))
+                return redirect('user-profile-update')
 
-        user_profile.save()
         user.save()
         return redirect('user-profile')
 
@@ -190,14 +271,14 @@ class UserProfileUpdate(LoginRequiredMixin, View):
 class CreateDeliveryOfferView(LoginRequiredMixin, View):
     login_url = '{}?next={}'.format(settings.LOGIN_URL, 'delivery-offer-add')
 
+    @query_budget(7)
     def get(self, request):
 
-        # If user passed phrase into search bar, filter delivery offers.
-        if query := request.GET.get('search'):
-            return m.DeliveryOffer.set_search_cookie_redirect(query)
-
-        recent_added = m.DeliveryOffer.objects.all()[:3]
-        context = {'recent_added': recent_added}
+        recent_added = m.DeliveryOffer.objects.all().select_related('owner', 'delivery_info')[:3]
+        context = {
+            'recent_added': fragment_cache.with_versions(recent_added),
+            'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        }
         return render(request, 'MyApp/delivery-offer-add.html', context=context)
 
     def post(self, request):
@@ -250,14 +331,13 @@ class CreateDeliveryOfferView(LoginRequiredMixin, View):
 
 
 class DeliveryOfferDetailView(View):
+    @replica_reads
+    @query_budget(6)
     def get(self, request, delivery_id):
 
-        # If user passed phrase into search bar, filter delivery offers.
-        if query := request.GET.get('search'):
-            return m.DeliveryOffer.set_search_cookie_redirect(query)
-
-        delivery_offer = m.DeliveryOffer.objects.get(pk=delivery_id)
-        bids = delivery_offer.userbid_set.all()
+        delivery_offer = m.DeliveryOffer.objects.select_related(
+            'owner', 'contractor', 'delivery_info').get(pk=delivery_id)
+        bids = delivery_offer.userbid_set.all().select_related('owner')
 
         context = {
             'delivery_offer': delivery_offer,
@@ -269,15 +349,12 @@ class DeliveryOfferDetailView(View):
 
     def post(self, request, delivery_id):
         data = request.POST
-        delivery_offer = m.DeliveryOffer.objects.get(pk=delivery_id)
 
-        user_bid = m.UserBid.objects.all().filter(pk=data.get('final_bid')).first()
-        if user_bid and delivery_offer.is_active:
-            delivery_offer.get_instance_update(
-                contractor_id=user_bid.owner_id,
-                is_active=0,
-                final_bid=user_bid.value
-            )
+        user_bid = m.UserBid.objects.select_related('delivery_offer').filter(
+            pk=data.get('final_bid'), delivery_offer_id=delivery_id).first() if data.get('final_bid') else None
+        if user_bid:
+            if not user_bid.delivery_offer.accept_bid(user_bid):
+                messages.add_message(request, messages.ERROR, 'Zlecenie zostało już zamknięte.')
             return redirect('user-delivery-offers')
 
         bid = data.get('bid')
@@ -286,26 +363,22 @@ class DeliveryOfferDetailView(View):
             for error in errors:
                 messages.add_message(request, messages.ERROR, error)
                 return redirect(
-                    'delivery-offer-detail', delivery_id=delivery_offer.pk)
+                    'delivery-offer-detail', delivery_id=delivery_id)
 
-        m.UserBid.objects.create(
-            owner=request.user,
-            value=bid,
-            delivery_offer=delivery_offer
-        )
-        return redirect('delivery-offer-detail', delivery_id=delivery_offer.pk)
+        # The offer is not loaded, bids only reference it by id.
+        if not bids.place_bid(delivery_id, request.user, bid):
+            messages.add_message(request, messages.ERROR, 'Zlecenie zostało już zamknięte.')
+        return redirect('delivery-offer-detail', delivery_id=delivery_id)
 
 
 class DeliveryOfferModifyView(LoginRequiredMixin, View):
     login_url = '{}?next={}'.format(settings.LOGIN_URL, 'delivery-offer-modify')
 
+    @query_budget(5)
     def get(self, request, delivery_id):
 
-        # If user passed phrase into search bar, filter delivery offers.
-        if query := request.GET.get('search'):
-            return m.DeliveryOffer.set_search_cookie_redirect(query)
-
-        delivery_offer = m.DeliveryOffer.objects.get(pk=delivery_id)
+        delivery_offer = m.DeliveryOffer.objects.select_related(
+            'owner', 'delivery_info').get(pk=delivery_id)
         context = {'delivery_offer': delivery_offer}
 
         # Do not allow to edit proceeded offer.
@@ -390,6 +463,105 @@ class DeliveryOfferDeleteView(LoginRequiredMixin, View):
         return redirect('dashboard')
 
 
+class DeliveryOfferImportView(LoginRequiredMixin, View):
+    login_url = '{}?next={}'.format(settings.LOGIN_URL, 'delivery-offers-import')
+
+    def post(self, request):
+        import_format = request.GET.get('format', 'csv')
+        if import_format not in bulk_offers.FORMATS:
+            return JsonResponse({'error': 'Nieobsługiwany format.'}, status=400)
+
+        # The body is read line by line, never loaded into memory at once.
+        lines = codecs.iterdecode(request, 'utf-8', errors='replace')
+        result = bulk_offers.import_offers(bulk_offers.read_rows(lines, import_format), request.user)
+        return JsonResponse({'created': result.created, 'errors': result.errors},
+                            status=201 if result.created else 400)
+
+
+class DeliveryOfferExportView(LoginRequiredMixin, View):
+    login_url = '{}?next={}'.format(settings.LOGIN_URL, 'delivery-offers-export')
+
+    def get(self, request):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in bulk_offers.FORMATS:
+            return JsonResponse({'error': 'Nieobsługiwany format.'}, status=400)
+
+        delivery_offers = m.DeliveryOffer.objects.filter(owner=request.user)
+        response = StreamingHttpResponse(
+            bulk_offers.export_rows(delivery_offers, export_format),
+            content_type='text/csv' if export_format == 'csv' else 'application/x-ndjson',
+        )
+        response['Content-Disposition'] = f'attachment; filename="delivery-offers.{export_format}"'
+        return response
+
+
+class OfferListApiView(View):
+    @replica_reads
+    @query_budget(3)
+    def get(self, request):
+        delivery_offers = m.DeliveryOffer.objects.filter(is_active=1)
+        ordering = ('-date_added', '-pk')
+        if query := request.GET.get('search'):
+            delivery_offers = search.cached_search(delivery_offers, query)
+            ordering = search.SEARCH_ORDERING
+
+        # Only page keys are loaded until the client copy is known to be stale.
+        page = KeysetPaginator(delivery_offers.only('pk', 'date_added', 'updated_at'),
+                               settings.DELIVERY_OFFERS_PER_PAGE, ordering).page(request.GET.get('cursor'))
+        versions = [(delivery_offer.pk, delivery_offer.updated_at) for delivery_offer in page]
+        etag = api.compute_etag('offers', versions, page.has_next, page.has_previous)
+        last_modified = max((updated_at for _, updated_at in versions), default=None)
+        if response := api.not_modified(request, etag, last_modified):
+            return response
+
+        pks = [pk for pk, _ in versions]
+        offers = {
+            offer['id']: offer
+            for offer in api.serialize(m.DeliveryOffer.objects.filter(pk__in=pks), api.OFFER_LIST_FIELDS)
+        }
+        return api.json_response({
+            'offers': [offers[pk] for pk in pks if pk in offers],
+            'next_cursor': page.next_cursor,
+            'previous_cursor': page.previous_cursor,
+        }, etag, last_modified)
+
+
+class OfferDetailApiView(View):
+    @replica_reads
+    @query_budget(2)
+    def get(self, request, delivery_id):
+        delivery_offers = m.DeliveryOffer.objects.filter(pk=delivery_id)
+        updated_at = delivery_offers.values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return JsonResponse({'error': 'Nie znaleziono zlecenia.'}, status=404)
+
+        etag = api.compute_etag('offer', delivery_id, updated_at)
+        if response := api.not_modified(request, etag, updated_at):
+            return response
+
+        offer = api.serialize(delivery_offers, api.OFFER_DETAIL_FIELDS)
+        if not offer:
+            return JsonResponse({'error': 'Nie znaleziono zlecenia.'}, status=404)
+        return api.json_response({'offer': offer[0]}, etag, updated_at)
+
+
+class OfferBidsApiView(View):
+    @replica_reads
+    @query_budget(2)
+    def get(self, request, delivery_id):
+        # Bids bump the offer updated_at, it versions the bid list as well.
+        updated_at = m.DeliveryOffer.objects.filter(pk=delivery_id).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return JsonResponse({'error': 'Nie znaleziono zlecenia.'}, status=404)
+
+        etag = api.compute_etag('bids', delivery_id, updated_at)
+        if response := api.not_modified(request, etag, updated_at):
+            return response
+
+        bids = m.UserBid.objects.filter(delivery_offer_id=delivery_id).order_by('pk')
+        return api.json_response({'bids': api.serialize(bids, api.BID_FIELDS)}, etag, updated_at)
+
+
 class NotificationDeleteView(View):
     def get(self, request, notification_id):
         notification = m.Notification.objects.get(pk=notification_id)
@@ -401,19 +573,59 @@ class NotificationDeleteView(View):
         return redirect('dashboard')
 
 
-class UserDeliveryOffer(View):
+class NotificationFeedView(LoginRequiredMixin, View):
+    login_url = '{}?next={}'.format(settings.LOGIN_URL, 'user-notifications')
+
     def get(self, request):
+        page = m.Notification.feed_page(request.user, request.GET.get('cursor'))
+        notifications = [
+            {
+                'id': notification.pk,
+                'title': notification.title,
+                'is_read': notification.is_read,
+                'delete_url': reverse('user-notification-delete', args=[notification.pk]),
+            }
+            for notification in page
+        ]
+        return JsonResponse({
+            'unread': request.user.unread_notifications,
+            'notifications': notifications,
+            'next_cursor': page.next_cursor,
+        })
+
+
+class NotificationMarkReadView(LoginRequiredMixin, View):
+    login_url = '{}?next={}'.format(settings.LOGIN_URL, 'dashboard')
 
-        # If user passed phrase into search bar, filter delivery offers.
-        if query := request.GET.get('search'):
-            return m.DeliveryOffer.set_search_cookie_redirect(query)
+    def post(self, request):
+        with transaction.atomic():
+            marked = request.user.notification_set.filter(is_read=False).update(is_read=True)
+            # Notifications committed meanwhile stay unread and counted.
+            m.User.add_unread_notifications({request.user.pk: -marked})
+
+        next_url = request.POST.get('next')
+        if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()},
+                                               require_https=request.is_secure()):
+            next_url = 'dashboard'
+        return redirect(next_url)
+
+
+class UserDeliveryOffer(View):
+    @replica_reads
+    @query_budget(5)
+    def get(self, request):
 
         delivery_offers = m.DeliveryOffer.objects.all().filter(
             Q(owner=request.user) | Q(contractor=request.user),
             Q(is_active=1) | Q(is_active=0)
-        ).order_by('-date_added')
+        ).select_related('owner', 'delivery_info')
+        page = KeysetPaginator(delivery_offers,
+                               settings.DELIVERY_OFFERS_PER_PAGE).page(request.GET.get('cursor'))
 
-        context = {'delivery_offers': delivery_offers}
+        context = {
+            'delivery_offers': page,
+            'page': page
+        }
         return render(request,
                       'MyApp/user-delivery-offers.html',
                       context=context
@@ -421,42 +633,89 @@ class UserDeliveryOffer(View):
 
 
 class UserSendMessageView(View):
+    @query_budget(6)
     def get(self, request, delivery_id):
 
-        # If user passed phrase into search bar, filter delivery offers.
-        if query := request.GET.get('search'):
-            return m.DeliveryOffer.set_search_cookie_redirect(query)
-
-        delivery_offer = m.DeliveryOffer.objects.get(pk=delivery_id)
+        delivery_offer = m.DeliveryOffer.objects.select_related(
+            'owner', 'contractor').get(pk=delivery_id)
 
         if request.user != delivery_offer.owner and request.user != delivery_offer.contractor:
             return HttpResponse('<h2>Not allowed</h2>')
 
-        all_messages = delivery_offer.message_set.all().order_by('-date')
-        context = {'all_messages': all_messages}
+        # Only the newest messages, older ones are loaded page by page.
+        all_messages = chat.history_page(delivery_offer.pk)
+        context = {
+            'all_messages': all_messages,
+            'delivery_offer': delivery_offer,
+            'last_message_id': max((message.pk for message in all_messages), default=0)
+        }
         return render(request, 'MyApp/user-send-message.html', context=context)
 
     def post(self, request, delivery_id):
-        delivery_offer = m.DeliveryOffer.objects.get(pk=delivery_id)
-
-        user = (
-            delivery_offer.owner if request.user != delivery_offer.owner else
-            delivery_offer.contractor
-        )
+        delivery_offer = chat.get_chat_offer(request.user, delivery_id)
+        if not delivery_offer:
+            return HttpResponseForbidden()
 
         content = request.POST.get('content')
-        m.Message.objects.create(content=content,
-                                 delivery_offer=delivery_offer,
-                                 message_from=request.user,
-                                 message_to=user)
+        chat.send_message(delivery_offer, request.user, content)
 
         return redirect('user-send-message', delivery_id=delivery_offer.pk)
 
 
-class Http405View(View):
+# Function based, class based views can not be async in Django 4.0.
+async def chat_messages_view(request, delivery_id):
+    """
+    Chat messages newer than ?after=<message id>, JSON.
+
+    ?cursor=<history cursor> returns the next page of older messages instead.
+    With ?wait=1 it is a long poll, answering as soon as a new message is
+    written or after CHAT_LONG_POLL_TIMEOUT seconds. POST writes a message.
+    Fallback for clients which can not use the chat WebSocket.
+    """
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    delivery_offer = await sync_to_async(chat.get_chat_offer)(user, delivery_id) if user else None
+    if not delivery_offer:
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+
+    if request.method == 'POST':
+        content = request.POST.get('content', '').strip()
+        if not content:
+            return JsonResponse({'error': 'Podaj treść wiadomości.'}, status=400)
+        message = await sync_to_async(chat.send_message)(delivery_offer, user, content)
+        return JsonResponse({'message': chat.serialize_message(message)}, status=201)
+
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    # Older history page.
+    if cursor := request.GET.get('cursor'):
+        page = await sync_to_async(chat.history_page)(delivery_offer.pk, cursor)
+        return JsonResponse({
+            'messages': [chat.serialize_message(message) for message in page],
+            'next_cursor': page.next_cursor,
+        })
+
+    try:
+        after_id = int(request.GET.get('after') or 0)
+    except ValueError:
+        after_id = 0
+
+    if request.GET.get('wait'):
+        messages = await chat.wait_for_messages(delivery_offer.pk, after_id, settings.CHAT_LONG_POLL_TIMEOUT)
+    else:
+        messages = await sync_to_async(chat.messages_after)(delivery_offer.pk, after_id)
+    return JsonResponse({'messages': messages})
+
+
+class MetricsView(View):
     def get(self, request):
-        # If user passed phrase into search bar, filter delivery offers.
-        if query := request.GET.get('search'):
-            return m.DeliveryOffer.set_search_cookie_redirect(query)
+        # Scraped by a local Prometheus, see MyApp.metrics.
+        if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(metrics.collect()),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
 
+
+class Http405View(View):
+    def get(self, request):
         return render(request, 'MyApp/http_errors/http_405.html')
@@ -2,6 +2,7 @@
 ASGI config for MyProject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP is served by Django, WebSocket connections by MyApp.chat.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -9,8 +10,24 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MyProject.settings')
 
-application = get_asgi_application()
+# Like get_asgi_application, with streaming responses produced off the event loop.
+django.setup(set_prefix=False)
+
+from MyApp.handlers import ASGIHandler  # noqa: E402
+
+django_application = ASGIHandler()
+
+# Apps have to be loaded before importing models.
+from MyApp.chat import ChatWebSocketApp  # noqa: E402
+
+websocket_application = ChatWebSocketApp()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -44,11 +44,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'MyApp.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'MyApp.staticfiles.StaticFilesMiddleware',
+    'MyApp.db.PrimaryPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Needs request.user, profiles the rest of the chain and the view.
+    'MyApp.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -57,7 +62,9 @@ ROOT_URLCONF = 'MyProject.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates timing renders for MyApp.metrics.
+        'BACKEND': 'MyApp.metrics.DjangoTemplates',
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -86,9 +93,32 @@ DATABASES = {
         'PASSWORD': 'random_pass',
         'HOST': 'localhost',
         'PORT': '5432',
-    }
+        # Persistent connections, checked before each request reuses them.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Read replicas are listed in DATABASE_REPLICAS, e.g.
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql_psycopg2',
+    #     'NAME': 'exam',
+    #     'USER': 'postgres',
+    #     'PASSWORD': 'random_pass',
+    #     'HOST': 'replica.localhost',
+    #     'PORT': '5432',
+    #     'CONN_MAX_AGE': 60,
+    #     'CONN_HEALTH_CHECKS': True,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
 }
 
+DATABASE_ROUTERS = ['MyApp.db.ReplicaRouter']
+
+# Aliases of DATABASES serving reads of listing, search and detail views.
+DATABASE_REPLICAS = []
+
+# Seconds a client reads from the primary after it wrote, covering replication lag.
+REPLICA_PIN_SECONDS = 10
+
 # sqlite
 # 'ENGINE': 'django.db.backends.sqlite3',
 #         'NAME': os.path.join(BASE_DIR, 'database.sqlite3'),
@@ -113,6 +143,25 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# MyApp.passwords.PBKDF2PasswordHasher replaces Django's pbkdf2_sha256 hasher,
+# with the cost taken from PASSWORD_HASH_ITERATIONS.
+PASSWORD_HASHERS = [
+    'MyApp.passwords.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 iterations of new hashes, existing ones are rehashed on login.
+PASSWORD_HASH_ITERATIONS = 320000
+
+# Threads hashing passwords for login and registration, see MyApp.passwords.
+PASSWORD_HASHING_WORKERS = 4
+
+# Seconds before the filter of taken usernames and emails is reloaded, see MyApp.availability.
+AVAILABILITY_FILTER_MAX_AGE = 300
+
 # Custom validators.
 LOGIN_EMAIL_VALIDATORS = [
     {
@@ -144,6 +193,13 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# collectstatic writes hashed names plus gzip/brotli variants here, they are
+# served by MyApp.staticfiles.StaticFilesMiddleware. Hashed names are cached
+# forever, other files for STATIC_MAX_AGE seconds.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_STORAGE = 'MyApp.staticfiles.CompressedManifestStaticFilesStorage'
+STATIC_MAX_AGE = 60 * 60
+
 STATICFILES_DIRS = [
     BASE_DIR / "static/MyApp/",
     BASE_DIR / "static/files/"
@@ -156,6 +212,67 @@ LOGIN_URL = '/login/'
 MEDIA_URL = '/files/'
 MEDIA_ROOT = BASE_DIR / 'static/files/'
 
+# What to do when a view runs more SQL queries than its query_budget:
+# 'raise', 'log' or None to turn the check off.
+QUERY_BUDGET_MODE = 'log' if DEBUG else None
+
+# Request metrics served on /metrics, see MyApp.metrics. With several worker
+# processes (gunicorn) METRICS_DIR has to be set to a directory shared by them,
+# each worker writes its counters there at most every METRICS_FLUSH_INTERVAL seconds.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
+# Client addresses allowed to read /metrics.
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# Upper bounds of the latency (seconds) and response size (bytes) histogram buckets.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024)
+
+# Staff can profile a request with ?profile=sample|cprofile or an X-Profile
+# header, see MyApp.profiling. Reports are also stored in PROFILING_DIR if set.
+PROFILING_ENABLED = True
+PROFILING_DIR = None
+# Seconds between stack samples, the GIL switch interval (5 ms) bounds the real rate.
+PROFILING_SAMPLE_INTERVAL = 0.001
+# Functions listed in cProfile reports.
+PROFILING_STATS_LIMIT = 50
+
+# Delivery offers listing page size.
+DELIVERY_OFFERS_PER_PAGE = 20
+
+# Dashboard pickup radius filter choices and default, in km.
+DELIVERY_OFFER_RADIUS_CHOICES = (5, 15, 50, 100)
+DELIVERY_OFFER_DEFAULT_RADIUS = 15
+
+# Notification feed page size.
+NOTIFICATIONS_PER_PAGE = 10
+
+# Chat: long poll / WebSocket push timeout and polling interval for
+# messages written by other processes, in seconds.
+CHAT_LONG_POLL_TIMEOUT = 25
+CHAT_POLL_INTERVAL = 2
+
+# Chat messages rendered at once, older ones are loaded page by page.
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# Rendered offer cards and their version counters, see MyApp.fragment_cache.
+# Production has to use a cache shared by all processes (Memcached, Redis),
+# with locmem a process would not see versions bumped by the other ones.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# Searched queries whose matching offer ids each process keeps, see
+# MyApp.search.cached_search. Queries matching more offers are not cached.
+SEARCH_RESULT_CACHE_SIZE = 256
+SEARCH_RESULT_CACHE_MAX_IDS = 5000
+
+# Avatar uploads: size limit in bytes and background processing threads.
+AVATAR_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+AVATAR_WORKERS = 2
+
 # Setting User model.
 AUTH_USER_MODEL = 'MyApp.User'
 
@@ -24,10 +24,12 @@ from MyApp import views as v
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', v.IndexView.as_view(), name="index"),
-    path('login/', v.LoginView.as_view(), name="login"),
+    path('login/', v.login_view, name="login"),
     path('logout/', v.LogoutView.as_view(), name="logout"),
-    path('register/', v.RegisterView.as_view(), name="register"),
+    path('register/', v.register_view, name="register"),
+    path('register/availability/', v.AvailabilityView.as_view(), name="register-availability"),
     path('dashboard/', include('MyApp.urls')),
+    path('metrics', v.MetricsView.as_view(), name="metrics"),
 ]
 
 # Set path for uploaded files.